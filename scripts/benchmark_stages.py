@@ -0,0 +1,320 @@
+#Benchmark of the stages of the scripts: time, throughput and peak memory of every phase, compared with a baseline.
+#
+#Every stage is one of the scripts run the way it runs in production, from its command line in a fresh process, on
+#synthetic data. bio.tools pages and FASTA downloads come from a local stub server (with a fixed delay per request), so
+#the network phases are measured without depending on the network. Each script writes its run report (--report, see
+#instrumentation.py); a stage is run --rounds times and the median of every number is kept. Every round starts cold:
+#new output directory, empty download cache, no abundance or protein set cache.
+#
+#The results can be saved with --output and used as the --baseline of a later run. A stage or phase that got slower by
+#more than --time-tolerance, or whose peak memory grew by more than --memory-tolerance, is a regression: it is listed
+#and the exit code is 1. Phases shorter than --min-seconds in the baseline are too noisy to compare and only shown.
+#Run: python scripts/benchmark_stages.py --output baseline.json   then after a change
+#     python scripts/benchmark_stages.py --baseline baseline.json
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+for subdir in ("biotools", "other"):
+    if str(SCRIPTS_DIR / subdir) not in sys.path:
+        sys.path.insert(0, str(SCRIPTS_DIR / subdir))
+
+import benchmark_formats
+import benchmark_ssgsea_permutations
+import fetch_biotools
+import json2tsv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+#Size of the synthetic data at --scale 1
+SIZES = {"tools": 3000, "tables": 4, "proteome": 20000, "contaminants": 120, "proteins": 5000, "samples": 16,
+         "sets": 300}
+
+#Local stand-in for the bio.tools API (/api/tool/?page=&page_size=) and for file downloads (/files/<name>)
+#Every request waits latency seconds first, like a round trip to a real server
+class StubServer:
+    def __init__(self, tools, files_dir, latency=0.01):
+        self.tools = tools
+        self.files_dir = Path(files_dir)
+        self.latency = latency
+        self.pages = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    #Pages are serialised once, so the server's own work stays out of the fetch timings after the first round
+    def page(self, page, size):
+        with self.lock:
+            if (page, size) not in self.pages:
+                self.pages[page, size] = json.dumps({"count": len(self.tools),
+                                                     "list": self.tools[(page - 1) * size:page * size]}).encode()
+            return self.pages[page, size]
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(stub.latency)
+                url = urlparse(self.path)
+                if url.path.startswith("/files/"):
+                    path = stub.files_dir / Path(url.path).name
+                    if not path.is_file():
+                        self.send_error(404)
+                        return
+                    body, content_type = path.read_bytes(), "text/plain"
+                elif url.path.startswith("/api/tool"):
+                    query = parse_qs(url.query)
+                    page, size = int(query.get("page", ["1"])[0]), int(query.get("page_size", ["10"])[0])
+                    # bio.tools answers 404 past the last page
+                    if page > 1 and (page - 1) * size >= len(stub.tools):
+                        self.send_error(404)
+                        return
+                    body, content_type = stub.page(page, size), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def write_fasta(path, rng, n_proteins, prefix, mean_length=400):
+    with open(path, "w") as f:
+        for i in range(n_proteins):
+            sequence = "".join(rng.choices(AMINO_ACIDS, k=max(20, int(rng.gauss(mean_length, mean_length / 4)))))
+            f.write(f">{prefix}|{prefix[:1].upper()}{i:05d}|PROT{i}_SYNTH Synthetic protein {i}\n")
+            for start in range(0, len(sequence), 60):
+                f.write(sequence[start:start + 60] + "\n")
+
+#Writes the synthetic inputs of every stage to fixtures_dir, returns the raw bio.tools entries served by the stub
+def make_fixtures(fixtures_dir, scale=1.0, seed=0):
+    fixtures_dir = Path(fixtures_dir)
+    sizes = {name: max(1, int(size * scale)) for name, size in SIZES.items()}
+    rng = random.Random(seed)
+
+    # bio.tools: the raw API entries, the same tools as fetch_biotools.py output, and json2tsv.py tables of them
+    tools = [benchmark_formats.synthetic_tool(rng, i) for i in range(sizes["tools"])]
+    fetched = [fetch_biotools.filter_tool(tool) for tool in tools]
+    fetch_biotools.save_to_file(fetched, fixtures_dir / "tools.json")
+    (fixtures_dir / "tables").mkdir()
+    per_table = -(-len(fetched) // sizes["tables"])
+    for t in range(sizes["tables"]):
+        part = fixtures_dir / f"part_{t}.json"
+        fetch_biotools.save_to_file(fetched[t * per_table:(t + 1) * per_table], part)
+        json2tsv.json_to_tsv_streaming(part, fixtures_dir / "tables" / f"query_{t}.tsv")
+        part.unlink()
+
+    # Database preparation: a proteome and a contaminant FASTA file, downloaded from the stub
+    (fixtures_dir / "files").mkdir()
+    write_fasta(fixtures_dir / "files" / "proteome.fasta", rng, sizes["proteome"], "sp")
+    write_fasta(fixtures_dir / "files" / "crap.fasta", rng, sizes["contaminants"], "crap")
+
+    # ssGSEA: an abundance matrix and protein sets of its proteins
+    abundance_df, gene_sets = benchmark_ssgsea_permutations.synthetic_data(sizes["proteins"], sizes["samples"],
+                                                                           sizes["sets"], seed)
+    abundance_df.to_csv(fixtures_dir / "abundance.tsv", sep="\t")
+    with open(fixtures_dir / "sets.gmt", "w") as f:
+        for name, members in gene_sets.items():
+            f.write("\t".join([name, "synthetic"] + list(members)) + "\n")
+    return tools, sizes
+
+#The stages: the command line of a script (without --report), run in out_dir, and the file it has to write
+#Inputs that get a cache next to them are copied into out_dir first, so every round starts without one
+def stage_command(stage, fixtures_dir, out_dir, url):
+    if stage == "fetch_biotools":
+        return [SCRIPTS_DIR / "biotools" / "fetch_biotools.py", "benchmark", out_dir / "fetched.json",
+                "--url", f"{url}/api/tool/", "--page-size", "100", "--workers", "4"], out_dir / "fetched.json"
+    if stage == "json2tsv":
+        return [SCRIPTS_DIR / "biotools" / "json2tsv.py", fixtures_dir / "tools.json", out_dir / "tools.tsv",
+                "--stream"], out_dir / "tools.tsv"
+    if stage == "json2tsv_pandas":
+        return [SCRIPTS_DIR / "biotools" / "json2tsv.py", fixtures_dir / "tools.json", out_dir / "tools.tsv"], \
+            out_dir / "tools.tsv"
+    if stage == "combine_tsv":
+        return [SCRIPTS_DIR / "biotools" / "combine_tsv.py", fixtures_dir / "tables", out_dir / "combined.tsv",
+                "--include-source", "--stream", "--workers", "2"], out_dir / "combined.tsv"
+    if stage == "add_contams":
+        return [SCRIPTS_DIR / "other" / "add_contams.py", "--fasta-url", f"{url}/files/proteome.fasta",
+                "--crap-url", f"{url}/files/crap.fasta", "--output", out_dir / "HRP_contams.fasta"], \
+            out_dir / "HRP_contams.fasta"
+    if stage == "ssgsea":
+        for name in ("abundance.tsv", "sets.gmt"):
+            shutil.copy(fixtures_dir / name, out_dir / name)
+        return [SCRIPTS_DIR / "other" / "ssgsea.py", "--abundance", out_dir / "abundance.tsv", "--gene-sets",
+                out_dir / "sets.gmt", "--output", out_dir / "ssgsea.tsv", "--no-cache"], out_dir / "ssgsea.tsv"
+    raise ValueError(f"Unknown stage: {stage}")
+
+STAGES = ["fetch_biotools", "json2tsv", "json2tsv_pandas", "combine_tsv", "add_contams", "ssgsea"]
+
+#Runs a stage once in a fresh process, returns its run report with the wall time of the whole process added
+def run_stage(stage, fixtures_dir, work_dir, url):
+    out_dir = Path(tempfile.mkdtemp(prefix=f"{stage}_", dir=work_dir))
+    command, output = stage_command(stage, fixtures_dir, out_dir, url)
+    report_path = out_dir / "report.json"
+    # The download cache of cached_download.py is kept in the round's directory, so every download is a real one
+    env = {**os.environ, "REPROTEOMICS_CACHE": str(out_dir / "download_cache")}
+    start = time.perf_counter()
+    finished = subprocess.run([sys.executable, *map(str, command), "--report", str(report_path)], cwd=out_dir, env=env,
+                              capture_output=True, text=True)
+    process_seconds = time.perf_counter() - start
+    if finished.returncode != 0 or not report_path.exists() or not Path(output).exists():
+        raise RuntimeError(f"{stage} failed (exit code {finished.returncode}): {finished.stderr.strip()[-2000:]}")
+    with open(report_path) as f:
+        report = json.load(f)
+    shutil.rmtree(out_dir)
+    report["process_seconds"] = process_seconds
+    return report
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+#Median over the rounds of the numbers of a stage and of each of its phases
+def summarize(reports):
+    summary = {"rounds": len(reports), "seconds": median(r["seconds"] for r in reports),
+               "process_seconds": median(r["process_seconds"] for r in reports),
+               "peak_rss_bytes": median(r["peak_rss_bytes"] for r in reports), "phases": {}}
+    for name in sorted({name for r in reports for name in r["phases"]}):
+        phases = [r["phases"][name] for r in reports if name in r["phases"]]
+        summary["phases"][name] = {key: median(phase.get(key) for phase in phases)
+                                   for key in ("seconds", "items", "items_per_second", "peak_rss_bytes")}
+    return summary
+
+#Compares the results with a baseline, returns the list of regressions as text
+def find_regressions(results, baseline, time_tolerance=0.2, memory_tolerance=0.2, min_seconds=0.05):
+    regressions = []
+
+    def compare(label, new, old):
+        if old.get("seconds") and new.get("seconds") and old["seconds"] >= min_seconds \
+                and new["seconds"] > old["seconds"] * (1 + time_tolerance):
+            regressions.append(f"{label}: {old['seconds']:.3f}s -> {new['seconds']:.3f}s "
+                               f"(+{100 * (new['seconds'] / old['seconds'] - 1):.0f}%)")
+        if old.get("peak_rss_bytes") and new.get("peak_rss_bytes") \
+                and new["peak_rss_bytes"] > old["peak_rss_bytes"] * (1 + memory_tolerance):
+            regressions.append(f"{label}: peak memory {old['peak_rss_bytes'] / 1e6:.0f} MB -> "
+                               f"{new['peak_rss_bytes'] / 1e6:.0f} MB")
+
+    for stage, new in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old is None:
+            continue
+        compare(stage, new, old)
+        for name, phase in new["phases"].items():
+            if name in old["phases"]:
+                compare(f"{stage} {name}", phase, old["phases"][name])
+    return regressions
+
+def megabytes(value):
+    return f"{value / 1e6:.0f}" if value else "-"
+
+#Prints the results, with the change against the baseline when there is one
+def print_results(results, baseline=None):
+    print(f"{'stage / phase':<34}{'seconds':>10}{'items/s':>14}{'peak MB':>10}{'vs baseline':>14}")
+    for stage, summary in results["stages"].items():
+        old = (baseline or {}).get("stages", {}).get(stage)
+        change = f"{100 * (summary['seconds'] / old['seconds'] - 1):+.0f}%" if old and old.get("seconds") else ""
+        print(f"{stage:<34}{summary['seconds']:>10.3f}{'':>14}{megabytes(summary['peak_rss_bytes']):>10}{change:>14}")
+        for name, phase in summary["phases"].items():
+            old_phase = old["phases"].get(name) if old else None
+            change = ""
+            if old_phase and old_phase.get("seconds"):
+                change = f"{100 * (phase['seconds'] / old_phase['seconds'] - 1):+.0f}%"
+            rate = f"{phase['items_per_second']:.0f}" if phase.get("items_per_second") else "-"
+            print(f"  {name:<32}{phase['seconds']:>10.3f}{rate:>14}{megabytes(phase['peak_rss_bytes']):>10}{change:>14}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the phases of the scripts on synthetic data and compare them with a baseline.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run (default: all).")
+    parser.add_argument("--rounds", type=int, default=3, help="Runs of every stage, the median is kept.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the synthetic data, relative to the default.")
+    parser.add_argument("--latency", type=float, default=0.01, help="Delay of the stub server per request, in seconds.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data.")
+    parser.add_argument("--output", type=str, default=None, help="Save the results to this JSON file (usable as a baseline).")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of an earlier run to compare with.")
+    parser.add_argument("--time-tolerance", type=float, default=0.2, help="Slowdown counted as a regression (0.2: 20%%).")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2, help="Peak memory growth counted as a regression.")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="Phases shorter than this in the baseline are not compared.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings", {}).get("scale") != args.scale:
+            logging.warning(f"The baseline was made with --scale {baseline.get('settings', {}).get('scale')}, "
+                            "the numbers are not comparable.")
+
+    results = {"settings": {"scale": args.scale, "latency": args.latency, "seed": args.seed, "rounds": args.rounds},
+               "stages": {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        fixtures_dir = Path(work_dir) / "fixtures"
+        fixtures_dir.mkdir()
+        # Making the fixtures logs every file written, which is noise here
+        logging.getLogger().setLevel(logging.ERROR)
+        tools, sizes = make_fixtures(fixtures_dir, args.scale, args.seed)
+        logging.getLogger().setLevel(logging.INFO)
+        results["settings"]["sizes"] = sizes
+
+        with StubServer(tools, fixtures_dir / "files", args.latency) as stub:
+            for stage in args.stages:
+                reports = []
+                for _ in range(args.rounds):
+                    try:
+                        reports.append(run_stage(stage, fixtures_dir, work_dir, stub.url))
+                    except RuntimeError as e:
+                        logging.error(str(e))
+                        break
+                if reports:
+                    results["stages"][stage] = summarize(reports)
+                    results["environment"] = {key: reports[0][key] for key in ("python", "platform", "cpus")}
+                    logging.info(f"{stage}: {results['stages'][stage]['seconds']:.3f}s")
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        logging.info(f"Results saved to {args.output}")
+
+    failed = [stage for stage in args.stages if stage not in results["stages"]]
+    regressions = find_regressions(results, baseline, args.time_tolerance, args.memory_tolerance,
+                                   args.min_seconds) if baseline else []
+    for regression in regressions:
+        logging.error(f"Regression: {regression}")
+    if failed:
+        logging.error(f"Stages that failed: {', '.join(failed)}")
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
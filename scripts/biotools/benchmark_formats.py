@@ -0,0 +1,116 @@
+import argparse
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import combine_tsv
+import fetch_biotools
+import json2tsv
+
+# Benchmark of the text chain (indented JSON -> TSV -> combined TSV) against the columnar chain
+# (Parquet -> Parquet -> combined Parquet) of fetch_biotools.py, json2tsv.py and combine_tsv.py.
+# The network is left out: both chains start from the same synthetic bio.tools API entries.
+
+WORDS = ("protein proteomics mass spectrometry quantification peptide identification workflow pipeline "
+         "label-free analysis data tool software statistical method spectra database search").split()
+
+# Function to make one synthetic entry shaped like a bio.tools API result
+def synthetic_tool(rng, i):
+    def text(n):
+        return " ".join(rng.choices(WORDS, k=n))
+    return {
+        "name": f"tool_{i}",
+        "homepage": f"https://github.com/example/tool_{i}",
+        "description": text(40),
+        # bio.tools lists every released version
+        "version": [f"{rng.randint(0, 5)}.{rng.randint(0, 20)}" for _ in range(rng.randint(0, 2))],
+        "toolType": rng.sample(["Command-line tool", "Library", "Web application", "Workflow"], k=rng.randint(1, 2)),
+        "topic": [{"term": term, "uri": f"http://edamontology.org/topic_{rng.randint(1, 4000)}"}
+                  for term in rng.sample(["Proteomics", "Mass spectrometry", "Bioinformatics", "Statistics"], k=2)],
+        "publication": [{"doi": f"10.1000/{i}.{j}", "metadata": {"title": text(12), "abstract": text(200)}}
+                        for j in range(rng.randint(0, 3))],
+        "documentation": [{"url": f"https://tool-{i}.readthedocs.io", "type": ["User manual"]}],
+        "operatingSystem": rng.sample(["Linux", "Mac", "Windows"], k=rng.randint(1, 3)),
+        "language": rng.sample(["Python", "R", "Java", "C++"], k=rng.randint(1, 2)),
+        "accessibility": "Open access",
+        "license": rng.choice(["GPL-3.0", "MIT", "Apache-2.0", "Proprietary"])
+    }
+
+def size_of(paths):
+    return sum(Path(path).stat().st_size for path in paths)
+
+# Function to run both chains on n_queries files of n_tools tools each, returns {chain: {stage: seconds}, ...}
+def run_benchmark(n_tools=5000, n_queries=4, seed=0):
+    rng = random.Random(seed)
+    queries = [[synthetic_tool(rng, q * n_tools + i) for i in range(n_tools)] for q in range(n_queries)]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for chain, suffix in (("text", None), ("columnar", ".parquet")):
+            chain_dir = tmp_dir / chain
+            (chain_dir / "tables").mkdir(parents=True)
+            timings = {}
+
+            start = time.perf_counter()
+            fetched = []
+            for q, tools in enumerate(queries):
+                if suffix:
+                    path = chain_dir / f"query_{q}.parquet"
+                    fetch_biotools.save_to_parquet([fetch_biotools.filter_tool(tool) for tool in tools], path)
+                else:
+                    path = chain_dir / f"query_{q}.json"
+                    fetch_biotools.save_to_file([fetch_biotools.filter_tool(tool) for tool in tools], path)
+                fetched.append(path)
+            timings["fetch output"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            tables = []
+            for path in fetched:
+                if suffix:
+                    table = chain_dir / "tables" / f"{path.stem}.parquet"
+                    json2tsv.json_to_parquet(path, table)
+                else:
+                    table = chain_dir / "tables" / f"{path.stem}.tsv"
+                    json2tsv.json_to_dataframe(path, table)
+                tables.append(table)
+            timings["json2tsv"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            if suffix:
+                combined = chain_dir / "combined.parquet"
+                combine_tsv.combine_parquet(chain_dir / "tables", combined, include_source=True)
+            else:
+                combined = chain_dir / "combined.tsv"
+                combine_tsv.combine_tsv(chain_dir / "tables", include_source=True).to_csv(combined, sep='\t', index=False)
+            timings["combine_tsv"] = time.perf_counter() - start
+
+            timings["total"] = sum(timings.values())
+            results[chain] = {"seconds": timings, "bytes": {
+                "fetch output": size_of(fetched), "json2tsv": size_of(tables), "combine_tsv": size_of([combined])}}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the text and the columnar (Parquet) bio.tools chain.')
+    parser.add_argument('--tools', type=int, default=5000, help='Number of tools per query file.')
+    parser.add_argument('--queries', type=int, default=4, help='Number of query files.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    args = parser.parse_args()
+
+    # The stages log every file they write and every tool without publications, which is noise here
+    logging.getLogger().setLevel(logging.ERROR)
+    results = run_benchmark(args.tools, args.queries, args.seed)
+
+    print(f"{args.queries} query files x {args.tools} tools")
+    print(f"{'stage':<14}{'text (s)':>10}{'columnar (s)':>14}{'text (MB)':>11}{'columnar (MB)':>15}")
+    for stage in ("fetch output", "json2tsv", "combine_tsv", "total"):
+        text, columnar = results["text"], results["columnar"]
+        sizes = ""
+        if stage in text["bytes"]:
+            sizes = f"{text['bytes'][stage] / 1e6:>11.1f}{columnar['bytes'][stage] / 1e6:>15.1f}"
+        print(f"{stage:<14}{text['seconds'][stage]:>10.2f}{columnar['seconds'][stage]:>14.2f}{sizes}")
+
+if __name__ == "__main__":
+    main()
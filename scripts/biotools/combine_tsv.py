@@ -3,6 +3,26 @@ import pandas as pd  # Data manipulation
 import argparse  # Command-line arguments
 from pathlib import Path  # File path handling
 import logging  # Display messages 
+import hashlib  # Content hashes for the manifest
+import json  # Reading and writing the manifest
+import os  # Replacing files atomically
+import shutil  # Copying file contents
+import sys  # Finding instrumentation.py
+import tempfile  # Temporary directory for the per-file parts
+from concurrent.futures import ProcessPoolExecutor  # Reading files in parallel
+
+# Parquet output is optional, only needed when the output file ends with .parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Phase timings and the run report (scripts/instrumentation.py, shared with the scripts in other/)
+if str(Path(__file__).resolve().parent.parent) not in sys.path:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import instrumentation
 
 # Set up logging to display messages with timestamps and the level of importance
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,7 +49,9 @@ def combine_tsv(directory, include_source):
     for filepath in tsv_files:
         try:
             # Try to read the tsv file, skipping any lines that cause problems
-            df = pd.read_csv(filepath, sep='\t', on_bad_lines='skip')
+            with instrumentation.span("combine_tsv.parse") as phase:
+                df = pd.read_csv(filepath, sep='\t', on_bad_lines='skip')
+                phase.items = len(df)
 
             # If I want to add the source file name and the column doesn't already exist
             if include_source and "Source File" not in df.columns:
@@ -46,13 +68,461 @@ def combine_tsv(directory, include_source):
     # If there are any dataframes in the list (files found)
     if dataframes:
         # Combine all the dataframes into one large dataframe
-        combined_df = pd.concat(dataframes, ignore_index=True)
+        with instrumentation.span("combine_tsv.transform") as phase:
+            combined_df = pd.concat(dataframes, ignore_index=True)
+            phase.items = len(combined_df)
         return combined_df  # Return the combined dataframe
     else:
         # If no files were successfully read, log an error
         logging.error("No valid data to combine.")
         return None  # Stop the function and return nothing
 
+# This reads only the header line of a tsv file to get its column names
+def read_columns(filepath):
+    return list(pd.read_csv(filepath, sep='\t', nrows=0).columns)
+
+# This builds one column schema shared by all files (the union of their columns, in the order they first appear)
+def unify_columns(tsv_files, include_source):
+    columns = []
+    readable_files = []
+
+    for filepath in tsv_files:
+        try:
+            file_columns = read_columns(filepath)
+        except Exception as e:
+            logging.error(f"Error reading {filepath.name}: {e}")
+            continue
+
+        readable_files.append(filepath)
+        for column in file_columns:
+            if column not in columns:
+                columns.append(column)
+
+    # Same as the in-memory version, the source column goes at the start
+    if include_source and "Source File" not in columns:
+        columns.insert(0, "Source File")
+
+    return columns, readable_files
+
+# This builds the Arrow schema used for parquet output, every column is stored as a string
+def string_schema(columns):
+    return pa.schema([(column, pa.string()) for column in columns])
+
+# This converts one tsv file into a part file with the shared column schema, one chunk at a time
+# It runs in a worker process, so it only takes plain arguments and returns the number of rows written
+def write_part(filepath, part_path, columns, include_source, chunksize, output_format):
+    filepath = Path(filepath)
+    n_rows = 0
+    writer = None
+
+    # Read everything as text so values are written back exactly as they were (no 1 -> 1.0 conversions)
+    reader = pd.read_csv(filepath, sep='\t', on_bad_lines='skip', dtype=str, chunksize=chunksize)
+
+    with open(part_path, 'wb') as part:
+        for chunk in reader:
+            if include_source and "Source File" not in chunk.columns:
+                chunk.insert(0, "Source File", filepath.stem)
+
+            # Missing columns are added as empty, and all chunks get the same column order
+            chunk = chunk.reindex(columns=columns)
+
+            if output_format == "parquet":
+                table = pa.Table.from_pandas(chunk.astype(object), schema=string_schema(columns), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(part, table.schema)
+                writer.write_table(table)
+            else:
+                part.write(chunk.to_csv(sep='\t', index=False, header=False).encode())
+
+            n_rows += len(chunk)
+
+        if writer is not None:
+            writer.close()
+
+    return n_rows
+
+# This combines the tsv files without holding them all in memory
+# Files are converted in parallel into part files with a shared schema, which are then
+# appended to the output in sorted file order
+def combine_tsv_streaming(directory, output, include_source, workers=None, chunksize=100000):
+    directory = Path(directory)
+
+    # Check if the provided directory does exist
+    if not directory.exists():
+        logging.error(f"Directory {directory} does not exist.")
+        return False
+
+    # Sorted, so the output is the same on every run
+    tsv_files = sorted(directory.glob("*.tsv"))
+
+    if not tsv_files:
+        logging.warning(f"No tsv files found in directory {directory}.")
+        return False
+
+    return combine_tsv_files(tsv_files, output, include_source, workers, chunksize)
+
+# This combines exactly the given tsv files, in the given order, the same way as combine_tsv_streaming
+# (used by pipeline.py, whose tables can share a directory with other tsv files)
+def combine_tsv_files(tsv_files, output, include_source, workers=None, chunksize=100000):
+    tsv_files = [Path(filepath) for filepath in tsv_files]
+    output = Path(output)
+    output_format = "parquet" if output.suffix == ".parquet" else "tsv"
+
+    if output_format == "parquet" and pa is None:
+        logging.error("Parquet output needs the pyarrow package (pip install pyarrow).")
+        return False
+
+    missing = [str(filepath) for filepath in tsv_files if not filepath.exists()]
+    if missing:
+        logging.error(f"Files to combine do not exist: {', '.join(missing)}")
+        return False
+
+    if not tsv_files:
+        logging.warning("No tsv files to combine.")
+        return False
+
+    # Header-only pass to agree on the columns before any rows are read
+    columns, tsv_files = unify_columns(tsv_files, include_source)
+
+    if not tsv_files:
+        logging.error("No valid data to combine.")
+        return False
+
+    total_rows = 0
+
+    with tempfile.TemporaryDirectory(dir=output.parent) as tmp_dir:
+        part_paths = [Path(tmp_dir) / f"part_{i:05d}" for i in range(len(tsv_files))]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(write_part, filepath, part_path, columns, include_source, chunksize, output_format)
+                for filepath, part_path in zip(tsv_files, part_paths)
+            ]
+
+            tmp_output = Path(tmp_dir) / output.name
+            parquet_writer = None
+
+            with open(tmp_output, 'wb') as out:
+                if output_format == "tsv":
+                    out.write(pd.DataFrame(columns=columns).to_csv(sep='\t', index=False).encode())
+                else:
+                    parquet_writer = pq.ParquetWriter(out, string_schema(columns))
+
+                # Waiting on the futures in submission order keeps the sorted file order
+                # The workers parse and convert the files, so the parse phase is the time spent waiting for them
+                for filepath, part_path, future in zip(tsv_files, part_paths, futures):
+                    try:
+                        with instrumentation.span("combine_tsv.parse") as phase:
+                            phase.items = future.result()
+                        total_rows += phase.items
+                    except Exception as e:
+                        logging.error(f"Error reading {filepath.name}: {e}")
+                        continue
+
+                    with instrumentation.span("combine_tsv.write", phase.items):
+                        if output_format == "tsv":
+                            with open(part_path, 'rb') as part:
+                                shutil.copyfileobj(part, out)
+                        elif part_path.stat().st_size:
+                            part_file = pq.ParquetFile(part_path)
+                            for i in range(part_file.num_row_groups):
+                                parquet_writer.write_table(part_file.read_row_group(i))
+
+                    # Remove the part as soon as it is copied, so disk use stays low as well
+                    part_path.unlink()
+
+                if parquet_writer is not None:
+                    parquet_writer.close()
+
+        shutil.move(tmp_output, output)
+
+    logging.info(f"{total_rows} rows from {len(tsv_files)} files combined.")
+    return True
+
+# This combines the parquet files written by json2tsv.py without parsing any text
+# Row groups are copied over as Arrow tables, with missing columns added as empty and the columns of all
+# files in the same order. A .tsv output is only written at the end, as an export of the combined rows.
+def combine_parquet(directory, output, include_source):
+    directory = Path(directory)
+    output = Path(output)
+
+    if pa is None:
+        logging.error("Combining parquet files needs the pyarrow package (pip install pyarrow).")
+        return False
+
+    if not directory.exists():
+        logging.error(f"Directory {directory} does not exist.")
+        return False
+
+    parquet_files = sorted(directory.glob("*.parquet"))
+    if not parquet_files:
+        logging.warning(f"No parquet files found in directory {directory}.")
+        return False
+
+    # Schema-only pass to agree on the columns before any rows are read
+    columns = []
+    readable_files = []
+    for filepath in parquet_files:
+        try:
+            file_columns = pq.read_schema(filepath).names
+        except Exception as e:
+            logging.error(f"Error reading {filepath.name}: {e}")
+            continue
+        readable_files.append(filepath)
+        columns.extend(column for column in file_columns if column not in columns)
+    if include_source and "Source File" not in columns:
+        columns.insert(0, "Source File")
+    schema = string_schema(columns)
+
+    total_rows = 0
+    tmp_output = output.with_name(output.name + ".tmp")
+    writer = pq.ParquetWriter(tmp_output, schema) if output.suffix == ".parquet" else None
+    for filepath in readable_files:
+        parquet_file = pq.ParquetFile(filepath)
+        for i in range(parquet_file.num_row_groups):
+            with instrumentation.span("combine_tsv.parse", parquet_file.metadata.row_group(i).num_rows):
+                table = parquet_file.read_row_group(i)
+            with instrumentation.span("combine_tsv.transform", len(table)):
+                if include_source and "Source File" not in table.column_names:
+                    table = table.append_column("Source File", pa.array([filepath.stem] * len(table), pa.string()))
+                for column in columns:
+                    if column not in table.column_names:
+                        table = table.append_column(column, pa.nulls(len(table), pa.string()))
+                table = table.select(columns).cast(schema)
+
+            with instrumentation.span("combine_tsv.write", len(table)):
+                if writer is not None:
+                    writer.write_table(table)
+                else:
+                    table.to_pandas().to_csv(tmp_output, sep='\t', index=False, mode='a' if total_rows else 'w',
+                                             header=not total_rows)
+            total_rows += len(table)
+    if writer is not None:
+        writer.close()
+
+    if not total_rows:
+        tmp_output.unlink(missing_ok=True)
+        logging.error("No valid data to combine.")
+        return False
+
+    os.replace(tmp_output, output)
+    logging.info(f"{total_rows} rows from {len(readable_files)} files combined.")
+    return True
+
+# This computes the sha256 of a file without reading it into memory at once
+def file_hash(filepath, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# This loads the manifest written by a previous incremental run (or an empty one)
+def load_manifest(manifest_path, include_source):
+    empty = {"include_source": include_source, "files": {}}
+
+    if not manifest_path.exists():
+        return empty
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as e:
+        logging.warning(f"Could not read manifest {manifest_path}, rebuilding: {e}")
+        return empty
+
+    # Adding or removing the source column changes every cached file
+    if manifest.get("include_source") != include_source:
+        logging.info("--include-source changed since the last run, rebuilding.")
+        return empty
+
+    return manifest
+
+# This writes the manifest through a temporary file, so it is never left half written
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+# This checks a tsv file against its manifest entry
+# Size and modification time are checked first, the file is only hashed when they differ
+# A file that could not be read last time has no cached parquet file, only its entry with the error
+def is_unchanged(filepath, entry, cache_path):
+    if entry is None or ("error" not in entry and not cache_path.exists()):
+        return False
+
+    stat = filepath.stat()
+    if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+        return True
+
+    # Touched but not modified (e.g. copied again by the nightly refresh)
+    if stat.st_size == entry["size"] and file_hash(filepath) == entry["sha256"]:
+        entry["mtime"] = stat.st_mtime
+        return True
+
+    return False
+
+# This converts one tsv file into its cached parquet file with its own columns
+# It runs in a worker process and returns the manifest entry for the file
+def cache_file(filepath, cache_path, include_source, chunksize):
+    filepath = Path(filepath)
+    columns = read_columns(filepath)
+    if include_source and "Source File" not in columns:
+        columns.insert(0, "Source File")
+
+    stat = filepath.stat()
+    rows = write_part(filepath, cache_path, columns, include_source, chunksize, "parquet")
+
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": file_hash(filepath),
+        "rows": rows,
+        "cache": cache_path.name
+    }
+
+# This is the manifest entry of a tsv file that could not be read, so it is not read again (and its rows are
+# not in the output) until it changes
+def failed_entry(filepath, error):
+    stat = filepath.stat()
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": file_hash(filepath),
+        "rows": 0,
+        "cache": None,
+        "error": str(error)
+    }
+
+# This writes the combined output from the cached parquet files, one row group at a time
+def write_from_cache(cache_paths, output):
+    output = Path(output)
+    output_format = "parquet" if output.suffix == ".parquet" else "tsv"
+
+    # Shared column schema, read from the parquet metadata only
+    columns = []
+    for cache_path in cache_paths:
+        for column in pq.read_schema(cache_path).names:
+            if column not in columns:
+                columns.append(column)
+
+    tmp_output = output.with_name(output.name + '.tmp')
+    parquet_writer = None
+
+    with open(tmp_output, 'wb') as out:
+        if output_format == "tsv":
+            out.write(pd.DataFrame(columns=columns).to_csv(sep='\t', index=False).encode())
+        else:
+            parquet_writer = pq.ParquetWriter(out, string_schema(columns))
+
+        for cache_path in cache_paths:
+            part_file = pq.ParquetFile(cache_path)
+            for i in range(part_file.num_row_groups):
+                chunk = part_file.read_row_group(i).to_pandas().reindex(columns=columns)
+                if output_format == "tsv":
+                    out.write(chunk.to_csv(sep='\t', index=False, header=False).encode())
+                else:
+                    parquet_writer.write_table(pa.Table.from_pandas(chunk.astype(object), schema=string_schema(columns), preserve_index=False))
+
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    os.replace(tmp_output, output)
+
+# This updates the combined output, only reading the tsv files that are new or changed since the last run
+# Each tsv file is cached as parquet in the cache directory, and a manifest (path, size, mtime, hash,
+# row count) is kept next to the output to know which files changed
+def combine_tsv_incremental(directory, output, include_source, cache_dir=None, workers=None, chunksize=100000):
+    directory = Path(directory)
+    output = Path(output)
+
+    if pa is None:
+        logging.error("Incremental mode needs the pyarrow package (pip install pyarrow).")
+        return False
+
+    # Check if the provided directory does exist
+    if not directory.exists():
+        logging.error(f"Directory {directory} does not exist.")
+        return False
+
+    cache_dir = Path(cache_dir) if cache_dir else output.with_name(output.name + '.cache')
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output.with_name(output.name + '.manifest.json')
+    manifest = load_manifest(manifest_path, include_source)
+    old_files = manifest["files"]
+
+    # Sorted, so the output is the same on every run
+    tsv_files = sorted(directory.glob("*.tsv"))
+    if not tsv_files:
+        logging.warning(f"No tsv files found in directory {directory}.")
+        return False
+
+    new_files = {}
+    changed = []
+    for filepath in tsv_files:
+        key = str(filepath.resolve())
+        cache_path = cache_dir / f"{filepath.stem}.parquet"
+        if is_unchanged(filepath, old_files.get(key), cache_path):
+            new_files[key] = old_files[key]
+        else:
+            changed.append((key, filepath, cache_path))
+
+    # Files that were deleted since the last run, their cached rows are dropped
+    changed_keys = {key for key, _, _ in changed}
+    deleted = [key for key in old_files if key not in new_files and key not in changed_keys]
+    for key in deleted:
+        if old_files[key].get("cache"):
+            (cache_dir / old_files[key]["cache"]).unlink(missing_ok=True)
+
+    logging.info(f"{len(changed)} new or changed, {len(deleted)} deleted, {len(new_files)} unchanged tsv files.")
+    for key, entry in new_files.items():
+        if "error" in entry:
+            logging.error(f"Skipping {Path(key).name}, it could not be read and did not change since: {entry['error']}")
+
+    if not changed and not deleted and output.exists():
+        logging.info(f"{output} is up to date.")
+        save_manifest(manifest, manifest_path)
+        return True
+
+    # Only the new or changed files are parsed, in parallel
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (key, filepath, cache_path, executor.submit(cache_file, filepath, cache_path, include_source, chunksize))
+            for key, filepath, cache_path in changed
+        ]
+        # The workers parse the files into the cache, the parse phase is the time spent waiting for them
+        for key, filepath, cache_path, future in futures:
+            try:
+                with instrumentation.span("combine_tsv.parse") as phase:
+                    new_files[key] = future.result()
+                    phase.items = new_files[key]["rows"]
+            except Exception as e:
+                logging.error(f"Error reading {filepath.name}: {e}")
+                # Recorded in the manifest, so the file is reported on every run instead of silently missing
+                cache_path.unlink(missing_ok=True)
+                try:
+                    new_files[key] = failed_entry(filepath, e)
+                except OSError:
+                    pass
+
+    readable = [key for key, entry in new_files.items() if "error" not in entry]
+    if not readable:
+        logging.error("No valid data to combine.")
+        return False
+
+    # Keep the sorted file order in the output
+    cache_paths = [cache_dir / new_files[key]["cache"] for key in sorted(readable, key=lambda k: Path(k).name)]
+    with instrumentation.span("combine_tsv.write", sum(entry["rows"] for entry in new_files.values())):
+        write_from_cache(cache_paths, output)
+
+    manifest["files"] = new_files
+    save_manifest(manifest, manifest_path)
+
+    total_rows = sum(entry["rows"] for entry in new_files.values())
+    logging.info(f"{total_rows} rows from {len(readable)} files combined.")
+    return True
+
 # Main function to handle command-line arguments and run the script
 def main():
     # Set up the argument parser
@@ -66,17 +536,62 @@ def main():
     
     # Optional: to add source file name as a column
     parser.add_argument('--include-source', action='store_true', help='Include a column with the source file name.')
+
+    # Optional: combine in parallel, streaming chunks to the output instead of holding everything in memory
+    parser.add_argument('--stream', action='store_true', help='Read files in parallel and write the output chunk by chunk (an output ending in .parquet is written as Parquet).')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for --stream (default: number of CPUs).')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Number of rows read at a time with --stream or --incremental.')
+
+    # Optional: combine the parquet output of json2tsv.py instead of tsv files
+    parser.add_argument('--parquet', action='store_true', help='Combine the .parquet files of the directory without parsing text (the output can be .parquet or .tsv).')
+
+    # Optional: only re-read the files that changed since the last run
+    parser.add_argument('--incremental', action='store_true', help='Keep a manifest and a parquet cache next to the output and only re-read new or changed files.')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Directory for the per-file cache of --incremental (default: <output>.cache).')
+
+    # Optional: time the phases and save a run report
+    parser.add_argument('--report', type=str, default=None, help='Save the time and peak memory of each phase to this JSON file.')
     
     # Parse the provided arguments
     args = parser.parse_args()
 
+    if args.report:
+        instrumentation.start()
+    run_combine(args)
+    if args.report:
+        instrumentation.write_report(args.report, directory=args.directory, output=args.output)
+
+# This runs the mode chosen on the command line
+def run_combine(args):
+    if args.parquet:
+        if combine_parquet(args.directory, args.output, args.include_source):
+            logging.info(f"Combined table saved to {args.output}")
+        else:
+            logging.error("Failed to combine parquet files.")
+        return
+
+    if args.incremental:
+        if combine_tsv_incremental(args.directory, args.output, args.include_source, args.cache_dir, args.workers, args.chunksize):
+            logging.info(f"Combined tsv saved to {args.output}")
+        else:
+            logging.error("Failed to combine tsv files.")
+        return
+
+    if args.stream:
+        if combine_tsv_streaming(args.directory, args.output, args.include_source, args.workers, args.chunksize):
+            logging.info(f"Combined tsv saved to {args.output}")
+        else:
+            logging.error("Failed to combine tsv files.")
+        return
+
     # Call the arguments
     combined_df = combine_tsv(args.directory, args.include_source)
 
     # If combining was successful
     if combined_df is not None:
         # Save the combined dataframe to the specified output file
-        combined_df.to_csv(args.output, sep='\t', index=False)
+        with instrumentation.span("combine_tsv.write", len(combined_df)):
+            combined_df.to_csv(args.output, sep='\t', index=False)
         logging.info(f"Combined tsv saved to {args.output}")  # Log a message indicating success
     else:
         # If combining wasn't successful, log an error
@@ -1,39 +1,67 @@
 import requests
 import json
 import argparse
+import hashlib
 import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
+# Parquet output is optional, only needed when the output file ends with .parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Phase timings and the run report (scripts/instrumentation.py, shared with the scripts in other/)
+if str(Path(__file__).resolve().parent.parent) not in sys.path:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import instrumentation
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Function to extract topic terms (remove URI) and concatenate them into a single string
+BIOTOOLS_URL = "https://bio.tools/api/tool/"
+
+# HTTP status codes that are usually temporary and worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The fields with several values are kept as lists of records, and only turned into text (one row per
+# publication, topics joined with commas) when json2tsv.py makes the table. Formatting them as text here
+# meant splitting the text again later, which broke on titles and abstracts containing commas.
+
+# Function to extract the topic terms (without the URIs)
 def extract_topics(topics):
     if isinstance(topics, list):
-        return ', '.join(topic.get("term", "") for topic in topics if isinstance(topic, dict))
-    return topics
+        return [topic.get("term") or "" for topic in topics if isinstance(topic, dict)]
+    return []
 
-# Function to extract documentation URL
+# Function to extract the documentation URLs
 def extract_documentation(documentation):
     if isinstance(documentation, list):
-        for doc in documentation:
-            if isinstance(doc, dict):
-                return doc.get("url", "")
-    return ""
+        return [doc.get("url") or "" for doc in documentation if isinstance(doc, dict)]
+    return []
 
-# Function to extract publication details (DOI, title, and abstract) and format them
+# Function to extract publication details (DOI, title, and abstract) as records
 def extract_publications(publications):
+    records = []
     if isinstance(publications, list):
-        extracted = []
         for pub in publications:
             if isinstance(pub, dict):
-                doi = pub.get("doi", "")
-                metadata = pub.get("metadata", {})
-                title = metadata.get("title", "") if isinstance(metadata, dict) else ""
-                abstract = metadata.get("abstract", "").replace('\n', ' ') if isinstance(metadata, dict) else ""
-                extracted.append(f"{doi}, {title}, {abstract}")
-        return '; '.join(extracted)
-    return publications
+                metadata = pub.get("metadata") if isinstance(pub.get("metadata"), dict) else {}
+                records.append({
+                    "DOI": pub.get("doi") or "",
+                    "Title": metadata.get("title") or "",
+                    "Abstract": (metadata.get("abstract") or "").replace('\n', ' ')
+                })
+    return records
 
 # Function to join list elements into a string, handling cases where the input is not a list
 def safe_join(lst):
@@ -41,68 +69,238 @@ def safe_join(lst):
         return ', '.join(str(item) for item in lst)
     return str(lst)
 
+# Function to keep only the fields we use from a raw bio.tools entry
+def filter_tool(tool):
+    return {
+        "Name": tool.get("name"),
+        "Homepage": tool.get("homepage"),
+        "Description": (tool.get("description") or "").replace('\n', ' '),
+        "Version": tool.get("version"),
+        "Tool Type": safe_join(tool.get("toolType", [])),
+        "Topic": extract_topics(tool.get("topic")),
+        "Publications": extract_publications(tool.get("publication")),
+        "Documentation": extract_documentation(tool.get("documentation", [])),
+        "Operating System": safe_join(tool.get("operatingSystem", [])),
+        "Language": safe_join(tool.get("language", [])),
+        "Accessibility": safe_join(tool.get("accessibility", "")),
+        "License": safe_join(tool.get("license", []))
+    }
+
+# Function to create one shared session so all pages reuse the same pooled keep-alive connections
+def make_session(pool_size=8):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Function to fetch a single page, retrying transient errors with exponential backoff
+# last_page is the number of pages the first page announced: a 404 past it means there is nothing left, a 404 within it
+# is an error like any other (None for the first page, whose 404 means no tools at all)
+def fetch_page(session, url, params, page, retries=5, backoff=1.0, last_page=None):
+    page_params = dict(params, page=page)
+    for attempt in range(retries + 1):
+        try:
+            with instrumentation.span("fetch_biotools.fetch") as phase:
+                response = session.get(url, params=page_params, timeout=60)
+                phase.items = len(response.content)
+            # 404 past the last page is how bio.tools says there is nothing left
+            if response.status_code == 404 and (last_page is None or page > last_page):
+                return {"count": 0, "list": []}
+            # Rate limits, server errors and a page missing within the announced pages are worth retrying
+            if response.status_code in RETRY_STATUSES or response.status_code == 404:
+                raise RequestException(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            with instrumentation.span("fetch_biotools.parse", len(response.content)):
+                return response.json()
+        except (RequestException, ValueError) as e:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            logging.warning(f"Page {page} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+# Functions to read and write the raw JSON of a page so an interrupted run can resume
+# Page files are named after a hash of the URL and the query parameters (query, page size), so a checkpoint
+# directory reused for another query or page size never mixes in pages of the earlier request
+def checkpoint_key(url, params):
+    return hashlib.sha256(json.dumps([url, params], sort_keys=True).encode()).hexdigest()[:16]
+
+def checkpoint_path(checkpoint_dir, key, page):
+    return Path(checkpoint_dir) / f"page_{key}_{page:05d}.json"
+
+def load_checkpoint(checkpoint_dir, key, page):
+    if checkpoint_dir is None:
+        return None
+    path = checkpoint_path(checkpoint_dir, key, page)
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        # A damaged checkpoint is simply fetched again
+        return None
+
+def save_checkpoint(checkpoint_dir, key, page, data):
+    if checkpoint_dir is None:
+        return
+    path = checkpoint_path(checkpoint_dir, key, page)
+    tmp_path = path.with_suffix(".tmp")
+    # Write to a temporary file first so a crash never leaves a half-written page behind
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+# Function to get a page from the checkpoint directory, or from the API if it is not there yet
+# Empty pages are not checkpointed, so a page that came back without tools is asked for again on resume
+def get_page(session, url, params, page, checkpoint_dir, retries, backoff, last_page=None):
+    key = checkpoint_key(url, params)
+    data = load_checkpoint(checkpoint_dir, key, page)
+    if data is None:
+        data = fetch_page(session, url, params, page, retries, backoff, last_page)
+        if data.get("list"):
+            save_checkpoint(checkpoint_dir, key, page, data)
+    return data
+
 # Function to fetch biotools tools based on a query
-def fetch_biotools(query):
-    url = "https://bio.tools/api/tool/"
-    params = {"q": query, "format": "json", "page_size": 150}
-    all_tools = []
-    page = 1
+# The first page gives the total count, the remaining pages are then fetched concurrently
+# Returns None if a page could not be fetched, unless allow_partial is set (then the tools of the other pages)
+def fetch_biotools(query, url=BIOTOOLS_URL, page_size=150, workers=8, checkpoint_dir=None, retries=5, backoff=1.0,
+                   allow_partial=False):
+    params = {"q": query, "format": "json", "page_size": page_size}
 
-    while True:
+    if checkpoint_dir is not None:
+        Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+
+    with make_session(workers) as session:
         try:
-            params["page"] = page
-            response = requests.get(url, params=params)
-            response.raise_for_status()  # Raise HTTPError for bad responses
-        except RequestException as e:
-            logging.error(f"Error: Failed to fetch data for page {page}: {e}")
-            break
-
-        data = response.json()
-        tools_on_page = data.get("list", [])
-
-        if not tools_on_page:
-            break
-
-        for tool in tools_on_page:
-            filtered_tool = {
-                "Name": tool.get("name"),
-                "Homepage": tool.get("homepage"),
-                "Description": tool.get("description", "").replace('\n', ' '),
-                "Version": tool.get("version"),
-                "Tool Type": safe_join(tool.get("toolType", [])),
-                "Topic": extract_topics(tool.get("topic")),
-                "Publications": extract_publications(tool.get("publication")),
-                "Documentation": extract_documentation(tool.get("documentation", [])),
-                "Operating System": safe_join(tool.get("operatingSystem", [])),
-                "Language": safe_join(tool.get("language", [])),
-                "Accessibility": safe_join(tool.get("accessibility", "")),
-                "License": safe_join(tool.get("license", []))
+            first_page = get_page(session, url, params, 1, checkpoint_dir, retries, backoff)
+        except (RequestException, ValueError) as e:
+            logging.error(f"Error: Failed to fetch data for page 1: {e}")
+            return None
+
+        count = first_page.get("count", 0)
+        n_pages = max(1, math.ceil(count / page_size))
+        logging.info(f"{count} tools found for '{query}' across {n_pages} pages.")
+
+        pages = {1: first_page.get("list", [])}
+        failed_pages = []
+
+        # Bounded pool of workers, all sharing the same session
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(get_page, session, url, params, page, checkpoint_dir, retries, backoff, n_pages): page
+                for page in range(2, n_pages + 1)
             }
-            all_tools.append(filtered_tool)
+            for future in as_completed(futures):
+                page = futures[future]
+                try:
+                    pages[page] = future.result().get("list", [])
+                except (RequestException, ValueError) as e:
+                    logging.error(f"Error: Failed to fetch data for page {page}: {e}")
+                    failed_pages.append(page)
 
-        page += 1
+    if failed_pages:
+        logging.error(f"{len(failed_pages)} pages could not be fetched: {sorted(failed_pages)}. "
+                      "Run again with the same --checkpoint-dir to resume.")
+        # A table missing whole pages of tools looks complete, so it is only returned when asked for
+        if not allow_partial:
+            return None
+
+    # Keep the same ordering as a page by page fetch
+    all_tools = []
+    with instrumentation.span("fetch_biotools.transform") as phase:
+        for page in sorted(pages):
+            for tool in pages[page]:
+                all_tools.append(filter_tool(tool))
+        phase.items = len(all_tools)
 
     return all_tools
 
 # Function to save the fetched tools to a JSON file
 def save_to_file(tools, filename):
     try:
-        with open(filename, 'w') as f:
+        with instrumentation.span("fetch_biotools.write", len(tools)), open(filename, 'w') as f:
             json.dump(tools, f, indent=4)
         logging.info(f"Data saved to {filename}")
     except IOError as e:
         logging.error(f"Error: Could not write to file {filename}: {e}")
 
+# Arrow schema of the Parquet output: topics and documentation URLs are lists of strings,
+# the publications a list of records, everything else a string (lists such as Version are joined, see flatten_strings)
+def tool_schema():
+    publication = pa.struct([("DOI", pa.string()), ("Title", pa.string()), ("Abstract", pa.string())])
+    return pa.schema([
+        ("Name", pa.string()), ("Homepage", pa.string()), ("Description", pa.string()), ("Version", pa.string()),
+        ("Tool Type", pa.string()), ("Topic", pa.list_(pa.string())), ("Publications", pa.list_(publication)),
+        ("Documentation", pa.list_(pa.string())), ("Operating System", pa.string()), ("Language", pa.string()),
+        ("Accessibility", pa.string()), ("License", pa.string())
+    ])
+
+# Function to bring the string columns of a tool to text: bio.tools gives some of them as lists (e.g. Version,
+# one value per released version), which are joined with commas the same way json2tsv.py joins them
+def flatten_strings(tool, string_fields):
+    lists = {field: ', '.join(str(item) for item in tool[field])
+             for field in string_fields if isinstance(tool.get(field), list)}
+    return {**tool, **lists} if lists else tool
+
+# Function to turn the fetched tools into Arrow record batches
+def tools_to_batches(tools, batch_size=1000):
+    schema = tool_schema()
+    string_fields = [field.name for field in schema if pa.types.is_string(field.type)]
+    for start in range(0, len(tools), batch_size):
+        batch = [flatten_strings(tool, string_fields) for tool in tools[start:start + batch_size]]
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+# Function to save the fetched tools to a Parquet file, one record batch at a time
+def save_to_parquet(tools, filename, batch_size=1000):
+    tmp_filename = f"{filename}.tmp"
+    try:
+        with instrumentation.span("fetch_biotools.write", len(tools)), \
+                pq.ParquetWriter(tmp_filename, tool_schema()) as writer:
+            for batch in tools_to_batches(tools, batch_size):
+                writer.write_batch(batch)
+        os.replace(tmp_filename, filename)
+        logging.info(f"Data saved to {filename}")
+    except IOError as e:
+        logging.error(f"Error: Could not write to file {filename}: {e}")
+
 # Main function to parse arguments and execute the script
 def main():
     parser = argparse.ArgumentParser(description='Fetch tools from bio.tools.')
     parser.add_argument('query', type=str, help='The search query string.')
-    parser.add_argument('output', type=str, help='The output JSON file.')
+    parser.add_argument('output', type=str, help='The output JSON file (or Parquet file, if it ends with .parquet).')
+    parser.add_argument('--url', type=str, default=BIOTOOLS_URL, help='The bio.tools API endpoint.')
+    parser.add_argument('--page-size', type=int, default=150, help='Number of tools requested per page.')
+    parser.add_argument('--workers', type=int, default=8, help='Maximum number of pages fetched at the same time.')
+    parser.add_argument('--retries', type=int, default=5, help='Number of retries for a failed page.')
+    parser.add_argument('--checkpoint-dir', type=str, default=None, help='Directory to store fetched pages in, so an interrupted run can resume.')
+    parser.add_argument('--allow-partial', action='store_true', help='Save the tools of the pages that were fetched even if other pages failed.')
+    parser.add_argument('--report', type=str, default=None, help='Save the time and peak memory of each phase to this JSON file.')
     args = parser.parse_args()
 
-    biotools = fetch_biotools(args.query)
-    save_to_file(biotools, args.output)
+    columnar = args.output.endswith(".parquet")
+    if columnar and pa is None:
+        logging.error("Parquet output needs the pyarrow package (pip install pyarrow).")
+        return
+
+    if args.report:
+        instrumentation.start()
+    biotools = fetch_biotools(args.query, url=args.url, page_size=args.page_size, workers=args.workers,
+                              checkpoint_dir=args.checkpoint_dir, retries=args.retries, allow_partial=args.allow_partial)
+    if biotools is None:
+        logging.error(f"Nothing saved to {args.output}, not all pages could be fetched (use --allow-partial to save them anyway).")
+        if args.report:
+            instrumentation.write_report(args.report, query=args.query, tools=0)
+        sys.exit(1)
+    if columnar:
+        save_to_parquet(biotools, args.output)
+    else:
+        save_to_file(biotools, args.output)
     logging.info(f"Total {len(biotools)} tools fetched.")
+    if args.report:
+        instrumentation.write_report(args.report, query=args.query, tools=len(biotools))
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,38 @@
 import pandas as pd
+import csv
 import json
 import argparse
+import itertools
 import logging
+import os
+import sys
 from pathlib import Path
 
+# Parquet input/output is optional, only needed for .parquet files
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+# Phase timings and the run report (scripts/instrumentation.py, shared with the scripts in other/)
+if str(Path(__file__).resolve().parent.parent) not in sys.path:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import instrumentation
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Fixed column schema of the TSV, in the order fetch_biotools.py writes the fields
+# (Publications is replaced by one DOI/Title/Abstract row per publication)
+COLUMNS = [
+    "Name", "Homepage", "Description", "Version", "Tool Type", "Topic",
+    "Documentation", "Operating System", "Language", "Accessibility", "License",
+    "DOI", "Title", "Abstract"
+]
+
 def clean_text(text):
     if isinstance(text, str):
         return text.replace('\n', ' ')
@@ -16,23 +43,23 @@ def clean_list(lst):
         return ', '.join([json.dumps(item) if isinstance(item, dict) else str(item) for item in lst])
     return lst
 
+# Function to bring one publication to a DOI/Title/Abstract record; takes the records written by
+# fetch_biotools.py as well as raw bio.tools entries ({'doi': ..., 'metadata': {'title': ..., 'abstract': ...}})
+def normalize_publication(pub):
+    if 'DOI' in pub or 'Title' in pub or 'Abstract' in pub:
+        return {'DOI': pub.get('DOI') or '', 'Title': clean_text(pub.get('Title') or ''),
+                'Abstract': clean_text(pub.get('Abstract') or '')}
+    metadata = pub.get('metadata') if isinstance(pub.get('metadata'), dict) else {}
+    return {'DOI': pub.get('doi') or '', 'Title': clean_text(metadata.get('title') or ''),
+            'Abstract': clean_text(metadata.get('abstract') or '')}
+
 def extract_publications(publications):
     if isinstance(publications, list):
-        extracted_data = []
-        for pub in publications:
-            if isinstance(pub, dict):
-                doi = pub.get('doi', '')
-                title = pub.get('metadata', {}).get('title', '') if isinstance(pub.get('metadata'), dict) else ''
-                abstract = pub.get('metadata', {}).get('abstract', '').replace('\n', ' ') if isinstance(pub.get('metadata'), dict) else ''
-                extracted_data.append({
-                    'DOI': doi,
-                    'Title': title,
-                    'Abstract': abstract
-                })
-        return extracted_data
-    
+        return [normalize_publication(pub) for pub in publications if isinstance(pub, dict)]
+
     elif isinstance(publications, str) and publications.strip():
-        # If `Publications` is a string, attempt to split it into components
+        # Files from older versions of fetch_biotools.py have `Publications` as one "doi, title, abstract" string.
+        # It is split again as well as it can be, but titles with commas end up partly in the abstract.
         parts = publications.split(', ')
         if len(parts) >= 3:
             doi = parts[0]
@@ -48,26 +75,313 @@ def extract_publications(publications):
             'Title': title,
             'Abstract': abstract
         }]
-    
+
     return []
 
+# Function to turn one field into the text written to the table
+# Topics are joined with commas and only the first documentation URL is kept, as in the bio.tools exports we started from
+def normalize_field(key, value):
+    if isinstance(value, list):
+        if key == 'Topic':
+            return ', '.join(str(term) for term in value)
+        if key == 'Documentation':
+            return str(value[0]) if value else ''
+        return clean_list(value)
+    return clean_text(value)
+
 def process_entry(entry):
     processed_entry = {}
     for key, value in entry.items():
         if key != 'Publications':  # Skip publications for now
-            processed_entry[key] = clean_list(value) if isinstance(value, list) else clean_text(value)
-    
+            processed_entry[key] = normalize_field(key, value)
+
     publications_data = extract_publications(entry.get('Publications', ''))
     return processed_entry, publications_data
 
-    
-    publications_data = extract_publications(entry.get('publications', []))
-    return processed_entry, publications_data
+# Function to turn one entry into one row per publication
+def merge_publications(entry):
+    processed_entry, pub_data = process_entry(entry)
+
+    if not pub_data:
+        logging.debug("No publications found for entry: %s", processed_entry.get('Name'))
+        return []
+
+    return [{**processed_entry, **pub} for pub in pub_data]
+
+# Function to warn once about the entries left out for having no publications
+# (a warning per entry flooded the log and its cost showed up in the timings of large files)
+def log_without_publications(count, examples):
+    if count:
+        logging.warning(f"{count} entries without publications were left out "
+                        f"(e.g. {', '.join(str(name) for name in examples[:5])}).")
+
+# Function to fill in missing publication titles and abstracts from the local metadata cache
+# (see pubmed_cache.py), without any network call; rows whose DOI is not in the cache are left as they are
+def fill_from_cache(rows, connection):
+    import pubmed_cache
+    missing = [row for row in rows if row.get('DOI') and not (row.get('Title') and row.get('Abstract'))]
+    if not missing:
+        return rows
+    records = pubmed_cache.lookup_dois(connection, [row['DOI'] for row in missing])
+    for row in missing:
+        record = records.get(pubmed_cache.normalize_doi(row['DOI']))
+        if record:
+            row['Title'] = row.get('Title') or record['title'] or ''
+            row['Abstract'] = row.get('Abstract') or record['abstract'] or ''
+    return rows
+
+# Function to turn a list of entries into a table with one row per publication in one go
+# Every column is normalised as a whole, then the publication lists are exploded into rows and
+# expanded into DOI/Title/Abstract columns. Gives the same rows as merge_publications entry by entry.
+def normalize_entries(entries):
+    df = pd.DataFrame(entries)
+    if df.empty or 'Publications' not in df.columns:
+        return pd.DataFrame()
+
+    publications = df.pop('Publications').map(extract_publications)
+    for column in df.columns:
+        df[column] = [normalize_field(column, value) for value in df[column]]
+
+    no_publications = publications.map(len) == 0
+    names = df.loc[no_publications, 'Name'] if 'Name' in df.columns else pd.Series(dtype=object)
+    log_without_publications(int(no_publications.sum()), names.head(5).tolist())
+
+    df['Publications'] = publications
+    df = df[~no_publications].explode('Publications', ignore_index=True)
+    details = pd.DataFrame(df.pop('Publications').tolist(), index=df.index, columns=['DOI', 'Title', 'Abstract'])
+    return pd.concat([df, details], axis=1)
+
+# Function to read the entries of a top-level JSON array one at a time, so only the
+# current entry (plus one read buffer) is held in memory
+def iter_json_array(f, chunk_size=1 << 20):
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    eof = False
+
+    if not buffer.startswith('['):
+        raise ValueError("Expected a top-level JSON array")
+    pos = 1
+
+    while True:
+        # Skip whitespace and the commas between entries
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        decoded = None
+        if pos < len(buffer):
+            try:
+                decoded = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                pass
+
+        if decoded is None:
+            # The entry runs past the end of the buffer, read some more and try again
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        entry, pos = decoded
+        yield entry
+
+# Function to iterate over the entries of a JSON array file or a JSON Lines file
+def iter_entries(json_file, chunk_size=1 << 20):
+    with open(json_file, 'r') as f:
+        # Look at the first character to tell a JSON array from JSON Lines
+        first = f.read(chunk_size).lstrip()[:1]
+        f.seek(0)
+
+        if first == '[':
+            yield from iter_json_array(f, chunk_size)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+# Function to read the next batch_size entries, timed as the parse phase
+def read_batch(entries, batch_size):
+    with instrumentation.span("json2tsv.parse") as phase:
+        batch = list(itertools.islice(entries, batch_size))
+        phase.items = len(batch)
+    return batch
+
+# Function to turn a batch of entries into rows, timed as the transform phase
+# Returns (rows, number of entries without publications, their names)
+def batch_rows(batch, metadata_cache=None):
+    # Checked once per batch: logging.debug of every entry still costs a call when debug output is off
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    with instrumentation.span("json2tsv.transform") as phase:
+        rows, skipped = [], []
+        for entry in batch:
+            if debug:
+                logging.debug("Processing entry: %s", entry)
+            entry_rows = merge_publications(entry)
+            if not entry_rows:
+                skipped.append(entry.get('Name') if isinstance(entry, dict) else None)
+            rows.extend(entry_rows)
+        if metadata_cache is not None:
+            fill_from_cache(rows, metadata_cache)
+        phase.items = len(rows)
+    return rows, len(skipped), skipped[:5]
+
+# Streaming version of json_to_dataframe: entries are parsed in batches and their rows
+# written straight to the TSV through a buffered writer, so memory use does not grow
+# with the size of the input. The output is the same as the pandas path.
+# With a connection to the metadata cache, missing titles and abstracts are filled in from it.
+def json_to_tsv_streaming(json_file, tsv_file, columns=COLUMNS, buffer_size=1 << 20, metadata_cache=None,
+                          batch_size=1000):
+    tsv_file = Path(tsv_file)
+    tmp_file = tsv_file.with_name(tsv_file.name + '.tmp')
+    n_rows = 0
+    n_skipped, skipped = 0, []
+    unknown_columns = set()
 
-def json_to_dataframe(json_file, tsv_file):
     try:
-        with open(json_file, 'r') as f:
+        with open(tmp_file, 'w', newline='', buffering=buffer_size) as out:
+            writer = csv.DictWriter(out, fieldnames=columns, delimiter='\t', lineterminator=os.linesep,
+                                    quoting=csv.QUOTE_MINIMAL, restval='', extrasaction='ignore')
+            writer.writeheader()
+
+            entries = iter_entries(json_file, buffer_size)
+            while batch := read_batch(entries, batch_size):
+                rows, batch_skipped, examples = batch_rows(batch, metadata_cache)
+                n_skipped += batch_skipped
+                skipped.extend(examples[:5 - len(skipped)])
+                for row in rows:
+                    unknown_columns.update(key for key in row if key not in columns)
+                with instrumentation.span("json2tsv.write", len(rows)):
+                    writer.writerows(rows)
+                n_rows += len(rows)
+    except FileNotFoundError:
+        logging.error(f"File not found: {json_file}")
+        return
+    except ValueError as e:
+        logging.error(f"Invalid JSON format: {json_file} ({e})")
+        tmp_file.unlink(missing_ok=True)
+        return
+
+    log_without_publications(n_skipped, skipped)
+    if unknown_columns:
+        logging.warning(f"Fields not in the column schema were dropped: {sorted(unknown_columns)}")
+
+    logging.info(f"Total processed data: {n_rows} entries.")
+
+    # Like the pandas path, nothing is written when there are no rows
+    if n_rows:
+        os.replace(tmp_file, tsv_file)
+        logging.info(f"File saved successfully as {tsv_file}")
+    else:
+        tmp_file.unlink()
+        logging.warning("No data to save. The resulting file will be empty.")
+
+# Arrow schema of the Parquet output: the same columns as the TSV, all stored as strings
+def table_schema(columns=COLUMNS):
+    return pa.schema([(column, pa.string()) for column in columns])
+
+# Function to fill in missing titles and abstracts of an Arrow table from the metadata cache
+def fill_table_from_cache(table, metadata_cache):
+    rows = fill_from_cache(table.select(['DOI', 'Title', 'Abstract']).to_pylist(), metadata_cache)
+    for column in ('Title', 'Abstract'):
+        table = table.set_column(table.schema.get_field_index(column), column,
+                                 pa.array([row[column] for row in rows], pa.string()))
+    return table
+
+# Function to turn the Parquet output of fetch_biotools.py into one row per publication
+# The publication lists are flattened column-wise and the tool columns repeated with take(),
+# so no text is parsed again. Tools without publications are left out, like in the other paths.
+def explode_publications(tools, columns=COLUMNS):
+    publications = tools.column('Publications')
+    parents = pc.list_parent_indices(publications)
+    flat = pc.list_flatten(publications)
+    rows = tools.drop_columns(['Publications']).take(parents)
+    # Topic and Documentation are lists in files from fetch_biotools.py, joined the same way as normalize_field
+    for column in ('Topic', 'Documentation'):
+        if column in rows.column_names and pa.types.is_list(rows.schema.field(column).type):
+            values = rows.column(column)
+            if column == 'Documentation':
+                values = pc.list_slice(values, 0, 1)
+            joined = pc.fill_null(pc.binary_join(values, ', '), '')
+            rows = rows.set_column(rows.column_names.index(column), column, joined)
+    for field in ('DOI', 'Title', 'Abstract'):
+        values = pc.struct_field(flat, field)
+        # Newlines in titles and abstracts become spaces, like clean_text does in the other paths
+        if field != 'DOI':
+            values = pc.replace_substring(values, '\n', ' ')
+        rows = rows.append_column(field, values)
+    # Missing columns are added as empty, every column is a string
+    for column in columns:
+        if column not in rows.column_names:
+            rows = rows.append_column(column, pa.nulls(len(rows), pa.string()))
+    return rows.select(columns).cast(table_schema(columns))
+
+# Function to convert fetch_biotools.py output to a Parquet table with one row per publication
+# The input can be Parquet (converted column-wise, see explode_publications) or JSON (streamed entry
+# by entry and written in batches). Written to a temporary file first, nothing is written without rows.
+def json_to_parquet(input_file, parquet_file, columns=COLUMNS, batch_size=10000, metadata_cache=None):
+    parquet_file = Path(parquet_file)
+    tmp_file = parquet_file.with_name(parquet_file.name + '.tmp')
+    n_rows = 0
+    n_skipped, skipped = 0, []
+
+    try:
+        with pq.ParquetWriter(tmp_file, table_schema(columns)) as writer:
+            def write(table):
+                if metadata_cache is not None:
+                    with instrumentation.span("json2tsv.transform", len(table)):
+                        table = fill_table_from_cache(table, metadata_cache)
+                with instrumentation.span("json2tsv.write", len(table)):
+                    writer.write_table(table)
+                return len(table)
+
+            if Path(input_file).suffix == '.parquet':
+                tools_file = pq.ParquetFile(input_file)
+                for i in range(tools_file.num_row_groups):
+                    with instrumentation.span("json2tsv.parse", tools_file.metadata.row_group(i).num_rows):
+                        tools = tools_file.read_row_group(i)
+                    with instrumentation.span("json2tsv.transform") as phase:
+                        table = explode_publications(tools, columns)
+                        phase.items = len(table)
+                    n_rows += write(table)
+            else:
+                # Entries are read batch_size at a time, every batch is one row group
+                entries = iter_entries(input_file)
+                while batch := read_batch(entries, batch_size):
+                    rows, batch_skipped, examples = batch_rows(batch)
+                    n_skipped += batch_skipped
+                    skipped.extend(examples[:5 - len(skipped)])
+                    if rows:
+                        with instrumentation.span("json2tsv.transform", len(rows)):
+                            table = pa.Table.from_pylist(rows, schema=table_schema(columns))
+                        n_rows += write(table)
+    except FileNotFoundError:
+        logging.error(f"File not found: {input_file}")
+        return
+    except ValueError as e:
+        logging.error(f"Invalid input format: {input_file} ({e})")
+        tmp_file.unlink(missing_ok=True)
+        return
+
+    log_without_publications(n_skipped, skipped)
+    logging.info(f"Total processed data: {n_rows} entries.")
+
+    if n_rows:
+        os.replace(tmp_file, parquet_file)
+        logging.info(f"File saved successfully as {parquet_file}")
+    else:
+        tmp_file.unlink()
+        logging.warning("No data to save. The resulting file will be empty.")
+
+def json_to_dataframe(json_file, tsv_file, metadata_cache=None):
+    try:
+        with instrumentation.span("json2tsv.parse") as phase, open(json_file, 'r') as f:
             data = json.load(f)
+            phase.items = len(data)
     except FileNotFoundError:
         logging.error(f"File not found: {json_file}")
         return
@@ -75,28 +389,22 @@ def json_to_dataframe(json_file, tsv_file):
         logging.error(f"Invalid JSON format: {json_file}")
         return
 
-    processed_data = []
-    publications_data = []
-
-    for entry in data:
-        logging.info(f"Processing entry: {entry}")
-        processed_entry, pub_data = process_entry(entry)
-        
-        if pub_data:
-            for pub in pub_data:
-                merged_entry = {**processed_entry, **pub}
-                publications_data.append(merged_entry)
-        else:
-            logging.warning(f"No publications found for entry: {processed_entry['Name']}")
-
-    logging.info(f"Total processed data: {len(publications_data)} entries.")
+    with instrumentation.span("json2tsv.transform") as phase:
+        result_df = normalize_entries(data)
+        if metadata_cache is not None and not result_df.empty:
+            rows = result_df[['DOI', 'Title', 'Abstract']].to_dict('records')
+            fill_from_cache(rows, metadata_cache)
+            result_df[['DOI', 'Title', 'Abstract']] = pd.DataFrame(rows, index=result_df.index)
+        phase.items = len(result_df)
+    logging.info(f"Total processed data: {len(result_df)} entries.")
 
-    if publications_data:
-        result_df = pd.DataFrame(publications_data)
-        logging.info(f"DataFrame head: \n{result_df.head()}")
+    if not result_df.empty:
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"DataFrame head: \n{result_df.head()}")
 
         try:
-            result_df.to_csv(tsv_file, sep='\t', index=False)
+            with instrumentation.span("json2tsv.write", len(result_df)):
+                result_df.to_csv(tsv_file, sep='\t', index=False)
             logging.info(f"File saved successfully as {tsv_file}")
         except Exception as e:
             logging.error(f"Failed to save file: {e}")
@@ -105,17 +413,48 @@ def json_to_dataframe(json_file, tsv_file):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert JSON data to TSV.')
-    parser.add_argument('json_file', type=str, help='The input JSON file.')
-    parser.add_argument('tsv_file', type=str, help='The output TSV file.')
+    parser.add_argument('json_file', type=str, help='The input JSON file (or Parquet file from fetch_biotools.py).')
+    parser.add_argument('tsv_file', type=str, help='The output TSV file (or Parquet file, if it ends with .parquet).')
+    parser.add_argument('--stream', action='store_true', help='Convert entry by entry with bounded memory (also reads JSON Lines input).')
+    parser.add_argument('--metadata-cache', type=str, default=None, help='SQLite cache from pubmed_cache.py to fill in missing titles and abstracts.')
+    parser.add_argument('--report', type=str, default=None, help='Save the time and peak memory of each phase to this JSON file.')
 
     args = parser.parse_args()
 
     json_file = Path(args.json_file)
     tsv_file = Path(args.tsv_file)
 
+    metadata_cache = None
+    if args.metadata_cache:
+        import pubmed_cache
+        metadata_cache = pubmed_cache.open_cache(args.metadata_cache)
+
+    if args.report:
+        instrumentation.start()
+
     if not json_file.exists():
         logging.error(f"Input file does not exist: {json_file}")
     elif not tsv_file.parent.exists():
         logging.error(f"Output directory does not exist: {tsv_file.parent}")
+    elif (json_file.suffix == '.parquet' or tsv_file.suffix == '.parquet') and pa is None:
+        logging.error("Parquet input or output needs the pyarrow package (pip install pyarrow).")
+    elif tsv_file.suffix == '.parquet':
+        json_to_parquet(json_file, tsv_file, metadata_cache=metadata_cache)
+    elif json_file.suffix == '.parquet':
+        # TSV is only an export format here: the columnar table is built first and then written out as text
+        tmp_file = tsv_file.with_name(tsv_file.name + '.parquet.tmp')
+        json_to_parquet(json_file, tmp_file, metadata_cache=metadata_cache)
+        if tmp_file.exists():
+            with instrumentation.span("json2tsv.write") as phase:
+                table = pq.read_table(tmp_file)
+                table.to_pandas().to_csv(tsv_file, sep='\t', index=False)
+                phase.items = len(table)
+            tmp_file.unlink()
+            logging.info(f"Exported to {tsv_file}")
+    elif args.stream:
+        json_to_tsv_streaming(json_file, tsv_file, metadata_cache=metadata_cache)
     else:
-        json_to_dataframe(json_file, tsv_file)
+        json_to_dataframe(json_file, tsv_file, metadata_cache)
+
+    if args.report:
+        instrumentation.write_report(args.report, input=str(json_file), output=str(tsv_file))
@@ -0,0 +1,283 @@
+import requests
+import argparse
+import logging
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Europe PMC search endpoint for POST requests (the GET endpoint is .../rest/search); any service answering
+# the same query/JSON format (a mirror, a local fixture server) can be used instead with --url
+EUROPEPMC_URL = "https://www.ebi.ac.uk/europepmc/webservices/rest/searchPOST"
+
+DEFAULT_CACHE = "publications_cache.sqlite"
+
+# HTTP status codes that are usually temporary and worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DOI_PREFIX = re.compile(r"^(https?://(dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+
+# Function to bring a DOI to the form it is stored in (DOIs are case-insensitive), '' if it is not a DOI
+def normalize_doi(doi):
+    if not isinstance(doi, str):
+        return ""
+    doi = DOI_PREFIX.sub("", doi.strip()).lower()
+    return doi if doi.startswith("10.") else ""
+
+# Function to turn an identifier into ('doi', doi) or ('pmid', pmid), None if it is neither
+def parse_identifier(identifier):
+    identifier = str(identifier).strip()
+    if identifier.isdigit():
+        return "pmid", identifier
+    doi = normalize_doi(identifier)
+    if doi:
+        return "doi", doi
+    return None
+
+# Open (and create if needed) the cache
+# publications holds one row per article; lookups remembers every identifier that was asked for,
+# so identifiers Europe PMC does not know are not asked for again on every run
+def open_cache(cache_path):
+    connection = sqlite3.connect(cache_path, check_same_thread=False)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS publications (
+            id INTEGER PRIMARY KEY, doi TEXT UNIQUE, pmid TEXT UNIQUE,
+            title TEXT, abstract TEXT, journal TEXT, year TEXT, source TEXT, fetched REAL);
+        CREATE TABLE IF NOT EXISTS lookups (
+            kind TEXT, identifier TEXT, found INTEGER, fetched REAL, PRIMARY KEY (kind, identifier));
+    """)
+    # Full-text index on titles and abstracts, kept in sync by triggers
+    # Some SQLite builds come without FTS5; the cache works without it, only search() needs it
+    try:
+        connection.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS publications_fts
+                USING fts5(title, abstract, content='publications', content_rowid='id');
+            CREATE TRIGGER IF NOT EXISTS publications_ai AFTER INSERT ON publications BEGIN
+                INSERT INTO publications_fts(rowid, title, abstract) VALUES (new.id, new.title, new.abstract);
+            END;
+            CREATE TRIGGER IF NOT EXISTS publications_au AFTER UPDATE ON publications BEGIN
+                INSERT INTO publications_fts(publications_fts, rowid, title, abstract) VALUES ('delete', old.id, old.title, old.abstract);
+                INSERT INTO publications_fts(rowid, title, abstract) VALUES (new.id, new.title, new.abstract);
+            END;
+            CREATE TRIGGER IF NOT EXISTS publications_ad AFTER DELETE ON publications BEGIN
+                INSERT INTO publications_fts(publications_fts, rowid, title, abstract) VALUES ('delete', old.id, old.title, old.abstract);
+            END;
+        """)
+    except sqlite3.OperationalError as e:
+        logging.warning(f"Full-text search not available in this SQLite build: {e}")
+    return connection
+
+# Function to find which identifiers were already looked up, returns a set of (kind, identifier)
+def known_identifiers(connection, identifiers):
+    known = set()
+    identifiers = list(identifiers)
+    # SQLite limits the number of parameters per query, so look up in slices
+    for kind in ("doi", "pmid"):
+        values = [value for k, value in identifiers if k == kind]
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(
+                f"SELECT kind, identifier FROM lookups WHERE kind = ? AND identifier IN ({placeholders})", [kind, *chunk]
+            )
+            known.update(rows)
+    return known
+
+# Function to get the cached records of a list of DOIs, returns {doi: record}
+def lookup_dois(connection, dois):
+    records = {}
+    dois = sorted({normalize_doi(doi) for doi in dois} - {""})
+    for start in range(0, len(dois), 500):
+        chunk = dois[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = connection.execute(
+            f"SELECT doi, pmid, title, abstract, journal, year FROM publications WHERE doi IN ({placeholders})", chunk
+        )
+        for doi, pmid, title, abstract, journal, year in rows:
+            records[doi] = {"pmid": pmid, "title": title, "abstract": abstract, "journal": journal, "year": year}
+    return records
+
+# Function to add or update records; an article already stored under its DOI or PMID is updated in place
+# When the DOI and the PMID of a record were stored as two rows (e.g. one fetched by DOI before Europe PMC linked it
+# to its PMID), the rows are merged into the oldest one, since updating one of them would clash with the other
+def store_records(connection, records, queried):
+    now = time.time()
+    found = set()
+    with connection:
+        for record in records:
+            doi, pmid = record["doi"] or None, record["pmid"] or None
+            existing = connection.execute(
+                "SELECT id FROM publications WHERE doi = ? OR pmid = ? ORDER BY id", (doi, pmid)
+            ).fetchall()
+            values = (doi, pmid, record["title"], record["abstract"], record["journal"], record["year"], record["source"], now)
+            if len(existing) > 1:
+                connection.executemany("DELETE FROM publications WHERE id = ?", existing[1:])
+            if existing:
+                connection.execute(
+                    "UPDATE publications SET doi = coalesce(?, doi), pmid = coalesce(?, pmid), title = ?, abstract = ?,"
+                    " journal = ?, year = ?, source = ?, fetched = ? WHERE id = ?", (*values, existing[0][0])
+                )
+            else:
+                connection.execute("INSERT INTO publications (doi, pmid, title, abstract, journal, year, source, fetched)"
+                                   " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+            if doi:
+                found.add(("doi", doi))
+            if pmid:
+                found.add(("pmid", pmid))
+        connection.executemany(
+            "INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)",
+            [(kind, identifier, int((kind, identifier) in found), now) for kind, identifier in queried]
+        )
+
+# Function to build the Europe PMC query for a batch of identifiers, e.g. DOI:"10.1/x" OR EXT_ID:123 AND SRC:MED
+def europepmc_query(batch):
+    terms = []
+    for kind, identifier in batch:
+        if kind == "doi":
+            terms.append(f'DOI:"{identifier}"')
+        else:
+            terms.append(f"(EXT_ID:{identifier} AND SRC:MED)")
+    return " OR ".join(terms)
+
+# Function to turn a Europe PMC result into a cache record
+def parse_europepmc_result(result):
+    journal = result.get("journalInfo", {}).get("journal", {}) if isinstance(result.get("journalInfo"), dict) else {}
+    return {
+        "doi": normalize_doi(result.get("doi", "")),
+        "pmid": str(result.get("pmid", "") or ""),
+        "title": (result.get("title") or "").replace('\n', ' ').strip(),
+        "abstract": (result.get("abstractText") or "").replace('\n', ' ').strip(),
+        "journal": journal.get("title", "") if isinstance(journal, dict) else "",
+        "year": str(result.get("pubYear", "") or ""),
+        "source": result.get("source", "")
+    }
+
+# Function to create one shared session so all batches reuse the same pooled keep-alive connections
+def make_session(pool_size=4):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Function to fetch the records of one batch of identifiers, following the cursor over result pages
+# and retrying transient errors with exponential backoff
+def fetch_batch(session, url, batch, page_size=1000, retries=5, backoff=1.0):
+    params = {"query": europepmc_query(batch), "resultType": "core", "format": "json",
+              "pageSize": page_size, "cursorMark": "*"}
+    records = []
+    while True:
+        for attempt in range(retries + 1):
+            try:
+                # POST keeps long queries out of the URL
+                response = session.post(url, data=params, timeout=60)
+                if response.status_code in RETRY_STATUSES:
+                    raise RequestException(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                data = response.json()
+                break
+            except (RequestException, ValueError) as e:
+                if attempt == retries:
+                    raise
+                delay = backoff * (2 ** attempt)
+                logging.warning(f"Batch of {len(batch)} identifiers failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+        results = data.get("resultList", {}).get("result", [])
+        records.extend(parse_europepmc_result(result) for result in results)
+        next_cursor = data.get("nextCursorMark")
+        if not results or not next_cursor or next_cursor == params["cursorMark"]:
+            return records
+        params["cursorMark"] = next_cursor
+
+# Function to fill the cache for a list of DOIs/PMIDs
+# Identifiers already looked up are skipped (unless refresh is set), the others are sent in batches of
+# batch_size, at most `workers` batches at a time. Returns the number of identifiers that were fetched.
+def fetch_metadata(identifiers, cache_path=DEFAULT_CACHE, url=EUROPEPMC_URL, batch_size=100, workers=4,
+                   refresh=False, retries=5):
+    parsed = {parse_identifier(identifier) for identifier in identifiers} - {None}
+    connection = open_cache(cache_path)
+    to_fetch = sorted(parsed if refresh else parsed - known_identifiers(connection, parsed))
+    logging.info(f"{len(parsed) - len(to_fetch)} identifiers already in the cache, {len(to_fetch)} to fetch")
+
+    batches = [to_fetch[start:start + batch_size] for start in range(0, len(to_fetch), batch_size)]
+    session = make_session(workers)
+    n_fetched = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_batch, session, url, batch, retries=retries): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                records = future.result()
+            except (RequestException, ValueError) as e:
+                # The batch is not marked as looked up, so the next run tries it again
+                logging.error(f"Batch of {len(batch)} identifiers failed: {e}")
+                continue
+            # Only the main thread writes to the cache
+            store_records(connection, records, batch)
+            n_fetched += len(batch)
+
+    connection.close()
+    logging.info(f"{n_fetched} identifiers fetched")
+    return n_fetched
+
+# Function to search the cached titles and abstracts (FTS5 query syntax), best matches first
+def search(cache_path, query, limit=20):
+    connection = open_cache(cache_path)
+    rows = connection.execute(
+        "SELECT p.doi, p.pmid, p.title, p.year FROM publications_fts f JOIN publications p ON p.id = f.rowid"
+        " WHERE publications_fts MATCH ? ORDER BY f.rank LIMIT ?", (query, limit)
+    ).fetchall()
+    connection.close()
+    return rows
+
+# Function to read identifiers from a fetch_biotools.py JSON file (its publication DOIs) or a text file
+# with one DOI or PMID per line
+def read_identifiers(path):
+    if Path(path).suffix.lower() != ".json":
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    from json2tsv import iter_entries
+    dois = []
+    for entry in iter_entries(path):
+        publications = entry.get("Publications", "")
+        # fetch_biotools.py writes publications as "doi, title, abstract; doi, title, abstract"
+        if isinstance(publications, str):
+            dois.extend(publication.split(", ")[0] for publication in publications.split("; "))
+        elif isinstance(publications, list):
+            dois.extend(pub.get("DOI") or pub.get("doi") or "" for pub in publications if isinstance(pub, dict))
+    return dois
+
+# Main function to parse arguments and execute the script
+def main():
+    parser = argparse.ArgumentParser(description='Fetch publication titles and abstracts for DOIs/PMIDs into a local cache.')
+    parser.add_argument('identifiers', type=str, nargs='?', help='fetch_biotools.py JSON output, or a text file with one DOI or PMID per line.')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE, help='SQLite cache file.')
+    parser.add_argument('--url', type=str, default=EUROPEPMC_URL, help='Europe PMC compatible search endpoint.')
+    parser.add_argument('--batch-size', type=int, default=100, help='Number of identifiers per request.')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of requests at the same time.')
+    parser.add_argument('--retries', type=int, default=5, help='Number of retries for a failed request.')
+    parser.add_argument('--refresh', action='store_true', help='Fetch identifiers again even if they are in the cache.')
+    parser.add_argument('--search', type=str, default=None, help='Search the cached titles and abstracts instead of fetching.')
+    args = parser.parse_args()
+
+    if args.search:
+        for doi, pmid, title, year in search(args.cache, args.search):
+            print(f"{doi or ''}\t{pmid or ''}\t{year or ''}\t{title}")
+    elif not args.identifiers:
+        parser.error("identifiers are required unless --search is given")
+    elif not Path(args.identifiers).exists():
+        logging.error(f"Input file does not exist: {args.identifiers}")
+    else:
+        fetch_metadata(read_identifiers(args.identifiers), args.cache, args.url, args.batch_size, args.workers,
+                       args.refresh, args.retries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Reproducibility scale (output/Reproducibility_scale.xlsx): every criterion is scored from 1 to 3.
+# Each criterion lists its levels in the order they are checked; the first level whose conditions hold is
+# given, otherwise the default. A level holds if any of its "any" conditions (or all of its "all" conditions)
+# holds. Conditions:
+#   {"columns": [...], "contains": ["docker", ...]}       any of the columns contains any of the words (case-insensitive)
+#   {"column": "License", "matches": "regex"}             the column matches the regular expression (case-insensitive)
+#   {"column": "Version", "present": true}                the column is not empty
+#   {"columns": [...], "count": [[words], ...], "min": 2}  at least `min` of the word groups are found in the columns
+#   {"criteria": [...], "mean_at_least": 2.5}            the mean level of criteria scored before is at least that
+# "column" and "columns" can be used interchangeably. Words are plain substrings, which are much faster to look
+# for in long abstracts than regular expressions; "matches" is meant for short fields like License.
+# The combined table has one row per publication; a condition holds for a tool if it holds on any of its rows.
+# The same structure can be given as a JSON file with --rules, so the scale can be changed without touching the code.
+
+TEXT = ["Description", "Abstract"]
+LINKS = ["Homepage", "Documentation"]
+
+CODE_HOSTING = ["github.com", "gitlab", "bitbucket.org", "sourceforge.net", "codeberg.org"]
+PLATFORMS = [CODE_HOSTING, ["forum", "biostars", "discourse", "help desk"], ["slack", "gitter", "discord"],
+             ["mailing list", "google groups"]]
+NINE_CRITERIA = ["Licensing", "Version control", "Preservation", "Community engagement", "Validation",
+                 "Containerization", "Workflow management", "Documentation", "Standardized formats"]
+
+RULES = [
+    {"criterion": "Licensing", "default": 1, "levels": [
+        {"level": 1, "any": [{"column": "License", "matches": r"proprietary|commercial|not licensed|licen[cs]e required"}]},
+        {"level": 3, "any": [{"column": "License", "matches":
+                              r"\b(GPL|LGPL|AGPL|MIT|Apache|BSD|MPL|EPL|Artistic|CC[- ]?BY|CC0|Unlicense|ISC|Zlib|CECILL|EUPL|Python)"}]},
+        {"level": 2, "any": [{"column": "License", "present": True},
+                             {"column": "Accessibility", "contains": ["open access", "free of charge"]}]},
+    ]},
+    {"criterion": "Version control", "default": 1, "levels": [
+        {"level": 3, "any": [{"columns": LINKS, "contains": CODE_HOSTING}]},
+        {"level": 2, "any": [{"column": "Version", "present": True}]},
+    ]},
+    {"criterion": "Preservation", "default": 1, "levels": [
+        {"level": 3, "any": [{"columns": LINKS + TEXT, "contains": ["zenodo", "figshare", "software heritage", "softwareheritage"]}]},
+        {"level": 2, "any": [{"columns": TEXT, "contains": ["proteomexchange", "pride archive", "pride database", "jpost",
+                                                           "peptideatlas", "data are available", "data is available", "deposited"]}]},
+    ]},
+    {"criterion": "Community engagement", "default": 1, "levels": [
+        {"level": 3, "any": [{"columns": LINKS + TEXT, "count": PLATFORMS, "min": 2}]},
+        {"level": 2, "any": [{"columns": LINKS + TEXT, "count": PLATFORMS, "min": 1}]},
+    ]},
+    {"criterion": "Validation", "default": 1, "levels": [
+        {"level": 3, "any": [{"columns": TEXT, "contains": ["continuous integration", "unit test", "test suite", "regression test"]}]},
+        {"level": 2, "any": [{"column": "DOI", "present": True},
+                             {"columns": TEXT, "contains": ["benchmark", "validat", "compared to", "compared with", "gold standard"]}]},
+    ]},
+    {"criterion": "Containerization", "default": 1, "levels": [
+        {"level": 3, "any": [{"columns": LINKS + TEXT, "contains": ["docker", "singularity", "apptainer", "biocontainer", "podman"]}]},
+        {"level": 2, "any": [{"columns": LINKS + TEXT, "contains": ["conda", "virtualenv", "pip install"]}]},
+    ]},
+    {"criterion": "Workflow management", "default": 1, "levels": [
+        {"level": 3, "any": [{"column": "Tool Type", "contains": ["workflow"]},
+                             {"columns": LINKS + TEXT, "contains": ["nextflow", "snakemake", "galaxy", "common workflow language",
+                                                                    "nf-core"]}]},
+        {"level": 2, "any": [{"columns": TEXT, "contains": ["pipeline", "workflow"]},
+                             {"column": "Tool Type", "contains": ["command-line tool", "library"]}]},
+    ]},
+    {"criterion": "Documentation", "default": 1, "levels": [
+        {"level": 3, "any": [{"column": "Documentation", "contains": ["readthedocs", "manual", "guide", "/doc", "wiki", "tutorial"]}]},
+        {"level": 2, "any": [{"column": "Documentation", "present": True}]},
+    ]},
+    # The scale has no level 2 for this criterion
+    {"criterion": "Standardized formats", "default": 1, "levels": [
+        {"level": 3, "any": [{"columns": TEXT, "contains": ["mzml", "mzidentml", "mztab", "mzxml", "hupo-psi", "hupo psi",
+                                                           "proteomics standards initiative"]}]},
+    ]},
+    # Community standards (FAIR) is based on the other nine criteria
+    {"criterion": "FAIR", "default": 1, "levels": [
+        {"level": 3, "any": [{"criteria": NINE_CRITERIA, "mean_at_least": 2.5}]},
+        {"level": 2, "any": [{"criteria": NINE_CRITERIA, "mean_at_least": 2.0}]},
+    ]},
+]
+
+# Function to read the rules from a JSON file (same structure as RULES)
+def load_rules(rules_file):
+    with open(rules_file) as f:
+        return json.load(f)
+
+# Function to give every condition of the rules a key, so conditions used by several levels are evaluated once
+def condition_key(condition):
+    return json.dumps(condition, sort_keys=True)
+
+def row_conditions(rules):
+    conditions = {}
+    for rule in rules:
+        for level in rule["levels"]:
+            for condition in level.get("any", []) + level.get("all", []):
+                if "criteria" not in condition:
+                    conditions[condition_key(condition)] = condition
+    return conditions
+
+# The distinct values of a column, lower-cased, and for every row the position of its value
+# Long fields repeat over the publication rows of a tool, so every test below runs once per distinct value
+def distinct_values(df, column, prepared):
+    if column not in prepared:
+        codes, uniques = pd.factorize(df[column].fillna("").astype(str))
+        prepared[column] = (codes, [value.lower() for value in uniques])
+    return prepared[column]
+
+# Function to find the rows where a column contains any of the words
+def column_contains(df, column, words, prepared):
+    # The same words are often looked for by several conditions (e.g. the platform counts)
+    key = (column, tuple(words))
+    if key in prepared:
+        return prepared[key]
+    codes, values = distinct_values(df, column, prepared)
+    found = np.zeros(len(values), dtype=bool)
+    for word in words:
+        word = word.lower()
+        # Only the values without a hit yet are searched for the next word
+        todo = np.flatnonzero(~found)
+        found[todo] = np.fromiter((word in values[i] for i in todo), dtype=bool, count=len(todo))
+    prepared[key] = found[codes]
+    return prepared[key]
+
+def column_matches(df, column, pattern, prepared):
+    codes, values = distinct_values(df, column, prepared)
+    pattern = re.compile(pattern, re.IGNORECASE)
+    found = np.fromiter((pattern.search(value) is not None for value in values), dtype=bool, count=len(values))
+    return found[codes]
+
+def column_present(df, column, prepared):
+    codes, values = distinct_values(df, column, prepared)
+    found = np.fromiter((bool(value.strip()) for value in values), dtype=bool, count=len(values))
+    return found[codes]
+
+# Function to evaluate the row conditions on a table, returns a rows x conditions boolean DataFrame
+def evaluate_conditions(df, conditions):
+    prepared = {}
+    results = {}
+    for key, condition in conditions.items():
+        columns = [c for c in condition.get("columns", [condition.get("column")]) if c in df.columns]
+        if not columns:
+            results[key] = np.zeros(len(df), dtype=bool)
+        elif condition.get("present"):
+            results[key] = np.logical_or.reduce([column_present(df, c, prepared) for c in columns])
+        elif "count" in condition:
+            counts = sum(np.logical_or.reduce([column_contains(df, c, words, prepared) for c in columns]).astype(int)
+                         for words in condition["count"])
+            results[key] = counts >= condition.get("min", 1)
+        elif "contains" in condition:
+            results[key] = np.logical_or.reduce([column_contains(df, c, condition["contains"], prepared) for c in columns])
+        else:
+            results[key] = np.logical_or.reduce([column_matches(df, c, condition["matches"], prepared) for c in columns])
+    return pd.DataFrame(results, index=df.index)
+
+# Function to evaluate the conditions of several chunks of rows in parallel
+def evaluate_parallel(df, conditions, workers):
+    chunks = np.array_split(np.arange(len(df)), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = executor.map(evaluate_conditions, (df.iloc[chunk] for chunk in chunks), [conditions] * workers)
+        return pd.concat(list(parts))
+
+# Condition results are kept next to the table (<table>.conditions.npz), so when the scale is changed only
+# new or changed conditions are evaluated again; the file is ignored once the table changes
+def condition_cache_path(table_file):
+    return Path(f"{table_file}.conditions.npz")
+
+def table_signature(table_file):
+    stat = Path(table_file).stat()
+    return f"{Path(table_file).resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def condition_name(key):
+    return "c" + hashlib.sha1(key.encode()).hexdigest()
+
+def load_condition_cache(table_file):
+    path = condition_cache_path(table_file)
+    if not path.exists():
+        return {}
+    try:
+        with np.load(path) as cached:
+            if str(cached["signature"]) != table_signature(table_file):
+                return {}
+            return {name: cached[name] for name in cached.files if name != "signature"}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def save_condition_cache(table_file, results):
+    path = condition_cache_path(table_file)
+    tmp_path = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp_path, signature=np.array(table_signature(table_file)), **results)
+    os.replace(tmp_path, path)
+
+# Function to turn the per-tool condition results into a level per criterion
+def score_levels(tool_conditions, rules):
+    levels = pd.DataFrame(index=tool_conditions.index)
+    for rule in rules:
+        holds, choices = [], []
+        for level in rule["levels"]:
+            checks = []
+            for condition in level.get("any", []) + level.get("all", []):
+                if "criteria" in condition:
+                    checks.append(levels[condition["criteria"]].mean(axis=1).to_numpy() >= condition["mean_at_least"])
+                else:
+                    checks.append(tool_conditions[condition_key(condition)].to_numpy())
+            if "all" in level:
+                holds.append(np.logical_and.reduce(checks))
+            else:
+                holds.append(np.logical_or.reduce(checks))
+            choices.append(level["level"])
+        # The first level that holds wins
+        levels[rule["criterion"]] = np.select(holds, choices, default=rule.get("default", 1)) if holds else rule.get("default", 1)
+    return levels
+
+# Function to score every tool of a json2tsv/combine_tsv table
+# Returns one row per tool: the level of every criterion, the total and the total as a percentage of the maximum
+# With table_file, condition results are cached next to the table (see load_condition_cache)
+def score_tools(df, rules=RULES, workers=1, table_file=None):
+    conditions = row_conditions(rules)
+    cached = load_condition_cache(table_file) if table_file else {}
+    todo = {key: condition for key, condition in conditions.items() if condition_name(key) not in cached}
+    logging.info(f"{len(conditions) - len(todo)} conditions taken from the cache, {len(todo)} to evaluate")
+
+    if todo:
+        if workers > 1 and len(df) > 10000:
+            evaluated = evaluate_parallel(df, todo, workers)
+        else:
+            evaluated = evaluate_conditions(df, todo)
+        cached.update({condition_name(key): evaluated[key].to_numpy() for key in todo})
+        if table_file:
+            save_condition_cache(table_file, cached)
+    results = pd.DataFrame({key: cached[condition_name(key)] for key in conditions}, index=df.index)
+
+    # One row per publication: a tool meets a condition if any of its rows does
+    tool_conditions = results.groupby(df["Name"].to_numpy(), sort=False).any()
+    levels = score_levels(tool_conditions, rules)
+
+    criteria = [rule["criterion"] for rule in rules]
+    max_total = sum(max([level["level"] for level in rule["levels"]] + [rule.get("default", 1)]) for rule in rules)
+    levels["Total"] = levels[criteria].sum(axis=1)
+    levels["Score (%)"] = (100 * levels["Total"] / max_total).round(1)
+    levels.index.name = "Name"
+    return levels.reset_index()
+
+# Function to read a json2tsv/combine_tsv output (.tsv or .parquet)
+def read_table(table_file):
+    if Path(table_file).suffix.lower() == ".parquet":
+        return pd.read_parquet(table_file)
+    return pd.read_csv(table_file, sep='\t', dtype=str, keep_default_na=False)
+
+def main():
+    parser = argparse.ArgumentParser(description='Score the reproducibility of every tool in a json2tsv/combine_tsv table.')
+    parser.add_argument('table', type=str, help='Input table (.tsv or .parquet).')
+    parser.add_argument('output', type=str, help='Output tsv file with one row per tool.')
+    parser.add_argument('--rules', type=str, default=None, help='JSON file with the scoring rules (default: the built-in scale).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes for evaluating the rules.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the cache of rule results next to the table.')
+    args = parser.parse_args()
+
+    if not Path(args.table).exists():
+        logging.error(f"Input file does not exist: {args.table}")
+        return
+
+    rules = load_rules(args.rules) if args.rules else RULES
+    df = read_table(args.table)
+    start_time = time.perf_counter()
+    scores = score_tools(df, rules, args.workers, None if args.no_cache else args.table)
+    logging.info(f"{len(scores)} tools scored in {time.perf_counter() - start_time:.2f}s")
+
+    scores.sort_values(["Total", "Name"], ascending=[False, True]).to_csv(args.output, sep='\t', index=False)
+    logging.info(f"Scores saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import pandas as pd
+import argparse
+import logging
+import re
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Screening terms from workflow/steps.txt (A. Literature search)
+# Terms are matched as whole words, so plurals and other forms are listed explicitly
+# 1. Articles with these words in the title are removed
+EXCLUDE_TERMS = ["Single-cell", "RNA", "RNAs", "Genetic", "Genetics", "Gene", "Genes", "Genomic", "Genomics",
+                 "Metabolomic", "Metabolomics"]
+# 2. Of the rest, articles with these words in the title are kept
+PROTEOMICS_TERMS = ["Protein", "Proteomic", "Proteins", "Proteome", "Proteomes", "Proteomics", "Mass spectrometry",
+                    "MS/MS"]
+# 3. Of those, articles with these keywords are the ones investigated further
+FOCUS_TERMS = ["Reproducible", "Reproducibility", "Workflow", "Workflows", "Pipeline", "Pipelines", "Standard",
+               "Standards", "Standardized", "Bioinformatics", "Bioinformatic", "Tool", "Tools", "Computational",
+               "Computation"]
+
+# MEDLINE/PubMed format tags we keep, and the column names they get (same as PubMed's CSV export)
+MEDLINE_TAGS = {"PMID": "PMID", "TI": "Title", "AB": "Abstract", "DP": "Publication Year", "JT": "Journal/Book", "LID": "DOI"}
+
+# Function to compile a list of terms into one case-insensitive regular expression
+# match: "word" only matches whole words (so "Gene" matches "Gene" and "gene-level" but not "general" or "Generic"),
+# "prefix" matches at the start of a word (so "Gene" also matches "general", "Generic" and "Next-generation"),
+# "substring" matches anywhere (like a spreadsheet "contains" filter, so "RNA" also matches "internal")
+def compile_terms(terms, match="word"):
+    # Longest terms first, so the reported term is the most specific one (e.g. "Proteomics" rather than "Proteomic")
+    alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    if match == "word":
+        pattern = rf"(?<!\w)({alternatives})(?!\w)"
+    elif match == "prefix":
+        pattern = rf"(?<!\w)({alternatives})"
+    else:
+        pattern = f"({alternatives})"
+    return re.compile(pattern, re.IGNORECASE)
+
+# Function to read a MEDLINE/PubMed format export one record at a time
+# Records are separated by blank lines, continuation lines start with spaces
+def iter_medline_records(path):
+    record = {}
+    tag = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                if record:
+                    yield record
+                record, tag = {}, None
+            elif line.startswith("      ") and tag:
+                if tag in MEDLINE_TAGS:
+                    record[MEDLINE_TAGS[tag]] += " " + line.strip()
+            elif len(line) > 4 and line[4] == "-":
+                tag = line[:4].strip()
+                value = line[6:].strip()
+                # LID holds several identifiers, only keep the DOI
+                if tag == "LID" and not value.endswith("[doi]"):
+                    tag = None
+                    continue
+                if tag == "LID":
+                    value = value.replace(" [doi]", "")
+                if tag in MEDLINE_TAGS and MEDLINE_TAGS[tag] not in record:
+                    record[MEDLINE_TAGS[tag]] = value
+    if record:
+        yield record
+
+# Function to read an export in chunks of DataFrames, so memory stays bounded for any number of records
+# A .csv file is read as PubMed's CSV export, anything else as MEDLINE format
+def read_chunks(path, chunksize=100000):
+    if Path(path).suffix.lower() == ".csv":
+        yield from pd.read_csv(path, dtype=str, chunksize=chunksize, keep_default_na=False)
+        return
+
+    chunk = []
+    for record in iter_medline_records(path):
+        chunk.append(record)
+        if len(chunk) == chunksize:
+            yield pd.DataFrame(chunk, columns=list(MEDLINE_TAGS.values()))
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=list(MEDLINE_TAGS.values()))
+
+# Function to screen one chunk of records, returns (kept, dropped), both with a Reason column
+# The stages run one after the other like the manual screening, each only on the records the previous stage kept,
+# and each is one vectorised regular expression pass that also gives the matched term
+def screen_chunk(df, exclude, proteomics, focus, title_column="Title", focus_columns=("Title",)):
+    titles = df[title_column].fillna("")
+    reason = pd.Series("", index=df.index, dtype=object)
+
+    # 1. Drop titles with an excluded term
+    excluded_term = titles.str.extract(exclude, expand=False)
+    is_excluded = excluded_term.notna()
+    reason[is_excluded] = "excluded term in title: " + excluded_term[is_excluded]
+    remaining = titles[~is_excluded]
+
+    # 2. Keep titles with a proteomics term
+    proteomics_term = remaining.str.extract(proteomics, expand=False)
+    reason[proteomics_term.index[proteomics_term.isna()]] = "no proteomics term in title"
+    remaining_index = proteomics_term.index[proteomics_term.notna()]
+
+    # 3. Keep records with a focus keyword
+    if tuple(focus_columns) == (title_column,):
+        focus_text = titles[remaining_index]
+    else:
+        focus_text = df.loc[remaining_index, list(focus_columns)].fillna("").agg(" ".join, axis=1)
+    focus_term = focus_text.str.extract(focus, expand=False)
+    reason[focus_term.index[focus_term.isna()]] = "no focus keyword"
+
+    kept_index = focus_term.index[focus_term.notna()]
+    reason[kept_index] = "kept: " + proteomics_term[kept_index] + ", " + focus_term[kept_index]
+
+    is_kept = df.index.isin(kept_index)
+    return df[is_kept].assign(Reason=reason[is_kept]), df[~is_kept].assign(Reason=reason[~is_kept])
+
+# Function to screen a whole export, writing kept and dropped records to two TSV files as it goes
+def screen_export(export_file, kept_file, dropped_file, match="word", focus_fields="title", chunksize=100000):
+    exclude = compile_terms(EXCLUDE_TERMS, match)
+    proteomics = compile_terms(PROTEOMICS_TERMS, match)
+    focus = compile_terms(FOCUS_TERMS, match)
+    focus_columns = {"title": ("Title",), "abstract": ("Abstract",), "both": ("Title", "Abstract")}[focus_fields]
+
+    n_kept = n_dropped = 0
+    first = True
+    for chunk in read_chunks(export_file, chunksize):
+        for column in focus_columns:
+            if column not in chunk.columns:
+                chunk[column] = ""
+        kept, dropped = screen_chunk(chunk, exclude, proteomics, focus, focus_columns=focus_columns)
+        # The header is only written with the first chunk, later chunks are appended
+        kept.to_csv(kept_file, sep='\t', index=False, mode='w' if first else 'a', header=first)
+        dropped.to_csv(dropped_file, sep='\t', index=False, mode='w' if first else 'a', header=first)
+        first = False
+        n_kept += len(kept)
+        n_dropped += len(dropped)
+
+    logging.info(f"{n_kept} records kept, {n_dropped} dropped.")
+    return n_kept, n_dropped
+
+def main():
+    parser = argparse.ArgumentParser(description='Screen a PubMed export by title, following the literature search in workflow/steps.txt.')
+    parser.add_argument('export', type=str, help='PubMed export: CSV (.csv) or MEDLINE/PubMed format.')
+    parser.add_argument('kept', type=str, help='Output tsv file for the kept records.')
+    parser.add_argument('dropped', type=str, help='Output tsv file for the dropped records, with the reason.')
+    parser.add_argument('--match', choices=['prefix', 'word', 'substring'], default='word', help='How terms are matched (default: whole words only).')
+    parser.add_argument('--focus-fields', choices=['title', 'abstract', 'both'], default='title', help='Where to look for the focus keywords.')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Number of records screened at a time.')
+    args = parser.parse_args()
+
+    if not Path(args.export).exists():
+        logging.error(f"Input file does not exist: {args.export}")
+        return
+
+    screen_export(args.export, args.kept, args.dropped, args.match, args.focus_fields, args.chunksize)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import pandas as pd
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Columns of the combined table (see combine_tsv.py) that are searched, and how much a match in each counts
+SEARCH_FIELDS = {"Name": 10.0, "Description": 4.0, "Topic": 4.0, "Abstract": 1.0, "License": 1.0}
+
+# Changed whenever the layout of the index changes, so older indexes are rebuilt
+INDEX_FORMAT = "1"
+
+# Columns holding comma-separated values that can be used as filters and are counted as facets
+FACET_FIELDS = ["Operating System", "Language", "Tool Type"]
+
+# Function to quote a column name for SQL ("Tool Type" -> "Tool Type" with quotes)
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+# Function to read the combined table in chunks, a .parquet file or a tsv file
+def read_table(table_file, chunksize=100000):
+    if Path(table_file).suffix.lower() == ".parquet":
+        df = pd.read_parquet(table_file).fillna("").astype(str)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+    else:
+        yield from pd.read_csv(table_file, sep='\t', dtype=str, keep_default_na=False, chunksize=chunksize)
+
+# Function to split a comma-separated field into its values ("Linux, Mac" -> ["Linux", "Mac"])
+def split_values(text):
+    return [value.strip() for value in text.split(",") if value.strip() and value.strip().lower() != "nan"]
+
+# Function to tell whether the index was built from the current version of the table
+def index_is_current(table_file, index_file):
+    if not Path(index_file).exists():
+        return False
+    stat = os.stat(table_file)
+    connection = sqlite3.connect(index_file)
+    try:
+        meta = dict(connection.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        connection.close()
+    return meta.get("format") == INDEX_FORMAT and meta.get("source") == str(Path(table_file).resolve()) and meta.get("size") == str(stat.st_size) \
+        and meta.get("mtime_ns") == str(stat.st_mtime_ns)
+
+# Function to build the search index of a combined table
+# The rows go to a tools table, the searched columns to an FTS5 full-text index on top of it and the
+# filter columns, split into single values, to a facets table. The combined table has one row per
+# publication, so rows of the same tool share a tool number and the facets are stored once per tool.
+# The index is written to a temporary file and moved into place at the end, so searches never see a
+# half-built index.
+def build_index(table_file, index_file, chunksize=100000):
+    index_file = Path(index_file)
+    tmp_file = index_file.with_name(index_file.name + ".tmp")
+    tmp_file.unlink(missing_ok=True)
+    stat = os.stat(table_file)
+    start_time = time.perf_counter()
+
+    connection = sqlite3.connect(tmp_file)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+
+    n_rows = 0
+    columns = None
+    tool_numbers = {}
+    for chunk in read_table(table_file, chunksize):
+        if columns is None:
+            columns = list(chunk.columns)
+            search_fields = [field for field in SEARCH_FIELDS if field in columns]
+            if "Name" not in columns or not search_fields:
+                connection.close()
+                tmp_file.unlink()
+                raise ValueError(f"{table_file} does not look like a combined bio.tools table (no Name or searched columns)")
+            connection.execute(f"CREATE TABLE tools (id INTEGER PRIMARY KEY, tool INTEGER, {', '.join(quote(c) + ' TEXT' for c in columns)})")
+            connection.execute(f"CREATE VIRTUAL TABLE tools_fts USING fts5({', '.join(quote(f) for f in search_fields)},"
+                               f" content='tools', content_rowid='id')")
+            connection.execute("CREATE TABLE facets (tool INTEGER, field TEXT, value TEXT)")
+
+        ids = range(n_rows + 1, n_rows + len(chunk) + 1)
+        # Only the first row of a tool gives its facets
+        tools, first_rows = [], []
+        for i, name in enumerate(chunk["Name"]):
+            if name not in tool_numbers:
+                tool_numbers[name] = len(tool_numbers)
+                first_rows.append(i)
+            tools.append(tool_numbers[name])
+        placeholders = ", ".join("?" * (len(columns) + 2))
+        with connection:
+            connection.executemany(f"INSERT INTO tools VALUES ({placeholders})",
+                                   ((i, tool, *row) for i, tool, row in zip(ids, tools, chunk[columns].itertuples(index=False))))
+            for field in FACET_FIELDS:
+                if field in columns:
+                    values = chunk[field].to_numpy()
+                    connection.executemany("INSERT INTO facets VALUES (?, ?, ?)",
+                                           ((tools[i], field, value) for i in first_rows for value in split_values(values[i])))
+        n_rows += len(chunk)
+
+    if columns is None:
+        connection.close()
+        tmp_file.unlink()
+        raise ValueError(f"No rows in {table_file}")
+
+    with connection:
+        # Filling the full-text index in one go is much faster than row by row
+        connection.execute("INSERT INTO tools_fts(tools_fts) VALUES ('rebuild')")
+        connection.execute("CREATE INDEX facets_value ON facets (field, value COLLATE NOCASE, tool)")
+        connection.execute("CREATE INDEX facets_tool ON facets (tool)")
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ("format", INDEX_FORMAT), ("source", str(Path(table_file).resolve())), ("size", str(stat.st_size)),
+            ("mtime_ns", str(stat.st_mtime_ns)), ("search_fields", ",".join(search_fields))
+        ])
+    connection.close()
+    os.replace(tmp_file, index_file)
+    logging.info(f"Indexed {n_rows} rows ({len(tool_numbers)} tools) of {table_file} in {time.perf_counter() - start_time:.1f}s")
+
+# Function to turn free text into an FTS5 query: every word must match, punctuation is taken literally
+# (with raw=True the text is passed on as an FTS5 query, e.g. 'Name:maxquant OR Topic:"mass spectrometry"')
+def fts_query(text, raw=False):
+    if raw:
+        return text
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+# Function to search the index
+# query: free text (or an FTS5 query with raw=True), None to only filter
+# filters: {field: value} on the FACET_FIELDS, e.g. {"Operating System": "Linux", "Language": "Python"}
+# The combined table has one row per publication, so results are grouped by tool name with the best
+# matching row kept. Returns (results DataFrame with a score column, lower is better, {field: facet counts})
+def search(index_file, query=None, filters=None, limit=20, raw=False):
+    connection = sqlite3.connect(index_file)
+    search_fields = dict(connection.execute("SELECT key, value FROM meta"))["search_fields"].split(",")
+
+    if query:
+        weights = ", ".join(str(SEARCH_FIELDS[field]) for field in search_fields)
+        matched = f"SELECT rowid AS id, bm25(tools_fts, {weights}) AS score FROM tools_fts WHERE tools_fts MATCH ?"
+        params = [fts_query(query, raw)]
+    else:
+        matched = "SELECT id, 0.0 AS score FROM tools"
+        params = []
+
+    # Best score of every matching tool, kept in a temporary table for the results and the facets
+    # (bm25() only works directly on the full-text table, so the matching rows are stored first)
+    connection.execute("DROP TABLE IF EXISTS temp.hits")
+    connection.execute("DROP TABLE IF EXISTS temp.matches")
+    connection.execute("CREATE TEMP TABLE hits (id INTEGER PRIMARY KEY, score REAL)")
+    connection.execute(f"INSERT INTO hits {matched}", params)
+    connection.execute("CREATE TEMP TABLE matches (tool INTEGER PRIMARY KEY, id INTEGER, score REAL)")
+    # SQLite takes id from the row with the lowest score for MIN()
+    connection.execute("INSERT INTO matches SELECT t.tool, h.id, MIN(h.score) FROM hits h JOIN tools t ON t.id = h.id GROUP BY t.tool")
+    # The filters are applied afterwards: in one statement SQLite would run the full-text query again for every row
+    for field, value in (filters or {}).items():
+        connection.execute("DELETE FROM matches WHERE tool NOT IN"
+                           " (SELECT tool FROM facets WHERE field = ? AND value = ? COLLATE NOCASE)", (field, value))
+
+    results = pd.read_sql_query(
+        "SELECT t.*, m.score FROM matches m JOIN tools t ON t.id = m.id ORDER BY m.score, t.Name LIMIT ?",
+        connection, params=[limit]
+    ).drop(columns=["id", "tool"])
+
+    # CROSS JOIN makes SQLite start from the (usually few) matches instead of scanning all facets
+    facets = {}
+    for field, value, count in connection.execute(
+            "SELECT f.field, f.value, COUNT(*) AS n FROM matches m CROSS JOIN facets f ON f.tool = m.tool"
+            " GROUP BY f.field, f.value ORDER BY f.field, n DESC, f.value"):
+        facets.setdefault(field, {})[value] = count
+    connection.close()
+    return results, facets
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and search a full-text index of the combined bio.tools table.')
+    parser.add_argument('table', type=str, help='Combined table from combine_tsv.py (.tsv or .parquet).')
+    parser.add_argument('query', type=str, nargs='?', default=None, help='Words to search for (all must match).')
+    parser.add_argument('--index', type=str, default=None, help='Index file (default: <table>.search.sqlite); rebuilt when the table changes.')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index even if it is up to date.')
+    parser.add_argument('--raw', action='store_true', help='Pass the query on as FTS5 syntax (field:word, OR, NOT, "phrases", prefix*).')
+    parser.add_argument('--os', type=str, default=None, help='Only tools for this operating system.')
+    parser.add_argument('--language', type=str, default=None, help='Only tools in this programming language.')
+    parser.add_argument('--tool-type', type=str, default=None, help='Only tools of this type.')
+    parser.add_argument('--limit', type=int, default=20, help='Maximum number of tools shown.')
+    parser.add_argument('--facets', action='store_true', help='Also show the number of matching tools per operating system, language and tool type.')
+    parser.add_argument('--output', type=str, default=None, help='Save the results as a tsv file instead of printing them.')
+    args = parser.parse_intermixed_args()
+
+    if not Path(args.table).exists():
+        logging.error(f"Input file does not exist: {args.table}")
+        return
+
+    index_file = args.index or f"{args.table}.search.sqlite"
+    if args.rebuild or not index_is_current(args.table, index_file):
+        build_index(args.table, index_file)
+
+    filters = {field: value for field, value in
+               zip(FACET_FIELDS, [args.os, args.language, args.tool_type]) if value}
+    start_time = time.perf_counter()
+    try:
+        results, facets = search(index_file, args.query, filters, args.limit, args.raw)
+    except sqlite3.OperationalError as e:
+        logging.error(f"Invalid query {args.query!r}: {e}")
+        return
+    logging.info(f"{len(results)} tools found in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    if args.output:
+        results.to_csv(args.output, sep='\t', index=False)
+    else:
+        shown = [column for column in ["Name", "Homepage", "Tool Type", "score"] if column in results.columns]
+        print(results[shown].to_string(index=False))
+
+    if args.facets:
+        for field, counts in facets.items():
+            print(f"\n{field}:")
+            for value, count in counts.items():
+                print(f"  {value}\t{count}")
+
+if __name__ == "__main__":
+    main()
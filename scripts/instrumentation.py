@@ -0,0 +1,201 @@
+#Timings and peak memory of the phases of the scripts (fetch, parse, transform, write), and a JSON run report.
+#
+#A phase is timed with
+#
+#    with instrumentation.span("json2tsv.write") as phase:
+#        ...
+#        phase.items += len(rows)
+#
+#Spans with the same name are added up (calls, seconds, longest call, items), so a phase that runs once per batch or
+#per page gives one line in the report. A span costs two clock reads and a dict update, it is meant for phases and
+#batches, not for single entries. Spans in threads overlap: the seconds of a phase run by 8 threads can add up to more
+#than the wall time, items per second are then per thread.
+#
+#Peak memory is sampled by a background thread reading the resident set size of the process and of its child processes
+#(the worker processes of combine_tsv.py and ssgsea.py) every interval. Every span keeps the highest value sampled while
+#it was open. The report also has the kernel's high-water mark (getrusage), which catches peaks between two samples
+#but does not say in which phase they were. Sampling only runs between start() and report(), without it the spans only
+#time.
+#
+#The scripts in biotools/ and other/ put this directory on sys.path to import it, like pipeline.py does for them.
+
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#Resident set size from /proc (Linux), in bytes; None where /proc is not there
+def rss_bytes(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def child_pids():
+    pids = []
+    try:
+        for task in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids.extend(f.read().split())
+    except OSError:
+        pass
+    return pids
+
+#Resident set size of the process and its running child processes, in bytes
+def total_rss_bytes():
+    total = rss_bytes()
+    if total is None:
+        return None
+    return total + sum(rss_bytes(pid) or 0 for pid in child_pids())
+
+#High-water mark of the resident set size of the process and of its finished child processes (the largest of them),
+#in bytes; None without the resource module (Windows)
+def max_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+#One open span; items is what the phase went through (tools, rows, bytes), for the throughput in the report
+class Span:
+    def __init__(self, recorder, name, items=0):
+        self.recorder = recorder
+        self.name = name
+        self.items = items
+        self.peak_rss = None
+
+    def __enter__(self):
+        self.recorder.open(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.seconds = time.perf_counter() - self.start
+        self.recorder.close(self)
+        return False
+
+#Collects the spans of a run and samples the memory while it is started
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.phases = {}
+            self.open_spans = set()
+            self.peak_rss = None
+            self.started = datetime.now(timezone.utc)
+            self.start_time = time.perf_counter()
+            self.sampler = None
+            self.stopping = threading.Event()
+
+    def span(self, name, items=0):
+        return Span(self, name, items)
+
+    def open(self, span):
+        with self.lock:
+            self.open_spans.add(span)
+        if self.sampler is not None:
+            self.sample()
+
+    def close(self, span):
+        if self.sampler is not None:
+            self.sample()
+        with self.lock:
+            self.open_spans.discard(span)
+            phase = self.phases.setdefault(span.name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "items": 0,
+                                                       "peak_rss_bytes": None})
+            phase["calls"] += 1
+            phase["seconds"] += span.seconds
+            phase["max_seconds"] = max(phase["max_seconds"], span.seconds)
+            phase["items"] += span.items
+            if span.peak_rss is not None:
+                phase["peak_rss_bytes"] = max(phase["peak_rss_bytes"] or 0, span.peak_rss)
+
+    def sample(self):
+        rss = total_rss_bytes()
+        if rss is None:
+            return
+        with self.lock:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+            for span in self.open_spans:
+                span.peak_rss = max(span.peak_rss or 0, rss)
+
+    def _sample_loop(self, interval):
+        while not self.stopping.wait(interval):
+            self.sample()
+
+    #Starts a new run and the memory sampling (every interval seconds)
+    def start(self, interval=0.05):
+        self.stop()
+        self.reset()
+        if total_rss_bytes() is None:
+            logging.debug("No /proc to sample the memory from, only the high-water mark is reported")
+            return
+        self.sampler = threading.Thread(target=self._sample_loop, args=(interval,), name="memory-sampler", daemon=True)
+        self.sampler.start()
+        self.sample()
+
+    def stop(self):
+        if self.sampler is not None:
+            self.stopping.set()
+            self.sampler.join()
+            self.sampler = None
+            self.sample()
+
+    #The run so far: wall time, memory and the phases, with anything given in extra (e.g. the inputs) added
+    def report(self, **extra):
+        if self.sampler is not None:
+            self.sample()
+        with self.lock:
+            phases = {}
+            for name, phase in sorted(self.phases.items()):
+                phase = {**phase, "seconds": round(phase["seconds"], 6), "max_seconds": round(phase["max_seconds"], 6)}
+                if phase["items"] and phase["seconds"]:
+                    phase["items_per_second"] = round(phase["items"] / phase["seconds"], 1)
+                phases[name] = phase
+            return {"started": self.started.isoformat(), "seconds": round(time.perf_counter() - self.start_time, 6),
+                    "argv": sys.argv, "python": sys.version.split()[0], "platform": platform.platform(),
+                    "cpus": os.cpu_count(), "peak_rss_bytes": self.peak_rss, "max_rss_bytes": max_rss_bytes(),
+                    "phases": phases, **extra}
+
+    #Stops the sampling and writes the report as JSON
+    def write_report(self, path, **extra):
+        self.stop()
+        report = self.report(**extra)
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=4, default=str)
+        os.replace(tmp_path, path)
+        logging.info(f"Run report saved to {path}")
+        return report
+
+#The recorder the scripts report to
+recorder = Recorder()
+
+def span(name, items=0):
+    return recorder.span(name, items)
+
+def start(interval=0.05):
+    recorder.start(interval)
+
+def report(**extra):
+    return recorder.report(**extra)
+
+def write_report(path, **extra):
+    return recorder.write_report(path, **extra)
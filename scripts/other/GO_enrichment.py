@@ -1,15 +1,182 @@
-from gprofiler import GProfiler
+import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-# Create a gProfiler object
-gp = GProfiler(return_dataframe=True)  # Use return_dataframe=True to get results as a pandas DataFrame
+import pandas as pd
 
-# Perform enrichment analysis
-enrichment_results = gp.profile(
-    query=["gene1", "gene2", "gene3"],  # List of genes
-    organism="hsapiens",  # Organism
-    sources=['GO:BP'],  # Functional categories (e.g., GO Biological Process)
-    user_threshold=0.05  # Significance threshold
-)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-print(enrichment_results)
-at 
+# Default example query
+default_query = ["gene1", "gene2", "gene3"]
+
+# g:Profiler address; an archived release (e.g. https://biit.cs.ut.ee/gprofiler_archive3/e108_eg55_p17) pins the annotations
+gprofiler_url = "https://biit.cs.ut.ee/gprofiler"
+
+# Reads gene lists, either from a directory (one file per list, one gene per line, the file name is the list ID)
+# or from a table with a list ID column and a gene column
+def read_gene_lists(lists_dir=None, table=None, list_column="list_id", gene_column="gene"):
+    gene_lists = {}
+    if lists_dir:
+        for path in sorted(Path(lists_dir).iterdir()):
+            if path.is_file():
+                with open(path) as f:
+                    gene_lists[path.stem] = [line.strip() for line in f if line.strip()]
+    if table:
+        df = pd.read_csv(table, sep=None, engine="python", dtype=str)
+        for list_id, genes in df.groupby(list_column, sort=True)[gene_column]:
+            gene_lists[list_id] = genes.dropna().tolist()
+    return gene_lists
+
+# Cache key of one enrichment: the same genes (in any order), organism, sources, threshold and annotation
+# version always give the same result
+def cache_key(genes, organism, sources, threshold, annotation_version):
+    key = json.dumps([sorted(set(genes)), organism, sorted(sources), threshold, annotation_version])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+# Results are pickled, so list columns (e.g. g:Profiler's parents) come back exactly as they were
+def load_cached(cache_dir, key):
+    path = Path(cache_dir) / f"{key}.pkl"
+    if not path.exists():
+        return None
+    return pd.read_pickle(path)
+
+def store_cached(cache_dir, key, result):
+    path = Path(cache_dir) / f"{key}.pkl"
+    tmp_path = path.with_name(path.name + ".tmp")
+    result.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+# Release of the annotations g:Profiler currently serves (Ensembl, Ensembl Genomes and g:Profiler versions),
+# as reported by its API; None if it cannot be asked
+def gprofiler_release(base_url=gprofiler_url):
+    import requests
+
+    try:
+        response = requests.get(f"{base_url.rstrip('/')}/api/util/current_version", timeout=30)
+        response.raise_for_status()
+        return json.dumps(response.json(), sort_keys=True)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.warning(f"Could not get the g:Profiler release from {base_url}: {e}")
+        return None
+
+# What the online results depend on besides the query: an archive URL is pinned to one release, the live service
+# changes with every release, so its current release is part of the key. None (no caching) if the release is unknown.
+def online_annotation_version(base_url=gprofiler_url):
+    if "gprofiler_archive" in base_url:
+        return base_url
+    release = gprofiler_release(base_url)
+    return f"{base_url}:{release}" if release else None
+
+# Enrichment of one gene list with g:Profiler
+def run_gprofiler(genes, organism, sources, threshold, base_url=gprofiler_url):
+    from gprofiler import GProfiler
+
+    # Create a gProfiler object
+    gp = GProfiler(return_dataframe=True, base_url=base_url)  # Use return_dataframe=True to get results as a pandas DataFrame
+
+    # Perform enrichment analysis
+    return gp.profile(
+        query=genes,  # List of genes
+        organism=organism,  # Organism
+        sources=sources,  # Functional categories (e.g., GO Biological Process)
+        user_threshold=threshold  # Significance threshold
+    )
+
+# Enrichment of many gene lists, returns one long table with a list_id column
+# Results are cached in cache_dir, so lists that were already analysed with the same settings (and the same g:Profiler
+# release, see online_annotation_version) are not run again.
+# Uncached lists go to g:Profiler, at most `workers` at a time, or, if annotations (see go_offline.py) are given,
+# are all tested together offline.
+def enrich_gene_lists(gene_lists, organism="hsapiens", sources=("GO:BP",), threshold=0.05, workers=4,
+                      cache_dir="enrichment_cache", annotations=None, correction="fdr", base_url=gprofiler_url):
+    sources = list(sources)
+    os.makedirs(cache_dir, exist_ok=True)
+    if annotations is not None:
+        annotation_version = f"offline:{annotations.version}:{correction}"
+    else:
+        annotation_version = online_annotation_version(base_url)
+        if annotation_version is None:
+            logging.warning("g:Profiler release unknown, results are neither taken from nor saved to the cache")
+
+    keys = {list_id: cache_key(genes, organism, sources, threshold, annotation_version) for list_id, genes in gene_lists.items()}
+    results = {}
+    for list_id, key in keys.items():
+        cached = load_cached(cache_dir, key) if annotation_version is not None else None
+        if cached is not None:
+            results[list_id] = cached
+    to_run = [list_id for list_id in gene_lists if list_id not in results]
+    logging.info(f"{len(gene_lists) - len(to_run)} gene lists taken from the cache, {len(to_run)} to run")
+
+    if to_run and annotations is not None:
+        import go_offline
+        offline = go_offline.enrich(annotations, {list_id: gene_lists[list_id] for list_id in to_run},
+                                    sources=sources, threshold=threshold, correction=correction)
+        for list_id in to_run:
+            results[list_id] = offline[offline["query"] == list_id].drop(columns="query")
+            store_cached(cache_dir, keys[list_id], results[list_id])
+    elif to_run:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {list_id: executor.submit(run_gprofiler, gene_lists[list_id], organism, sources, threshold, base_url)
+                       for list_id in to_run}
+            for list_id, future in futures.items():
+                try:
+                    results[list_id] = future.result()
+                except Exception as e:
+                    logging.error(f"Enrichment of {list_id} failed: {e}")
+                    continue
+                if annotation_version is not None:
+                    store_cached(cache_dir, keys[list_id], results[list_id])
+
+    combined = [result.assign(list_id=list_id) for list_id, result in results.items() if len(result)]
+    if not combined:
+        return pd.DataFrame(columns=["list_id"])
+    combined = pd.concat(combined, ignore_index=True)
+    # list_id first, lists in input order
+    combined["list_id"] = pd.Categorical(combined["list_id"], categories=list(gene_lists), ordered=True)
+    combined = combined.sort_values("list_id", kind="stable").reset_index(drop=True)
+    combined["list_id"] = combined["list_id"].astype(str)
+    return combined[["list_id"] + [column for column in combined.columns if column != "list_id"]]
+
+def main():
+    parser = argparse.ArgumentParser(description="GO enrichment of one or many gene lists with g:Profiler, or offline from a local annotation file.")
+    parser.add_argument("genes", nargs="*", default=default_query, help="List of genes (when --lists or --table are not given).")
+    parser.add_argument("--lists", default=None, help="Directory with one gene list per file.")
+    parser.add_argument("--table", default=None, help="Table of gene lists with 'list_id' and 'gene' columns.")
+    parser.add_argument("--output", default=None, help="Combined results (.parquet or .tsv); printed if not given.")
+    parser.add_argument("--organism", default="hsapiens", help="Organism (g:Profiler only).")
+    parser.add_argument("--sources", nargs="+", default=["GO:BP"], help="Functional categories (e.g. GO Biological Process).")
+    parser.add_argument("--threshold", type=float, default=0.05, help="Significance threshold.")
+    parser.add_argument("--workers", type=int, default=4, help="Gene lists sent to g:Profiler at the same time.")
+    parser.add_argument("--cache-dir", default="enrichment_cache", help="Directory for cached results.")
+    parser.add_argument("--gprofiler-url", default=gprofiler_url, help="g:Profiler address (an archive URL pins the annotation version; otherwise cached results are tied to the current release).")
+    parser.add_argument("--annotations", default=None, help="GAF or GMT annotation file for offline enrichment (no web requests).")
+    parser.add_argument("--obo", default=None, help="GO ontology (OBO) for propagating GAF annotations to parent terms.")
+    parser.add_argument("--correction", choices=["fdr", "bonferroni"], default="fdr", help="Multiple testing correction for offline enrichment.")
+    args = parser.parse_args()
+
+    gene_lists = read_gene_lists(args.lists, args.table)
+    if not gene_lists:
+        gene_lists = {"query_1": args.genes}
+
+    annotations = None
+    if args.annotations:
+        # Perform enrichment analysis locally (see go_offline.py)
+        import go_offline
+        annotations = go_offline.load_annotations(args.annotations, args.obo)
+
+    enrichment_results = enrich_gene_lists(gene_lists, args.organism, args.sources, args.threshold, args.workers,
+                                           args.cache_dir, annotations, args.correction, args.gprofiler_url)
+
+    if args.output and args.output.endswith(".parquet"):
+        enrichment_results.to_parquet(args.output, index=False)
+    elif args.output:
+        enrichment_results.to_csv(args.output, sep="\t", index=False)
+    else:
+        print(enrichment_results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#Loader for protein abundance matrices (rows = proteins, columns = samples, tab-separated).
+#The text file is converted once into a binary NumPy file next to it (<matrix>.cache/), with the protein and sample
+#names in sidecar files. Later runs open the binary file memory-mapped, so the matrix is available in milliseconds
+#without parsing the text again and without reading it all into memory. The cache is rebuilt when the source file
+#changes (size or modification time) or when another dtype or missing-value handling is asked for.
+
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+#Where the cache of an abundance matrix is kept
+def cache_dir_for(matrix_file):
+    matrix_file = Path(matrix_file)
+    return matrix_file.with_name(matrix_file.name + ".cache")
+
+#What the cache must match to be used
+def cache_key(matrix_file, dtype, fill_value):
+    stat = os.stat(matrix_file)
+    return {
+        "version": CACHE_VERSION,
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "dtype": np.dtype(dtype).name,
+        "fill_value": fill_value,
+    }
+
+def read_names(path):
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f]
+
+def write_names(path, names):
+    with open(path, "w") as f:
+        for name in names:
+            f.write(f"{name}\n")
+
+#Converts the text matrix into the binary cache, reading chunksize rows at a time
+#Missing values stay NaN, or are replaced by fill_value if it is given
+def build_cache(matrix_file, cache_dir, dtype="float32", fill_value=None, chunksize=10000):
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Number of proteins, needed to size the binary file before filling it
+    with open(matrix_file) as f:
+        n_rows = sum(1 for line in f if line.strip()) - 1
+    samples = list(pd.read_csv(matrix_file, sep="\t", index_col=0, nrows=0).columns)
+
+    tmp_values = cache_dir / "values.npy.tmp"
+    values = np.lib.format.open_memmap(tmp_values, mode="w+", dtype=dtype, shape=(n_rows, len(samples)))
+    proteins = []
+    n_missing = 0
+    row = 0
+    for chunk in pd.read_csv(matrix_file, sep="\t", index_col=0, chunksize=chunksize):
+        block = chunk.to_numpy(dtype=np.float64)
+        missing = np.isnan(block)
+        n_missing += int(missing.sum())
+        if fill_value is not None:
+            block[missing] = fill_value
+        values[row:row + len(block)] = block
+        proteins.extend(str(protein) for protein in chunk.index)
+        row += len(block)
+    values.flush()
+    del values
+
+    if row != n_rows:
+        raise ValueError(f"Expected {n_rows} proteins in {matrix_file}, read {row}")
+
+    os.replace(tmp_values, cache_dir / "values.npy")
+    write_names(cache_dir / "proteins.txt", proteins)
+    write_names(cache_dir / "samples.txt", samples)
+
+    # The key is written last, so an interrupted conversion is never mistaken for a valid cache
+    key = cache_key(matrix_file, dtype, fill_value)
+    key["missing_values"] = n_missing
+    with open(cache_dir / "cache.json", "w") as f:
+        json.dump(key, f, indent=4)
+
+    logging.info(f"Cached {matrix_file} ({n_rows} proteins x {len(samples)} samples, {n_missing} missing values) in {cache_dir}")
+
+#Returns True if the cache in cache_dir was made from the current matrix_file with the same settings
+def cache_is_valid(matrix_file, cache_dir, dtype, fill_value):
+    key_file = Path(cache_dir) / "cache.json"
+    if not key_file.exists():
+        return False
+    with open(key_file) as f:
+        stored = json.load(f)
+    stored.pop("missing_values", None)
+    return stored == cache_key(matrix_file, dtype, fill_value)
+
+#Loads an abundance matrix as a DataFrame (rows = proteins, columns = samples) backed by the memory-mapped cache
+#dtype is the storage type (float32 halves the memory of float64), fill_value replaces missing values (default: keep NaN)
+#With use_cache=False the text file is parsed directly, as before
+def load_abundance_matrix(matrix_file, dtype="float32", fill_value=None, use_cache=True, cache_dir=None):
+    if not use_cache:
+        abundance_df = pd.read_csv(matrix_file, sep="\t", index_col=0).astype(dtype)
+        if fill_value is not None:
+            abundance_df = abundance_df.fillna(fill_value)
+        return abundance_df
+
+    cache_dir = Path(cache_dir) if cache_dir else cache_dir_for(matrix_file)
+    if not cache_is_valid(matrix_file, cache_dir, dtype, fill_value):
+        build_cache(matrix_file, cache_dir, dtype, fill_value)
+
+    values = np.load(cache_dir / "values.npy", mmap_mode="r")
+    proteins = pd.Index(read_names(cache_dir / "proteins.txt"))
+    samples = pd.Index(read_names(cache_dir / "samples.txt"))
+
+    # copy=False keeps the DataFrame on top of the memory map instead of reading it into memory
+    return pd.DataFrame(values, index=proteins, columns=samples, copy=False)
@@ -1,53 +1,80 @@
 #load modules that will be used
 import os
+import sys
+import gzip
+import argparse
 import requests
 import logging
-from Bio import SeqIO
+from pathlib import Path
+from merge_fasta import merge_fasta
+from cached_download import download, ChecksumError
+
+#Phase timings and the run report (scripts/instrumentation.py, shared with the scripts in biotools/)
+if str(Path(__file__).resolve().parent.parent) not in sys.path:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import instrumentation
 
 # Configure logging with a basic configuration (https://docs.python.org/3/howto/logging-cookbook.html)
 #Logging messages which are less severe than level will be ignored
 logging.basicConfig(level=logging.INFO,format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Create a console handler and set its log level to INFO
-#StreamHandler sends logging output to streams such as sys.stdout, sys.stderr or any file-like object
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-
-# Create a formatter and add it to the console handler
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
-
-# Add the console handler to the root logger that is created
-logging.getLogger('').addHandler(console_handler)
+#basicConfig already sends the messages to the console (a second console handler printed every message twice,
+#also in scripts that import this one, like scripts/pipeline.py)
 
 #Defines the function. Give function a specific name. Specify the files that will be used in the command.
+#The download goes through the shared cache in cached_download.py: it is streamed to disk in chunks, and a repeat run
+#only checks with the server whether the file changed. A path ending in .gz is written gzip-compressed.
 def download_file(url, output_path):
-    #Sends an HTTP get request to the provided url using the requests library. The response from the server is stored in the response variable
-    response = requests.get(url)
-    #Checks if the HTTP response status code is 200, which indicates a successful request. If the condition is true, it means the file was successfully retrieved from the server.
-      if response.status_code == 200:
-        #Opens the output_path file in write mode ('w') using a context manager.
-        with open(output_path, 'w') as file:
-            #Writes the content of the response (the downloaded file) to the opened file
-            file.write(response.text)
-            #Print log message if successfully saved to output_path
-        logging.info(f"File saved as '{output_path}'")
-    else:
-        #Prints an error message with status code
-        logging.error("An error occurred while retrieving the file: %d", response.status_code)
+    try:
+        with instrumentation.span("add_contams.fetch") as phase:
+            download(url, output_path)
+            phase.items = os.path.getsize(output_path)
+    except (requests.exceptions.RequestException, ChecksumError) as e:
+        #Prints an error message with the reason
+        logging.error("An error occurred while retrieving the file: %s", e)
+
+#Opens a FASTA file for reading as text, whether it is gzip-compressed or not
+def open_fasta(path):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+#Copies the records of a FASTA file to an open output file one line at a time.
+#The output is the same as Biopython's SeqIO.write: header lines are kept, sequences are re-wrapped at 60 residues per line.
+#Only one line of sequence is held in memory at a time.
+def write_fasta_records(input_path, output_file, wrap=60):
+    sequence = ''
+    in_record = False
+    with open_fasta(input_path) as fasta:
+        for line in fasta:
+            if line.startswith('>'):
+                #Finish the previous record before writing the next header
+                if sequence:
+                    output_file.write(sequence + '\n')
+                sequence = ''
+                in_record = True
+                output_file.write('>' + line[1:].rstrip() + '\n')
+            elif in_record:
+                #Whitespace inside sequence lines is dropped, like Biopython does
+                sequence += ''.join(line.split())
+                while len(sequence) >= wrap:
+                    output_file.write(sequence[:wrap] + '\n')
+                    sequence = sequence[wrap:]
+    if sequence:
+        output_file.write(sequence + '\n')
 
 
 def concatenate_fasta_files(fasta_file_path, crap_file_path, output_file_path):
-    # Read sequences from the first input file
-    sequences1 = SeqIO.parse(fasta_file_path, "fasta")
+    #Write the records of both input files, one after the other, straight to the output file
+    #Reading and writing go line by line, so they are timed together as the write phase (items: bytes written)
+    with instrumentation.span("add_contams.write") as phase:
+        with open(output_file_path, 'w') as output_file:
+            # Copy sequences from the first input file
+            write_fasta_records(fasta_file_path, output_file)
 
-    # Read sequences from the second input file
-    sequences2 = SeqIO.parse(crap_file_path, "fasta")
-
-    # Concatenate the sequences
-    concatenated_sequences = list(sequences1) + list(sequences2)
-
-    SeqIO.write(concatenated_sequences, output_file_path, "fasta")
+            # Copy sequences from the second input file
+            write_fasta_records(crap_file_path, output_file)
+        phase.items = os.path.getsize(output_file_path)
 
     logging.info(f"Concatenated sequences saved to {output_file_path}")
 
@@ -59,21 +86,49 @@ crap_file_path = "crap.fasta"
 output_file_path = "HRP_contams.fasta"
 
 
-# Download FASTA file
-#Runs the download file command that was described above
-logging.info("Downloading FASTA file...")
-download_file(fasta_url, fasta_file_path)
-
-# Download contaminant file
-#Runs the download file command that was described above
-logging.info("Downloading contaminant file...")
-download_file(crap_url, crap_file_path)
+def main():
+    parser = argparse.ArgumentParser(description='Download the human proteome and cRAP and combine them into one FASTA file.')
+    parser.add_argument('--dedup', action='store_true', help='Drop duplicate accessions and identical sequences when merging.')
+    parser.add_argument('--contaminant-prefix', type=str, default='', help='Prefix added to contaminant identifiers with --dedup (e.g. CONTAM_).')
+    parser.add_argument('--decoy', choices=['reverse', 'shuffle'], default=None, help='Append decoy sequences with --dedup.')
+    parser.add_argument('--fasta-url', type=str, default=fasta_url, help='URL of the proteome FASTA file.')
+    parser.add_argument('--crap-url', type=str, default=crap_url, help='URL of the contaminant FASTA file.')
+    parser.add_argument('--output', type=str, default=output_file_path, help='Combined FASTA file.')
+    parser.add_argument('--report', type=str, default=None, help='Save the time and peak memory of each phase to this JSON file.')
+    args = parser.parse_args()
+
+    if args.report:
+        instrumentation.start()
+
+    # Download FASTA file
+    #Runs the download file command that was described above
+    logging.info("Downloading FASTA file...")
+    download_file(args.fasta_url, fasta_file_path)
+
+    # Download contaminant file
+    #Runs the download file command that was described above
+    logging.info("Downloading contaminant file...")
+    download_file(args.crap_url, crap_file_path)
+
+    #Contatenate fasta files
+    #Runs the concatenate command described above
+    if args.dedup:
+        #Merge with the indexed merge engine in merge_fasta.py, removing duplicated proteins
+        logging.info("Merging FASTA files...")
+        #Indexing, deduplication and writing all happen in merge_fasta, timed as one transform phase
+        with instrumentation.span("add_contams.transform"):
+            merge_fasta([fasta_file_path], [crap_file_path], args.output,
+                        contaminant_prefix=args.contaminant_prefix, decoy=args.decoy)
+    else:
+        logging.info("Concatenating FASTA files...")
+        concatenate_fasta_files(fasta_file_path, crap_file_path, args.output)
 
-#Contatenate fasta files
-#Runs the concatenate command described above
-logging.info("Concatenating FASTA files...")
-concatenate_fasta_files(fasta_file_path, crap_file_path, output_file_path)
 
+    #Gives a final log output if script was executed completely
+    logging.info("Script execution completed.")
+    if args.report:
+        instrumentation.write_report(args.report, output=args.output)
 
-#Gives a final log output if script was executed completely
-logging.info("Script execution completed.")
+#Only run the downloads when the script is run directly, so the functions can be imported
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+import benchmark_ssgsea_permutations
+import ssgsea_engine
+
+#Benchmark of the two ssGSEA scorers of ssgsea.py, the built-in one (ssgsea_engine.py) and gseapy, on the same
+#synthetic abundance matrix and random protein sets (by default 1000 samples and 5000 sets). Both get the same number
+#of processes and no permutations; the scores of the two are compared as well, so the timing is of equal work.
+
+#Scores as a sets x samples table of ES from the long result table of either engine
+def score_table(results):
+    return results.pivot(index="Term", columns="Name", values="ES").astype(float)
+
+def run_builtin(abundance_df, gene_sets, n_jobs):
+    return ssgsea_engine.ssgsea(abundance_df, gene_sets, n_jobs=n_jobs)
+
+def run_gseapy(abundance_df, gene_sets, n_jobs):
+    import gseapy as gp
+    return gp.ssgsea(data=abundance_df, gene_sets=gene_sets, outdir=None, sample_norm_method="rank", min_size=15,
+                     max_size=500, permutation_num=0, no_plot=True, threads=n_jobs, verbose=False).res2d
+
+ENGINES = {"builtin": run_builtin, "gseapy": run_gseapy}
+
+#Runs every engine once, returns [(engine, seconds, set x sample scores per second)] and the largest difference
+#between the scores of the engines (None with a single engine)
+def run_benchmark(abundance_df, gene_sets, engines, n_jobs):
+    results, scores = [], {}
+    for engine in engines:
+        start = time.perf_counter()
+        table = score_table(ENGINES[engine](abundance_df, gene_sets, n_jobs))
+        seconds = time.perf_counter() - start
+        scores[engine] = table
+        results.append((engine, seconds, table.size / seconds))
+
+    difference = None
+    if len(scores) > 1:
+        first, *others = scores.values()
+        difference = max(float(np.nanmax(np.abs(other.loc[first.index, first.columns].to_numpy() - first.to_numpy())))
+                         for other in others)
+    return results, difference
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the built-in ssGSEA scorer against gseapy on the same synthetic data.')
+    parser.add_argument('--proteins', type=int, default=5000, help='Number of proteins.')
+    parser.add_argument('--samples', type=int, default=1000, help='Number of samples.')
+    parser.add_argument('--sets', type=int, default=5000, help='Number of protein sets.')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES), help='Scorers to run.')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='Number of processes for both scorers.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    abundance_df, gene_sets = benchmark_ssgsea_permutations.synthetic_data(args.proteins, args.samples, args.sets,
+                                                                           args.seed)
+    results, difference = run_benchmark(abundance_df, gene_sets, args.engines, args.cores)
+
+    print(f"{args.proteins} proteins x {args.samples} samples, {args.sets} sets, {args.cores} processes")
+    print(f"{'engine':<18}{'seconds':>10}{'scores/s':>16}")
+    for engine, seconds, rate in results:
+        print(f"{engine:<18}{seconds:>10.2f}{rate:>16.0f}")
+    seconds = {engine: engine_seconds for engine, engine_seconds, _ in results}
+    if len(seconds) == len(ENGINES):
+        print(f"Speed-up of builtin over gseapy: {seconds['gseapy'] / seconds['builtin']:.1f}x")
+    if difference is not None:
+        print(f"Largest difference between the scores: {difference:.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import ssgsea_permutations
+
+#Benchmark of the permutation engine (ssgsea_permutations.py): permutations per second for a growing number of
+#processes, on a synthetic abundance matrix and random protein sets. Permutations per second counts one permutation
+#of one sample scored against all sets; early stopping is off for these runs, so every run does the same work.
+#A last run with early stopping shows how much of that work is saved.
+
+#Makes a synthetic abundance matrix (proteins x samples) and random protein sets of 15 to 200 proteins
+def synthetic_data(n_proteins, n_samples, n_sets, seed=0):
+    rng = np.random.default_rng(seed)
+    proteins = [f"P{i:05d}" for i in range(n_proteins)]
+    abundance_df = pd.DataFrame(rng.lognormal(10, 2, size=(n_proteins, n_samples)), index=proteins,
+                                columns=[f"sample_{j}" for j in range(n_samples)])
+    gene_sets = {f"set_{k}": list(rng.choice(proteins, size=rng.integers(15, 201), replace=False))
+                 for k in range(n_sets)}
+    return abundance_df, gene_sets
+
+#Process counts to try: powers of two up to the number of cores, and the number of cores itself
+def core_counts(max_cores):
+    counts = [1]
+    while counts[-1] * 2 < max_cores:
+        counts.append(counts[-1] * 2)
+    if max_cores > 1:
+        counts.append(max_cores)
+    return counts
+
+def run_benchmark(abundance_df, gene_sets, n_permutations, max_cores, seed=0):
+    results = []
+    n_samples = abundance_df.shape[1]
+    for n_jobs in core_counts(max_cores):
+        start = time.perf_counter()
+        ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations, seed=seed, n_jobs=n_jobs,
+                                                stop_exceedances=0)
+        seconds = time.perf_counter() - start
+        results.append((f"{n_jobs}", seconds, n_samples * n_permutations / seconds))
+
+    start = time.perf_counter()
+    result = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations, seed=seed,
+                                                     n_jobs=max_cores)
+    seconds = time.perf_counter() - start
+    done = result["Permutations"].mean()
+    results.append((f"{max_cores}, early stop", seconds, n_samples * n_permutations / seconds))
+    return results, done
+
+def main():
+    parser = argparse.ArgumentParser(description='Permutations per second of the ssGSEA permutation engine against the number of processes.')
+    parser.add_argument('--proteins', type=int, default=5000, help='Number of proteins.')
+    parser.add_argument('--samples', type=int, default=16, help='Number of samples.')
+    parser.add_argument('--sets', type=int, default=500, help='Number of protein sets.')
+    parser.add_argument('--permutations', type=int, default=1000, help='Permutations per sample.')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='Largest number of processes to try.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data and the permutations.')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+    abundance_df, gene_sets = synthetic_data(args.proteins, args.samples, args.sets, args.seed)
+    results, done = run_benchmark(abundance_df, gene_sets, args.permutations, args.cores, args.seed)
+
+    print(f"{args.proteins} proteins x {args.samples} samples, {args.sets} sets, {args.permutations} permutations")
+    print(f"{'processes':<18}{'seconds':>10}{'permutations/s':>16}")
+    for label, seconds, rate in results:
+        print(f"{label:<18}{seconds:>10.2f}{rate:>16.0f}")
+    print(f"With early stopping a set needed {done:.0f} of {args.permutations} permutations on average")
+
+if __name__ == "__main__":
+    main()
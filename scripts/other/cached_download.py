@@ -0,0 +1,179 @@
+#Shared download layer for the database preparation scripts (get_fasta.py, get_cRAP.py, download_dbs.py, add_contams.py).
+#Downloads are kept in a local content-addressed cache, so a repeat run only asks the server whether the file changed
+#(If-None-Match / If-Modified-Since) and copies the cached file when it did not.
+
+#load modules that will be used
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import requests
+
+#Default cache location, can be changed with the REPROTEOMICS_CACHE environment variable
+DEFAULT_CACHE_DIR = Path(os.environ.get("REPROTEOMICS_CACHE", Path.home() / ".cache" / "reproteomics" / "downloads"))
+
+#Raised when a downloaded file does not have the expected checksum
+class ChecksumError(Exception):
+    pass
+
+#Paths used inside the cache: objects/<sha256> holds file contents, urls/<hash of url>.json holds what we know about a URL
+#and partial/<hash of url> holds an unfinished download
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+def object_path(cache_dir, sha256):
+    return Path(cache_dir) / "objects" / sha256
+
+def meta_path(cache_dir, url):
+    return Path(cache_dir) / "urls" / f"{url_key(url)}.json"
+
+def partial_path(cache_dir, url):
+    return Path(cache_dir) / "partial" / url_key(url)
+
+#ETag/Last-Modified of an unfinished download, needed to resume it safely
+def partial_meta_path(cache_dir, url):
+    return partial_path(cache_dir, url).with_suffix(".json")
+
+#Reads the stored ETag/Last-Modified/checksum of a URL, or None if it was never downloaded
+def load_meta(cache_dir, url):
+    path = meta_path(cache_dir, url)
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    #Only trust the metadata if the cached file it points to is still there
+    if not object_path(cache_dir, meta.get("sha256", "")).exists():
+        return None
+    return meta
+
+def save_meta(cache_dir, url, meta):
+    path = meta_path(cache_dir, url)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, path)
+
+#Computes the sha256 of a file, reading it in chunks
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+#True if a file starts with the gzip magic bytes
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+#Copies a cached file to its output path through a temporary file and a rename, so the output is never half written.
+#An output path ending in .gz is written gzip-compressed, unless the downloaded file already is (e.g. a *.fasta.gz
+#mirror or a UniProt compressed=true URL), then it is copied as it is.
+def copy_to_output(source, output_path):
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    opener = gzip.open if output_path.suffix == ".gz" and not is_gzip(source) else open
+    with open(source, "rb") as src, opener(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp_path, output_path)
+
+#Downloads url to output_path through the cache and returns the sha256 of the content.
+#- If the URL was downloaded before, the request is conditional and a 304 answer reuses the cached file.
+#- An interrupted download is resumed with an HTTP Range request.
+#- If sha256 is given, the content is checked against it and ChecksumError is raised on a mismatch.
+#HTTP errors are raised as requests exceptions.
+def download(url, output_path, sha256=None, cache_dir=DEFAULT_CACHE_DIR, session=None, chunk_size=1 << 20, timeout=60):
+    cache_dir = Path(cache_dir)
+    for sub_dir in ("objects", "urls", "partial"):
+        (cache_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+    http = session or requests
+
+    meta = load_meta(cache_dir, url)
+
+    #A known checksum that is already in the cache needs no request at all
+    if sha256 and object_path(cache_dir, sha256).exists():
+        copy_to_output(object_path(cache_dir, sha256), output_path)
+        logging.info(f"'{output_path}' taken from the cache (checksum {sha256[:12]})")
+        return sha256
+
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    #Continue an unfinished download where it stopped. If-Range makes the server send the whole file
+    #instead of the rest of it when the file changed in the meantime, so this is only done when we have a validator.
+    part = partial_path(cache_dir, url)
+    part_meta = partial_meta_path(cache_dir, url)
+    done = part.stat().st_size if part.exists() else 0
+    if done and part_meta.exists():
+        with open(part_meta) as f:
+            part_info = json.load(f)
+        validator = part_info.get("etag") or part_info.get("last_modified")
+        if validator:
+            headers["Range"] = f"bytes={done}-"
+            headers["If-Range"] = validator
+
+    with http.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304 and meta:
+            copy_to_output(object_path(cache_dir, meta["sha256"]), output_path)
+            logging.info(f"'{output_path}' is up to date, taken from the cache")
+            return meta["sha256"]
+
+        #The unfinished download can not be resumed (e.g. it was already complete), start again
+        if response.status_code == 416:
+            part.unlink()
+            return download(url, output_path, sha256, cache_dir, session, chunk_size, timeout)
+
+        response.raise_for_status()
+
+        #206 means the server sends the rest of the file, anything else means starting again
+        mode = "ab" if response.status_code == 206 else "wb"
+        if mode == "ab":
+            logging.info(f"Resuming download of {url} at byte {done}")
+
+        new_meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        with open(part_meta, "w") as f:
+            json.dump(new_meta, f)
+
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    content_sha256 = file_sha256(part)
+    if sha256 and content_sha256 != sha256:
+        part.unlink()
+        raise ChecksumError(f"Checksum mismatch for {url}: expected {sha256}, got {content_sha256}")
+
+    #Move the finished download into the cache under its checksum
+    os.replace(part, object_path(cache_dir, content_sha256))
+    part_meta.unlink(missing_ok=True)
+    new_meta["sha256"] = content_sha256
+    new_meta["size"] = object_path(cache_dir, content_sha256).stat().st_size
+    save_meta(cache_dir, url, new_meta)
+
+    #Remove the previous version of this URL if nothing else points to it
+    if meta and meta["sha256"] != content_sha256:
+        referenced = set()
+        for other in (cache_dir / "urls").glob("*.json"):
+            with open(other) as f:
+                referenced.add(json.load(f).get("sha256"))
+        if meta["sha256"] not in referenced:
+            object_path(cache_dir, meta["sha256"]).unlink(missing_ok=True)
+
+    copy_to_output(object_path(cache_dir, content_sha256), output_path)
+    logging.info(f"File saved as '{output_path}'")
+    return content_sha256
@@ -2,6 +2,7 @@
 import os
 import requests
 import logging
+from cached_download import download, ChecksumError
 
 # Configure logging with a basic configuration (https://docs.python.org/3/howto/logging-cookbook.html)
 #Logging messages which are less severe than level will be ignored
@@ -20,8 +21,11 @@ console_handler.setFormatter(formatter)
 logging.getLogger('').addHandler(console_handler)
 
 #Defines the function. Give function a specific name. Specify the files that will be used in the command.
-def download_file(url, output_path):
-    #Sends an HTTP get request to the provided url using the requests library. The response from the server is stored in the response variable
-    response = requests.get(url)
-    #Checks if the HTTP response status code is 200, which indicates a successful request. If the condition is true, it means the file was successfully retrieved from the server.
-    if response.status_code == 200:
+#The download goes through the shared cache in cached_download.py, so files that did not change on the server are not downloaded again.
+#If sha256 is given, the downloaded file is checked against it.
+def download_file(url, output_path, sha256=None):
+    try:
+        download(url, output_path, sha256=sha256)
+    except (requests.exceptions.RequestException, ChecksumError) as e:
+        #Prints an error message with the reason
+        logging.error("An error occurred while retrieving the file: %s", e)
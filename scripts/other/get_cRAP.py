@@ -8,21 +8,26 @@
 
 #The requests library is imported to make HTTP requests.
 import requests
+#The shared download layer (cached_download.py) keeps a local copy, so a repeat run only checks whether the file changed on the server.
+from cached_download import download
 
 #The url variable contains the URL from which the FASTA data will be retrieved.
 url = 'http://ftp.thegpm.org/fasta/cRAP/crap.fasta'
 
-#The requests.get(url) sends an HTTP GET request to the specified URL.
-response = requests.get(url)
+#download(url, 'crap.fasta') sends the HTTP GET request (a conditional one if the file was downloaded before)
+#and writes the FASTA data to 'crap.fasta' in chunks, through a temporary file that is renamed when complete.
+#If the server does not answer successfully, requests raises an exception and the error is printed.
+def get_crap(url=url, output_path='crap.fasta'):
+    download(url, output_path)
+    return output_path
 
-#The response is checked using the status_code attribute. If it is 200 (indicating a successful response), the FASTA data is retrieved using response.text.
-#The with open('output.fasta', 'w') as file statement opens a new file called 'output.fasta' in write mode.
-#The retrieved FASTA data is written to the file using file.write(fasta_data).
-#Finally, a message is printed to indicate that the FASTA file has been saved as 'output.fasta'.
-if response.status_code == 200: #The server successfully answered the http request
-    contams_data = response.text
-    with open('crap.fasta', 'w') as file:
-        file.write(contams_data)
+def main():
+    try:
+        get_crap()
         print("Contaminant FASTA file saved as 'crap.fasta'")
-else:
-    print("Error occurred while retrieving the contaminant file:", response.status_code)
+    except requests.exceptions.RequestException as e:
+        print("Error occurred while retrieving the contaminant file:", e)
+
+#Only download when the script is run directly, so get_crap can be imported (e.g. by scripts/pipeline.py)
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,23 @@
 import os
 import requests
+from cached_download import download
 
 url = 'https://rest.uniprot.org/uniprotkb/stream?format=fasta&query=%28%28proteome%3AUP000005640%29%29'
-response = requests.get(url)
-
-if response.status_code == 200:
-    fasta_data = response.text
-    output_filename = 'HRP.fasta'
-    output_file_path = os.path.join(os.getcwd(), output_filename)
-    with open(output_file_path, 'w') as file:
-        file.write(fasta_data)
-    print("FASTA file saved as:", output_file_path)
-else:
-    print("Error occurred while retrieving the FASTA file:", response.status_code)
+output_filename = 'HRP.fasta'
+output_file_path = os.path.join(os.getcwd(), output_filename)
+
+# The download goes through the shared cache (cached_download.py), so a repeat run only checks whether the proteome changed
+def get_fasta(url=url, output_path=output_file_path):
+    download(url, output_path)
+    return output_path
+
+def main():
+    try:
+        get_fasta()
+        print("FASTA file saved as:", output_file_path)
+    except requests.exceptions.RequestException as e:
+        print("Error occurred while retrieving the FASTA file:", e)
+
+# Only download when the script is run directly, so get_fasta can be imported (e.g. by scripts/pipeline.py)
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,31 @@
 ## For each protein in a list, save the PNG image of
 ## STRING network of its 15 most confident interaction partners.
 ##
+## Images are fetched by a small pool of workers that share a
+## token bucket, so requests stay within the STRING API rate
+## without sleeping after every request. Images that already
+## exist with the same request parameters are skipped, and a
+## manifest of successes and failures is written at the end.
+##
+## With --network the images are drawn locally from a STRING
+## links dump instead (see string_network.py), without any
+## request to the API.
+##
 ## Requires requests module:
 ## Install using "python -m pip install requests"
 ################################################################
 
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import time
+from requests.adapters import HTTPAdapter
+
+from network_images import image_path
+from rate_limiter import TokenBucket
 
 # Set STRING API URL and parameters
 string_api_url = "https://version-11-5.string-db.org/api"
@@ -26,30 +45,162 @@ my_genes = [
 # Construct base URL
 base_url = "/".join([string_api_url, output_format, method])
 
-# Loop through genes
-for gene in my_genes:
+# Name of the manifest written next to the images
+manifest_name = "network_manifest.json"
+
+# Parameters for the API request, the same for every gene apart from the identifier
+def request_params(gene, species=species_id, partners=15):
+    return {
+        "identifiers": gene,
+        "species": species,
+        "add_white_nodes": partners,
+        "network_flavor": "confidence"
+    }
+
+# Short hash of the URL and parameters, so an image made with other settings is fetched again
+def params_hash(url, params):
+    return hashlib.sha256(json.dumps([url, params], sort_keys=True).encode()).hexdigest()[:16]
+
+# Read the manifest of a previous run, if there is one
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, manifest_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+# Write the manifest, keeping the entries of genes from previous runs that are not in this one
+# It is written through a temporary file, so an interrupted run never leaves it half written
+def save_manifest(output_dir, previous, manifest):
+    previous = dict(previous)
+    previous.update(manifest)
+    path = os.path.join(output_dir, manifest_name)
+    with open(path + ".tmp", 'w') as fh:
+        json.dump(previous, fh, indent=4)
+    os.replace(path + ".tmp", path)
+    return previous
+
+# True if the manifest entry of a previous run is an image made with the same parameters that still exists
+def is_current(old, expected_hash):
+    return (old.get("status") in ("saved", "skipped") and old.get("params_hash") == expected_hash
+            and os.path.exists(old.get("file", "")))
+
+# Fetch and save the network image of one gene, returns its manifest entry
+def fetch_network(session, limiter, gene, params, output_dir):
+    file_name = image_path(output_dir, gene)
+    entry = {"file": file_name, "params_hash": params_hash(base_url, params)}
     try:
-        # Set parameters for the API request
-        params = {
-            "identifiers": gene,
-            "species": species_id,
-            "add_white_nodes": 15,
-            "network_flavor": "confidence"
-        }
+        # Wait for our turn within the allowed request rate
+        limiter.acquire()
 
         # Make the API request
-        response = requests.post(base_url, data=params)
+        response = session.post(base_url, data=params, timeout=60)
         response.raise_for_status()  # Raise an exception for HTTP errors
 
-        # Save the network to a file
-        file_name = f"{gene}_network.png"
-        with open(file_name, 'wb') as fh:
+        # Save the network to a temporary file first, so an interrupted write never leaves a truncated image
+        # that a later run would skip
+        with open(file_name + ".tmp", 'wb') as fh:
             fh.write(response.content)
+        os.replace(file_name + ".tmp", file_name)
 
         print(f"Saved interaction network to {file_name}")
-
-        # Sleep for a short duration to avoid overloading the server
-        time.sleep(1)
+        entry["status"] = "saved"
 
     except requests.exceptions.RequestException as e:
         print(f"Error processing {gene}: {e}")
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+
+    return entry
+
+# Fetch the network images of a list of genes
+def fetch_networks(genes, output_dir=".", species=species_id, workers=4, requests_per_second=1.0, partners=15):
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_manifest(output_dir)
+    manifest = {}
+
+    # Remove duplicate genes but keep the input order
+    genes = list(dict.fromkeys(genes))
+
+    limiter = TokenBucket(requests_per_second)
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+        futures = {}
+        for gene in genes:
+            params = request_params(gene, species, partners)
+            old = previous.get(gene, {})
+            # Skip images that were already saved with the same request
+            if is_current(old, params_hash(base_url, params)):
+                print(f"Skipping {gene}, {old['file']} already exists")
+                manifest[gene] = dict(old, status="skipped")
+                continue
+            futures[gene] = executor.submit(fetch_network, session, limiter, gene, params, output_dir)
+
+        for gene, future in futures.items():
+            manifest[gene] = future.result()
+
+    # Keep the manifest in the input order
+    manifest = {gene: manifest[gene] for gene in genes}
+    save_manifest(output_dir, previous, manifest)
+
+    failed = [gene for gene, entry in manifest.items() if entry["status"] == "failed"]
+    print(f"{len(genes) - len(failed)} networks available, {len(failed)} failed" + (f": {', '.join(failed)}" if failed else ""))
+    return manifest
+
+# Draw the network images of a list of genes from a local network (string_network.Network), same files and manifest
+# as fetch_networks; genes that are not in the network are listed as failed
+def render_networks(genes, network, output_dir=".", partners=15):
+    import string_network
+
+    os.makedirs(output_dir, exist_ok=True)
+    previous = load_manifest(output_dir)
+    manifest = {}
+    genes = list(dict.fromkeys(genes))
+    # The images depend on the dumps the network was made from, not on an API URL
+    expected_hash = params_hash("local", {"network": network.key["sources"], "min_score": network.key["min_score"],
+                                          "partners": partners})
+
+    rows, unresolved = network.resolve(genes)
+    for gene in genes:
+        file_name = image_path(output_dir, gene)
+        old = previous.get(gene, {})
+        if is_current(old, expected_hash):
+            manifest[gene] = dict(old, status="skipped")
+        elif gene in rows:
+            nodes, edges = network.neighbourhood(rows[gene], partners)
+            string_network.render_network(network, nodes, edges, file_name, [rows[gene]])
+            manifest[gene] = {"file": file_name, "params_hash": expected_hash, "status": "saved"}
+        else:
+            manifest[gene] = {"file": file_name, "params_hash": expected_hash, "status": "failed",
+                              "error": "not in the network"}
+
+    save_manifest(output_dir, previous, manifest)
+
+    saved = sum(entry["status"] == "saved" for entry in manifest.values())
+    skipped = sum(entry["status"] == "skipped" for entry in manifest.values())
+    print(f"{saved} networks drawn, {skipped} skipped, {len(unresolved)} not in the network"
+          + (f": {', '.join(unresolved)}" if unresolved else ""))
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Save STRING network images for a list of proteins.")
+    parser.add_argument("genes", nargs="*", default=my_genes, help="Gene/protein identifiers (default: the example list).")
+    parser.add_argument("--output-dir", default=".", help="Directory for the PNG files and the manifest.")
+    parser.add_argument("--species", type=int, default=species_id, help="NCBI taxon identifier.")
+    parser.add_argument("--workers", type=int, default=4, help="Requests sent at the same time.")
+    parser.add_argument("--rate", type=float, default=1.0, help="Maximum requests per second.")
+    parser.add_argument("--partners", type=int, default=15, help="Number of interaction partners shown.")
+    parser.add_argument("--network", default=None, help="STRING links dump to draw the images from locally instead of asking the API.")
+    parser.add_argument("--aliases", default=None, help="STRING aliases dump, to find genes by name or UniProt accession with --network.")
+    parser.add_argument("--info", default=None, help="STRING protein info dump, for the node labels with --network.")
+    args = parser.parse_args()
+
+    if args.network:
+        import string_network
+        network = string_network.load_network(args.network, args.aliases, args.info)
+        render_networks(args.genes, network, args.output_dir, args.partners)
+    else:
+        fetch_networks(args.genes, args.output_dir, args.species, args.workers, args.rate, args.partners)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#Offline GO over-representation analysis, to replace one g:Profiler web request per gene list.
+#
+#A GO annotation file (GAF, optionally with the GO ontology in OBO format for propagating annotations to ancestor
+#terms) or a GMT file is read once into a sparse term x protein matrix and cached on disk. Any number of query lists
+#are then tested together: the overlaps of all lists with all terms come from one sparse matrix product, and the
+#hypergeometric p-values are computed for all overlaps at once.
+#
+#Like g:Profiler's default "annotated" domain, each source (GO:BP, GO:MF, GO:CC) is tested against the proteins that
+#have at least one annotation in that source, and only query proteins in that domain are counted. Multiple testing
+#correction is Benjamini-Hochberg ("fdr") or Bonferroni ("bonferroni") over all terms of a source. g:Profiler's
+#default g:SCS threshold comes from precomputed simulations that are not public, so it is not reproduced here;
+#"fdr" is the closest option.
+
+import gzip
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import hypergeom
+
+#GAF aspect column and OBO namespace to g:Profiler source names
+ASPECT_SOURCE = {"P": "GO:BP", "F": "GO:MF", "C": "GO:CC"}
+NAMESPACE_SOURCE = {"biological_process": "GO:BP", "molecular_function": "GO:MF", "cellular_component": "GO:CC"}
+
+#Relationships followed when propagating annotations to ancestor terms
+PROPAGATE_RELATIONSHIPS = ("part_of",)
+
+def open_text(path):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+#Reads the GO ontology (OBO format) into {term id: {"name", "namespace", "parents"}}
+#Obsolete terms are skipped, alternative ids are returned separately as {alt id: term id}
+def read_obo(obo_file):
+    terms = {}
+    alt_ids = {}
+    term = None
+    with open_text(obo_file) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                term = {"parents": [], "alt_ids": []} if line == "[Term]" else None
+                continue
+            if term is None or ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            value = value.split("!")[0].strip()
+            if key == "id":
+                term["id"] = value
+                terms[value] = term
+            elif key == "name":
+                term["name"] = value
+            elif key == "namespace":
+                term["namespace"] = value
+            elif key == "alt_id":
+                term["alt_ids"].append(value)
+            elif key == "is_a":
+                term["parents"].append(value)
+            elif key == "relationship":
+                relation, target = value.split()[:2]
+                if relation in PROPAGATE_RELATIONSHIPS:
+                    term["parents"].append(target)
+            elif key == "is_obsolete" and value == "true":
+                term["obsolete"] = True
+
+    terms = {term_id: term for term_id, term in terms.items() if not term.get("obsolete")}
+    for term_id, term in terms.items():
+        for alt_id in term.pop("alt_ids"):
+            alt_ids[alt_id] = term_id
+    return terms, alt_ids
+
+#Finds the ancestors of every term (including the term itself), computed once for the whole ontology
+def ancestor_map(terms):
+    ancestors = {}
+    for start in terms:
+        if start in ancestors:
+            continue
+        # Depth-first walk without recursion, so deep ontologies can not hit the recursion limit
+        stack = [(start, False)]
+        while stack:
+            term_id, expanded = stack.pop()
+            if term_id in ancestors:
+                continue
+            parents = [parent for parent in terms[term_id]["parents"] if parent in terms]
+            if expanded:
+                found = {term_id}
+                for parent in parents:
+                    found |= ancestors[parent]
+                ancestors[term_id] = frozenset(found)
+            else:
+                stack.append((term_id, True))
+                stack.extend((parent, False) for parent in parents if parent not in ancestors)
+    return ancestors
+
+#Reads (protein, GO term, source) from a GAF file
+#id_column "symbol" uses the gene symbol (column 3), "accession" the database identifier (column 2, e.g. UniProt)
+#Annotations with a NOT qualifier are skipped
+def read_gaf(gaf_file, id_column="symbol"):
+    column = 2 if id_column == "symbol" else 1
+    with open_text(gaf_file) as f:
+        for line in f:
+            if line.startswith("!"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or "NOT" in fields[3].split("|"):
+                continue
+            yield fields[column], fields[4], ASPECT_SOURCE.get(fields[8], fields[8])
+
+#Reads (protein, term, source) from a GMT file, all sets get the given source name
+def read_gmt_pairs(gmt_file, source="GMT"):
+    with open_text(gmt_file) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            for member in fields[2:]:
+                if member:
+                    yield member, fields[0], source
+
+#Compiled annotations: a sparse term x protein matrix plus the names of its rows and columns
+class Annotations:
+    def __init__(self, matrix, terms, names, sources, proteins, version=""):
+        self.matrix = matrix.tocsr()
+        self.terms = np.asarray(terms)
+        self.names = np.asarray(names)
+        self.sources = np.asarray(sources)
+        self.proteins = np.asarray(proteins)
+        self.version = version
+        self.protein_index = {protein: i for i, protein in enumerate(self.proteins)}
+
+    def save(self, path):
+        np.savez_compressed(path, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                            shape=np.array(self.matrix.shape), terms=self.terms, names=self.names,
+                            sources=self.sources, proteins=self.proteins, version=np.array(self.version))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            matrix = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return cls(matrix, f["terms"], f["names"], f["sources"], f["proteins"], str(f["version"]))
+
+#Builds the term x protein matrix from (protein, term, source) pairs
+#With an ontology, every annotation is also added to all ancestors of the term (the "true path rule")
+def build_annotations(pairs, terms=None, alt_ids=None, version=""):
+    ancestors = ancestor_map(terms) if terms else {}
+    alt_ids = alt_ids or {}
+    term_index, protein_index = {}, {}
+    term_sources = {}
+    rows, cols = [], []
+
+    for protein, term_id, source in pairs:
+        term_id = alt_ids.get(term_id, term_id)
+        column = protein_index.setdefault(protein, len(protein_index))
+        for annotated in ancestors.get(term_id, (term_id,)):
+            row = term_index.setdefault(annotated, len(term_index))
+            if terms and annotated in terms:
+                term_sources[annotated] = NAMESPACE_SOURCE.get(terms[annotated].get("namespace"), source)
+            else:
+                term_sources[annotated] = source
+            rows.append(row)
+            cols.append(column)
+
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                               shape=(len(term_index), len(protein_index)))
+    # Duplicate annotations (e.g. from several evidence codes) count once
+    matrix.data[:] = 1
+    matrix = matrix.astype(np.int8)
+
+    term_ids = list(term_index)
+    names = [terms[t].get("name", t) if terms and t in terms else t for t in term_ids]
+    return Annotations(matrix, term_ids, names, [term_sources[t] for t in term_ids], list(protein_index), version)
+
+#Hash of the files an annotation matrix is built from, used as the annotation version and as the cache key
+def annotation_version(*paths, **options):
+    digest = hashlib.sha256(repr(sorted(options.items())).encode())
+    for path in paths:
+        if path is None:
+            continue
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+#Loads the annotations of a GAF (with an optional OBO ontology) or GMT file, compiling them only the first time
+#The compiled matrix is kept in cache_dir under the hash of the input files
+def load_annotations(annotation_file, obo_file=None, id_column="symbol", cache_dir=None):
+    version = annotation_version(annotation_file, obo_file, id_column=id_column)
+    cache_dir = Path(cache_dir) if cache_dir else Path(str(annotation_file) + ".cache")
+    cache_file = cache_dir / f"annotations_{version}.npz"
+    if cache_file.exists():
+        return Annotations.load(cache_file)
+
+    logging.info(f"Compiling annotations from {annotation_file}...")
+    if str(annotation_file).replace(".gz", "").endswith(".gmt"):
+        pairs = read_gmt_pairs(annotation_file)
+    else:
+        pairs = read_gaf(annotation_file, id_column)
+    terms, alt_ids = read_obo(obo_file) if obo_file else (None, None)
+    annotations = build_annotations(pairs, terms, alt_ids, version)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_dir / f"annotations_{version}.tmp.npz"
+    annotations.save(tmp_file)
+    os.replace(tmp_file, cache_file)
+    logging.info(f"{len(annotations.terms)} terms x {len(annotations.proteins)} proteins cached in {cache_file}")
+    return annotations
+
+#Benjamini-Hochberg adjusted p-values
+def benjamini_hochberg(p_values):
+    n = len(p_values)
+    if n == 0:
+        return p_values
+    order = np.argsort(p_values)
+    ranked = p_values[order] * n / np.arange(1, n + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    result = np.empty(n)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+#Tests many query lists at once
+#queries is {list id: list of proteins}. Returns a long table with one row per (list, term) with at least one
+#overlapping protein (only significant ones unless all_results=True), with g:Profiler-like columns
+def enrich(annotations, queries, sources=("GO:BP",), threshold=0.05, correction="fdr", min_term_size=1,
+           max_term_size=None, all_results=False):
+    query_ids = list(queries)
+
+    # Query x protein membership matrix, proteins not in the annotations are left out
+    rows, cols = [], []
+    for row, query_id in enumerate(query_ids):
+        found = {annotations.protein_index[p] for p in queries[query_id] if p in annotations.protein_index}
+        rows.extend([row] * len(found))
+        cols.extend(found)
+    query_matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                     shape=(len(query_ids), len(annotations.proteins)))
+
+    results = []
+    for source in sources:
+        term_rows = np.flatnonzero(annotations.sources == source)
+        if not len(term_rows):
+            logging.warning(f"No terms for source {source}")
+            continue
+        term_matrix = annotations.matrix[term_rows].astype(np.int32)
+
+        # Domain: proteins with at least one annotation in this source
+        in_domain = np.asarray(term_matrix.sum(axis=0)).ravel() > 0
+        domain_size = int(in_domain.sum())
+        term_sizes = np.asarray(term_matrix.sum(axis=1)).ravel()
+        query_sizes = np.asarray(query_matrix[:, in_domain].sum(axis=1)).ravel()
+
+        # Terms outside the size limits are not tested
+        tested = term_sizes >= min_term_size
+        if max_term_size:
+            tested &= term_sizes <= max_term_size
+        n_tested = int(tested.sum())
+
+        # Overlap of every query with every term in one sparse product
+        overlaps = (query_matrix @ term_matrix.T).tocoo()
+        keep = tested[overlaps.col] & (overlaps.data > 0)
+        q, t, k = overlaps.row[keep], overlaps.col[keep], overlaps.data[keep]
+
+        # P(X >= k) for X ~ Hypergeometric(domain size, term size, query size)
+        p_values = hypergeom.sf(k - 1, domain_size, term_sizes[t], query_sizes[q])
+
+        # Correction per query over all tested terms of the source (terms without overlap have p = 1)
+        adjusted = np.empty_like(p_values)
+        for query_row in np.unique(q):
+            mask = q == query_row
+            if correction == "bonferroni":
+                adjusted[mask] = np.minimum(p_values[mask] * n_tested, 1.0)
+            elif correction == "fdr":
+                padded = np.concatenate([p_values[mask], np.ones(n_tested - mask.sum())])
+                adjusted[mask] = benjamini_hochberg(padded)[:mask.sum()]
+            else:
+                adjusted[mask] = p_values[mask]
+
+        results.append(pd.DataFrame({
+            "query": np.asarray(query_ids, dtype=object)[q],
+            "source": source,
+            "native": annotations.terms[term_rows[t]],
+            "name": annotations.names[term_rows[t]],
+            "p_value": adjusted,
+            "significant": adjusted <= threshold,
+            "term_size": term_sizes[t],
+            "query_size": query_sizes[q],
+            "intersection_size": k,
+            "effective_domain_size": domain_size,
+            "precision": k / query_sizes[q],
+            "recall": k / term_sizes[t],
+        }))
+
+    columns = ["query", "source", "native", "name", "p_value", "significant", "term_size", "query_size",
+               "intersection_size", "effective_domain_size", "precision", "recall"]
+    if not results:
+        return pd.DataFrame(columns=columns)
+    result = pd.concat(results, ignore_index=True)
+    if not all_results:
+        result = result[result["significant"]]
+    return result.sort_values(["query", "p_value"], ignore_index=True)
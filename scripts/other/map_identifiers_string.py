@@ -3,49 +3,188 @@
 ## (if possible) to the best matching STRING identifier
 ## and prints out the mapping on screen in the TSV format
 ##
+## Large lists are split into batches that are sent
+## concurrently (within STRING's request rate), and the
+## results are kept in a local SQLite cache so identifiers
+## are only looked up once per STRING version and species.
+##
 ## Requires requests module:
 ## type "python -m pip install requests" in command line
 ## (win) or terminal (mac/linux) to install the module
 ###########################################################
 
+import argparse
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
-def resolve_protein_identifiers(protein_list):
-    string_api_url = "https://version-11-5.string-db.org/api"
-    output_format = "tsv-no-header"
-    method = "get_string_ids"
+from rate_limiter import TokenBucket
+
+STRING_VERSION = "11.5"
+DEFAULT_CACHE = "string_ids_cache.sqlite"
+
+## STRING API base URL of a given version, e.g. 11.5 -> https://version-11-5.string-db.org/api
+def string_api_url(version=STRING_VERSION):
+    return f"https://version-{version.replace('.', '-')}.string-db.org/api"
+
+## Open (and create if needed) the SQLite cache
+## An identifier that STRING could not resolve is stored with string_id NULL
+def open_cache(cache_path):
+    connection = sqlite3.connect(cache_path, check_same_thread=False)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS string_ids ("
+        " version TEXT, species INTEGER, identifier TEXT, string_id TEXT,"
+        " PRIMARY KEY (version, species, identifier))"
+    )
+    return connection
+
+## Look up identifiers in the cache, returns {identifier: string_id or None} for the ones found
+def cached_mappings(connection, version, species, identifiers):
+    found = {}
+    identifiers = list(identifiers)
+    ## SQLite limits the number of parameters per query, so look up in slices
+    for start in range(0, len(identifiers), 500):
+        chunk = identifiers[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = connection.execute(
+            f"SELECT identifier, string_id FROM string_ids WHERE version = ? AND species = ? AND identifier IN ({placeholders})",
+            [version, species, *chunk]
+        )
+        found.update(rows)
+    return found
+
+def store_mappings(connection, version, species, mappings):
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO string_ids VALUES (?, ?, ?, ?)",
+            [(version, species, identifier, string_id) for identifier, string_id in mappings.items()]
+        )
+
+## Parse the tsv-no-header answer of get_string_ids
+## With echo_query=1 the first column is the query and the third the STRING identifier;
+## lines that do not look like that are skipped instead of crashing the whole run
+def parse_string_ids(text):
+    protein_mapping = {}
+    for line in text.strip().split("\n"):
+        fields = line.split("\t")
+        if len(fields) < 3 or not fields[2]:
+            continue
+        ## limit=1 should give one match per query, keep the first if there are more
+        protein_mapping.setdefault(fields[0], fields[2])
+    return protein_mapping
+
+## Client errors (bad request, unauthorised, batch too large, ...) give the same answer on every
+## try, so they are not retried; 429 (too many requests) and server errors are
+def is_permanent(error):
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
 
-## Set parameters for API request
+## Send one batch to STRING, retrying with exponential backoff (except on permanent errors)
+def resolve_batch(session, limiter, request_url, batch, species, retries=3, backoff=2.0):
     params = {
-        "identifiers": "\r\n".join(protein_list),
-        "species": 9606,
+        "identifiers": "\r\n".join(batch),
+        "species": species,
         "limit": 1,
         "echo_query": 1,
     }
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            results = session.post(request_url, data=params, timeout=120)
+            results.raise_for_status()
+            return parse_string_ids(results.text)
+        except requests.exceptions.RequestException as e:
+            if attempt == retries or is_permanent(e):
+                raise
+            print(f"Batch of {len(batch)} identifiers failed ({e}), retrying")
+            time.sleep(backoff * (2 ** attempt))
+
+## Resolve a list of proteins to STRING identifiers
+## Returns (mapping, unresolved): mapping is {input identifier: STRING identifier},
+## unresolved lists the inputs STRING had no match for (or that could not be looked up)
+def resolve_protein_identifiers(protein_list, species=9606, version=STRING_VERSION, batch_size=1000,
+                                workers=4, requests_per_second=1.0, cache_path=DEFAULT_CACHE):
+    output_format = "tsv-no-header"
+    method = "get_string_ids"
 
 ## Construct the API request URL
-    request_url = "/".join([string_api_url, output_format, method])
+    request_url = "/".join([string_api_url(version), output_format, method])
+
+## Remove duplicates but keep the input order
+    identifiers = list(dict.fromkeys(protein_list))
+
+## Take what we already know from the cache
+    connection = open_cache(cache_path) if cache_path else None
+    known = cached_mappings(connection, version, species, identifiers) if connection else {}
+    to_query = [identifier for identifier in identifiers if identifier not in known]
+
+## Split the rest into batches and send them concurrently, within the allowed request rate
+    batches = [to_query[i:i + batch_size] for i in range(0, len(to_query), batch_size)]
+    limiter = TokenBucket(requests_per_second)
+    failed = set()
+
+    with requests.Session() as session:
+        session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(resolve_batch, session, limiter, request_url, batch, species) for batch in batches]
+            for batch, future in zip(batches, futures):
+                try:
+                    batch_mapping = future.result()
+                except requests.exceptions.RequestException as e:
+                    print(f"Error resolving a batch of {len(batch)} identifiers: {e}")
+                    failed.update(batch)
+                    continue
+                ## Also remember identifiers without a match, so they are not asked again
+                resolved = {identifier: batch_mapping.get(identifier) for identifier in batch}
+                known.update(resolved)
+                if connection:
+                    store_mappings(connection, version, species, resolved)
 
-## Send the API request and get the results
-    results = requests.post(request_url, data=params)
+    if connection:
+        connection.close()
 
-## Parse the results and create a mapping
+## Split into resolved and unresolved identifiers
     protein_mapping = {}
-    for line in results.text.strip().split("\n"):
-        input_identifier, _, string_identifier, _ = line.split("\t")
-        protein_mapping[input_identifier] = string_identifier
+    unresolved = []
+    for identifier in identifiers:
+        string_identifier = known.get(identifier)
+        if string_identifier:
+            protein_mapping[identifier] = string_identifier
+        else:
+            unresolved.append(identifier)
 
-    return protein_mapping
+    return protein_mapping, unresolved
 
 def main():
-    protein_list = ["P1", "P2", "P3", "P4"]  # Your protein list
-    mapping = resolve_protein_identifiers(protein_list)
+    parser = argparse.ArgumentParser(description="Resolve protein identifiers to STRING identifiers.")
+    parser.add_argument("proteins", nargs="*", default=["P1", "P2", "P3", "P4"], help="Protein identifiers (default: an example list).")
+    parser.add_argument("--file", type=str, default=None, help="File with one protein identifier per line.")
+    parser.add_argument("--species", type=int, default=9606, help="NCBI taxon identifier (default: 9606, Homo sapiens).")
+    parser.add_argument("--string-version", type=str, default=STRING_VERSION, help="STRING version to query.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Identifiers per request.")
+    parser.add_argument("--workers", type=int, default=4, help="Requests sent at the same time.")
+    parser.add_argument("--cache", type=str, default=DEFAULT_CACHE, help="SQLite cache file (empty string to disable).")
+    args = parser.parse_args()
+
+    protein_list = args.proteins  # Your protein list
+    if args.file:
+        with open(args.file) as f:
+            protein_list = [line.strip() for line in f if line.strip()]
+
+    mapping, unresolved = resolve_protein_identifiers(protein_list, species=args.species, version=args.string_version,
+                                                      batch_size=args.batch_size, workers=args.workers,
+                                                      cache_path=args.cache or None)
 
    # Print the mapping
     for input_id, string_id in mapping.items():
         print("Input:", input_id, "STRING:", string_id)
-      
+
+    for input_id in unresolved:
+        print("Input:", input_id, "STRING: not found")
+
 #ensures that the script's main functionality is only executed when the script is run directly
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,222 @@
+#load modules that will be used
+import argparse
+import hashlib
+import logging
+import os
+import random
+import shutil
+import tempfile
+from pathlib import Path
+
+# Configure logging with a basic configuration (https://docs.python.org/3/howto/logging-cookbook.html)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+#Suffix of the index file written next to each FASTA file
+INDEX_SUFFIX = '.index'
+
+#Gets the accession from a FASTA header line, e.g. b'>sp|P02768|ALBU_HUMAN Albumin' gives 'P02768'.
+#Headers that are not in the UniProt db|accession|name format use their first word.
+def parse_accession(header):
+    first_word = header[1:].split(None, 1)[0].decode() if header[1:].strip() else ''
+    parts = first_word.split('|')
+    if len(parts) >= 3:
+        return parts[1]
+    return first_word
+
+#Gets the sequence of a raw record (header line plus sequence lines) as one string without whitespace
+def record_sequence(record):
+    lines = record.split(b'\n', 1)
+    if len(lines) == 1:
+        return ''
+    return b''.join(lines[1].split()).decode().upper()
+
+#Hashes a sequence, so identical sequences under different accessions can be found
+def sequence_hash(sequence):
+    return hashlib.blake2b(sequence.encode(), digest_size=16).hexdigest()
+
+#Hash of a record without sequence; such records are not duplicates of each other
+EMPTY_SEQUENCE_HASH = sequence_hash('')
+
+#Yields (offset, raw record bytes) for each record in a FASTA file, reading one line at a time
+def iter_raw_records(fasta_path):
+    with open(fasta_path, 'rb') as fasta:
+        offset = 0
+        start = None
+        lines = []
+        for line in fasta:
+            if line.startswith(b'>'):
+                if start is not None:
+                    yield start, b''.join(lines)
+                start = offset
+                lines = []
+            if start is not None:
+                lines.append(line)
+            offset += len(line)
+        if start is not None:
+            yield start, b''.join(lines)
+
+#Scans a FASTA file once and returns its index as a list of (accession, offset, length, sequence hash), in file order
+def build_index(fasta_path):
+    index = []
+    for offset, record in iter_raw_records(fasta_path):
+        header = record.split(b'\n', 1)[0]
+        index.append((parse_accession(header), offset, len(record), sequence_hash(record_sequence(record))))
+    return index
+
+#Writes the index next to the FASTA file. The first line records the size and modification time of the FASTA file,
+#so a stale index is rebuilt automatically.
+def save_index(fasta_path, index):
+    index_path = Path(str(fasta_path) + INDEX_SUFFIX)
+    stat = os.stat(fasta_path)
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(f"# {stat.st_size}\t{stat.st_mtime_ns}\n")
+        for accession, offset, length, seq_hash in index:
+            f.write(f"{accession}\t{offset}\t{length}\t{seq_hash}\n")
+    os.replace(tmp_path, index_path)
+
+#Loads the index of a FASTA file from disk, building (and saving) it first if it is missing or out of date
+def load_index(fasta_path):
+    index_path = Path(str(fasta_path) + INDEX_SUFFIX)
+    stat = os.stat(fasta_path)
+    if index_path.exists():
+        with open(index_path) as f:
+            if f.readline().rstrip('\n') == f"# {stat.st_size}\t{stat.st_mtime_ns}":
+                index = []
+                for line in f:
+                    accession, offset, length, seq_hash = line.rstrip('\n').split('\t')
+                    index.append((accession, int(offset), int(length), seq_hash))
+                return index
+    logging.info(f"Indexing {fasta_path}...")
+    index = build_index(fasta_path)
+    save_index(fasta_path, index)
+    return index
+
+#Turns an index into a dictionary for O(1) lookups: accession -> (offset, length, sequence hash).
+#If an accession occurs more than once, the first record is kept.
+def index_by_accession(index):
+    lookup = {}
+    for accession, offset, length, seq_hash in index:
+        lookup.setdefault(accession, (offset, length, seq_hash))
+    return lookup
+
+#Reads a single record from a FASTA file using its index entry, without parsing the rest of the file
+def fetch_record(fasta_path, lookup, accession):
+    offset, length, _ = lookup[accession]
+    with open(fasta_path, 'rb') as fasta:
+        fasta.seek(offset)
+        return fasta.read(length)
+
+#Puts a prefix in front of the identifier of a header line and/or a suffix after its accession.
+#b'>sp|P02768|ALBU_HUMAN Albumin' with prefix 'CONTAM_' gives b'>CONTAM_sp|P02768|ALBU_HUMAN Albumin'
+def rewrite_header(header, prefix='', suffix=''):
+    identifier, _, description = header[1:].partition(b' ')
+    if suffix:
+        parts = identifier.split(b'|')
+        if len(parts) >= 3:
+            parts[1] += suffix.encode()
+            identifier = b'|'.join(parts)
+        else:
+            identifier += suffix.encode()
+    new_header = b'>' + prefix.encode() + identifier
+    if description:
+        new_header += b' ' + description
+    return new_header
+
+#Writes a sequence wrapped at 60 residues per line
+def write_sequence(output_file, sequence, wrap=60):
+    for i in range(0, len(sequence), wrap):
+        output_file.write(sequence[i:i + wrap].encode() + b'\n')
+
+#Makes the decoy version of a sequence, either reversed or shuffled
+def make_decoy(sequence, method, rng):
+    if method == 'reverse':
+        return sequence[::-1]
+    residues = list(sequence)
+    rng.shuffle(residues)
+    return ''.join(residues)
+
+#Merges FASTA files into one search database in a single pass over the records.
+#Records with an accession or a sequence that was already written are dropped (or renamed with duplicates='rename'),
+#records from the contaminant files get contaminant_prefix (e.g. 'CONTAM_', none by default) in front of their identifier,
+#and decoys (reversed or shuffled) can be appended at the end with decoy_prefix.
+def merge_fasta(target_paths, contaminant_paths, output_path, contaminant_prefix='', duplicates='drop',
+                decoy=None, decoy_prefix='rev_', seed=0):
+    seen_accessions = set()
+    seen_sequences = set()
+    rng = random.Random(seed)
+    counts = {"written": 0, "duplicate accession": 0, "duplicate sequence": 0, "decoys": 0}
+
+    inputs = [(path, '') for path in target_paths] + [(path, contaminant_prefix) for path in contaminant_paths]
+
+    output_path = Path(output_path)
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as tmp_dir:
+        tmp_output = Path(tmp_dir) / output_path.name
+        decoy_path = Path(tmp_dir) / 'decoys.fasta'
+
+        with open(tmp_output, 'wb') as output_file, open(decoy_path, 'wb') as decoy_file:
+            for fasta_path, prefix in inputs:
+                index = load_index(fasta_path)
+                with open(fasta_path, 'rb') as fasta:
+                    for accession, offset, length, seq_hash in index:
+                        fasta.seek(offset)
+                        record = fasta.read(length)
+                        header, _, body = record.partition(b'\n')
+                        suffix = ''
+
+                        duplicate_sequence = seq_hash in seen_sequences and seq_hash != EMPTY_SEQUENCE_HASH
+                        if accession in seen_accessions or duplicate_sequence:
+                            reason = "duplicate accession" if accession in seen_accessions else "duplicate sequence"
+                            counts[reason] += 1
+                            if duplicates == 'drop':
+                                logging.debug("Dropping %s (%s) from %s", accession, reason, fasta_path)
+                                continue
+                            # Give the record an accession that was not used yet
+                            n = 1
+                            while f"{accession}_dup{n}" in seen_accessions:
+                                n += 1
+                            suffix = f"_dup{n}"
+
+                        seen_accessions.add(accession + suffix)
+                        seen_sequences.add(seq_hash)
+
+                        # The record is copied as it is, only the header changes when needed
+                        if prefix or suffix:
+                            header = rewrite_header(header, prefix, suffix)
+                        output_file.write(header + b'\n' + body)
+                        if not body.endswith(b'\n') and body:
+                            output_file.write(b'\n')
+                        counts["written"] += 1
+
+                        if decoy:
+                            decoy_file.write(rewrite_header(header, decoy_prefix) + b'\n')
+                            write_sequence(decoy_file, make_decoy(record_sequence(record), decoy, rng))
+                            counts["decoys"] += 1
+
+            # The decoys go after all target and contaminant records
+            decoy_file.close()
+            with open(decoy_path, 'rb') as decoy_file_in:
+                shutil.copyfileobj(decoy_file_in, output_file)
+
+        os.replace(tmp_output, output_path)
+
+    logging.info(f"Merged database saved to {output_path}: " + ", ".join(f"{n} {what}" for what, n in counts.items()))
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge FASTA files into one search database, removing duplicate proteins.')
+    parser.add_argument('output', type=str, help='The output FASTA file.')
+    parser.add_argument('--target', nargs='+', required=True, help='FASTA files with the target proteins (e.g. the UniProt proteome).')
+    parser.add_argument('--contaminants', nargs='*', default=[], help='FASTA files with contaminant proteins (e.g. cRAP).')
+    parser.add_argument('--contaminant-prefix', type=str, default='', help='Prefix added to contaminant identifiers (e.g. CONTAM_).')
+    parser.add_argument('--duplicates', choices=['drop', 'rename'], default='drop', help='What to do with duplicate accessions or identical sequences.')
+    parser.add_argument('--decoy', choices=['reverse', 'shuffle'], default=None, help='Append decoy sequences.')
+    parser.add_argument('--decoy-prefix', type=str, default='rev_', help='Prefix added to decoy identifiers.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for shuffled decoys.')
+    args = parser.parse_args()
+
+    merge_fasta(args.target, args.contaminants, args.output, args.contaminant_prefix, args.duplicates,
+                args.decoy, args.decoy_prefix, args.seed)
+
+if __name__ == "__main__":
+    main()
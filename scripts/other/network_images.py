@@ -0,0 +1,15 @@
+#File names of the network images, shared by get_network_image.py (STRING API) and string_network.py (local network),
+#so both write the same files. Only the standard library, so the API path does not need numpy or scipy.
+
+import hashlib
+import os
+import re
+
+#Path of the network image of an identifier in a directory
+#Characters that cannot be in a file name (e.g. "/" in "HLA-A/B") are replaced by "_", with a short hash of the
+#identifier added so two identifiers never share a file
+def image_path(directory, identifier):
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", identifier)
+    if name != identifier or name.strip(".") == "":
+        name = f"{name}_{hashlib.sha256(identifier.encode()).hexdigest()[:8]}"
+    return os.path.join(directory, f"{name}_network.png")
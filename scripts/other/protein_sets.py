@@ -0,0 +1,250 @@
+#Protein sets (GMT) matched to the identifiers of an abundance matrix, for ssgsea.py.
+#
+#GMT files usually list gene symbols while proteomics matrices are indexed by UniProt accessions (or FASTA headers
+#like sp|P69905|HBA_HUMAN, or protein groups like P69905;P68871), so comparing them as strings silently gives no
+#overlap. Set members are matched to matrix rows directly where possible and otherwise through a local UniProt
+#ID-mapping table (both directions: symbol -> accession and accession -> symbol).
+#
+#The result is a sparse set x protein CSR matrix (a dense array without scipy) with the columns in the order of the matrix rows, plus per set
+#overlap statistics. Both are cached on disk, keyed by the hash of the GMT file, the hash of the matrix index and the
+#mapping table (size and modification time, the UniProt tables are large), so repeated analyses skip parsing and
+#mapping entirely.
+
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import abundance_cache
+
+# scipy is optional, the membership matrix is kept sparse when it is available (as in ssgsea_engine.py)
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+#Bumped whenever the matching or the cache layout changes
+CACHE_VERSION = 1
+
+#UniProt accession, with an optional isoform suffix (P69905, A0A024RBG1, P69905-2)
+UNIPROT_ACCESSION = re.compile(r"^([OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9](?:[A-Z][A-Z0-9]{2}[0-9]){1,2})(?:-\d+)?$")
+
+STATS_COLUMNS = ["Term", "Members", "Matched", "Direct", "Via mapping", "Unmatched", "Proteins", "Coverage"]
+
+def open_text(path):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+#Keys an identifier is matched by: upper case, FASTA headers reduced to the accession, isoforms also without suffix
+#A protein group ("P69905;P68871") gives the keys of all its members
+def identifier_keys(identifier):
+    keys = []
+    for part in str(identifier).split(";"):
+        part = part.strip().upper()
+        if part.count("|") >= 2:
+            part = part.split("|")[1]
+        if not part:
+            continue
+        keys.append(part)
+        if UNIPROT_ACCESSION.match(part) and "-" in part:
+            keys.append(part.split("-")[0])
+    return keys
+
+#Reads a UniProt ID-mapping table into {identifier: set of identifiers it maps to}, in both directions
+#A .dat file (UniProt's idmapping.dat: accession, type, identifier) is filtered on id_type (e.g. Gene_Name);
+#anything else is read as a tab-separated table with a header, mapping the first column to the second
+#(like the results of the UniProt ID mapping tool)
+def read_id_mapping(mapping_file, id_type="Gene_Name"):
+    mapping = {}
+
+    def add(a, b):
+        a, b = a.strip().upper(), b.strip().upper()
+        if a and b:
+            mapping.setdefault(a, set()).add(b)
+            mapping.setdefault(b, set()).add(a)
+
+    with open_text(mapping_file) as f:
+        if ".dat" in Path(mapping_file).name:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 3 and fields[1] == id_type:
+                    add(fields[0], fields[2])
+        else:
+            next(f, None)
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 2:
+                    add(fields[0], fields[1])
+    return mapping
+
+#Reads a GMT file into a list of (set name, members), keeping the order of the file
+def read_gmt(gmt_file):
+    sets = []
+    with open_text(gmt_file) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                continue
+            # The second column is a description or URL, the members follow it
+            sets.append((fields[0], list(dict.fromkeys(member for member in fields[2:] if member))))
+    return sets
+
+#Membership matrix from its CSR arrays (data, column indices, row pointers): CSR with scipy, dense without
+def membership_from_csr(data, indices, indptr, shape):
+    if sparse is not None:
+        return sparse.csr_matrix((data, indices, indptr), shape=shape)
+    membership = np.zeros(shape, dtype=np.float64)
+    membership[np.repeat(np.arange(shape[0]), np.diff(indptr)), indices] = data
+    return membership
+
+#CSR arrays (data, column indices, row pointers) of a membership matrix, sparse or dense
+def membership_to_csr(membership):
+    if sparse is not None and sparse.issparse(membership):
+        membership = membership.tocsr()
+        return membership.data, membership.indices, membership.indptr
+    rows, cols = np.nonzero(membership)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=membership.shape[0]))])
+    return membership[rows, cols], cols, indptr
+
+#Builds the set x protein membership matrix and the overlap statistics
+#proteins are the matrix rows, mapping the output of read_id_mapping (or None to match directly only)
+def build_membership(gene_sets, proteins, mapping=None):
+    rows_of = {}
+    for row, protein in enumerate(proteins):
+        for key in identifier_keys(protein):
+            rows_of.setdefault(key, set()).add(row)
+    mapping = mapping or {}
+
+    names, stats, rows, cols = [], [], [], []
+    for name, members in gene_sets:
+        matched_rows = set()
+        direct = via_mapping = 0
+        for member in members:
+            found = set()
+            for key in identifier_keys(member):
+                found |= rows_of.get(key, set())
+            if found:
+                direct += 1
+            else:
+                for key in identifier_keys(member):
+                    for mapped in mapping.get(key, ()):
+                        found |= rows_of.get(mapped, set())
+                via_mapping += bool(found)
+            matched_rows |= found
+        rows.extend([len(names)] * len(matched_rows))
+        cols.extend(sorted(matched_rows))
+        names.append(name)
+        matched = direct + via_mapping
+        stats.append((name, len(members), matched, direct, via_mapping, len(members) - matched, len(matched_rows),
+                       matched / len(members) if members else 0.0))
+
+    # rows and cols are already in CSR order (by set, then by protein)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(np.asarray(rows, dtype=np.int64), minlength=len(names)))])
+    membership = membership_from_csr(np.ones(len(cols), dtype=np.float64), np.asarray(cols, dtype=np.int64), indptr,
+                                     (len(names), len(proteins)))
+    return membership, names, pd.DataFrame(stats, columns=STATS_COLUMNS)
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+#Cache key of a membership matrix: hash of the GMT file and of the matrix index, the mapping table by size and
+#modification time
+def membership_key(gmt_file, proteins, mapping_file=None, id_type="Gene_Name"):
+    digest = hashlib.sha256(f"{CACHE_VERSION}\n{file_hash(gmt_file)}\n".encode())
+    digest.update("\n".join(map(str, proteins)).encode())
+    if mapping_file:
+        stat = os.stat(mapping_file)
+        digest.update(f"\n{Path(mapping_file).resolve()}\n{stat.st_size}\n{stat.st_mtime_ns}\n{id_type}".encode())
+    return digest.hexdigest()[:16]
+
+def save_membership(path, membership, names, stats):
+    data, indices, indptr = membership_to_csr(membership)
+    np.savez_compressed(path, data=data, indices=indices, indptr=indptr,
+                        shape=np.array(membership.shape), names=np.asarray(names),
+                        **{f"stats_{i}": np.asarray(stats[column].tolist()) for i, column in enumerate(STATS_COLUMNS)})
+
+def load_membership(path):
+    with np.load(path, allow_pickle=False) as f:
+        membership = membership_from_csr(f["data"], f["indices"], f["indptr"], tuple(f["shape"]))
+        stats = pd.DataFrame({column: f[f"stats_{i}"] for i, column in enumerate(STATS_COLUMNS)})
+        return membership, [str(name) for name in f["names"]], stats
+
+#Loads the protein sets of a GMT file as a set x protein membership matrix for the given matrix rows
+#Returns (membership, set names, overlap statistics); the columns of membership follow the order of proteins
+#The matrix is cached in cache_dir (default: <gmt>.cache) and only built when the GMT file, the matrix index or
+#the mapping table change
+def load_protein_sets(gmt_file, proteins, mapping_file=None, id_type="Gene_Name", cache_dir=None, use_cache=True):
+    proteins = list(proteins)
+    key = membership_key(gmt_file, proteins, mapping_file, id_type)
+    cache_dir = Path(cache_dir) if cache_dir else Path(str(gmt_file) + ".cache")
+    cache_file = cache_dir / f"membership_{key}.npz"
+    if use_cache and cache_file.exists():
+        membership, names, stats = load_membership(cache_file)
+        logging.info(f"Loaded {len(names)} protein sets from {cache_file}")
+        return membership, names, stats
+
+    mapping = read_id_mapping(mapping_file, id_type) if mapping_file else None
+    membership, names, stats = build_membership(read_gmt(gmt_file), proteins, mapping)
+    log_overlap(stats, mapping_file)
+
+    if use_cache:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_dir / f"membership_{key}.tmp.npz"
+        save_membership(tmp_file, membership, names, stats)
+        os.replace(tmp_file, cache_file)
+    return membership, names, stats
+
+#Logs how many set members were found in the matrix, and warns when the identifier types do not seem to match
+def log_overlap(stats, mapping_file=None):
+    members, matched = int(stats["Members"].sum()), int(stats["Matched"].sum())
+    logging.info(f"{len(stats)} protein sets: {matched} of {members} members found in the matrix "
+                 f"({int(stats['Direct'].sum())} directly, {int(stats['Via mapping'].sum())} through the ID mapping)")
+    if members and matched == 0:
+        hint = "" if mapping_file else " Give a UniProt ID-mapping table to translate them."
+        logging.warning(f"No set member matches a protein of the matrix: the identifiers are of different types.{hint}")
+
+#Turns a membership matrix back into {set name: list of matrix identifiers}, for scorers that take plain sets (gseapy)
+def membership_to_sets(membership, names, proteins):
+    proteins = np.asarray(proteins, dtype=object)
+    _, indices, indptr = membership_to_csr(membership)
+    return {name: list(proteins[indices[indptr[i]:indptr[i + 1]]])
+            for i, name in enumerate(names)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Match the protein sets of a GMT file to an abundance matrix and report the overlap per set.")
+    parser.add_argument("gmt", type=str, help="Protein sets in GMT format.")
+    parser.add_argument("abundance", type=str, help="Abundance matrix (rows = proteins, columns = samples).")
+    parser.add_argument("--id-mapping", type=str, default=None, help="UniProt ID-mapping table (idmapping.dat[.gz] or a from/to TSV).")
+    parser.add_argument("--id-type", type=str, default="Gene_Name", help="Identifier type used from an idmapping.dat file.")
+    parser.add_argument("--output", type=str, default=None, help="Save the overlap statistics as a tsv file instead of printing them.")
+    parser.add_argument("--no-cache", action="store_true", help="Build the membership matrix again instead of using the cache.")
+    args = parser.parse_args()
+
+    for path in (args.gmt, args.abundance, args.id_mapping):
+        if path and not Path(path).exists():
+            logging.error(f"Input file does not exist: {path}")
+            return
+
+    proteins = abundance_cache.load_abundance_matrix(args.abundance).index
+    membership, names, stats = load_protein_sets(args.gmt, proteins, args.id_mapping, args.id_type,
+                                                 use_cache=not args.no_cache)
+    if args.output:
+        stats.to_csv(args.output, sep="\t", index=False)
+    else:
+        print(stats.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+#Token bucket rate limiter shared by the scripts that call the STRING API from several threads.
+#The bucket holds at most `burst` tokens and refills at `rate` tokens per second; every request takes one token,
+#waiting until one is available. This keeps to the allowed request rate without a fixed sleep after every request.
+
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    #Blocks until a token is available and takes it
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
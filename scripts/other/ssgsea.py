@@ -1,25 +1,89 @@
-import gseapy as gp
-import pandas as pd
+import argparse
+import sys
+from pathlib import Path
+
+import abundance_cache
+import protein_sets as protein_set_loader
+import ssgsea_engine
+import ssgsea_permutations
+
+# Phase timings and the run report (scripts/instrumentation.py, shared with the scripts in biotools/)
+if str(Path(__file__).resolve().parent.parent) not in sys.path:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import instrumentation
 
 # Set paths for input data and gene sets
 abundance_matrix_file = "abundance_matrix.txt"
 protein_sets_file = "HYPOCHROMIC_MICROCYTIC_ANEMIA.gmt"
+output_file = "ssgsea_results_proteins.csv"
 
-# Load the abundance matrix (rows = proteins, columns = samples)
-abundance_df = pd.read_csv(abundance_matrix_file, sep="\t", index_col=0)
+def main():
+    parser = argparse.ArgumentParser(description="Single sample GSEA on a protein abundance matrix.")
+    parser.add_argument("--abundance", default=abundance_matrix_file, help="Abundance matrix (rows = proteins, columns = samples).")
+    parser.add_argument("--gene-sets", default=protein_sets_file, help="Protein sets in GMT format.")
+    parser.add_argument("--output", default=output_file, help="Output file for the results.")
+    parser.add_argument("--id-mapping", default=None, help="UniProt ID-mapping table to match set members to the matrix identifiers (idmapping.dat[.gz] or a from/to TSV).")
+    parser.add_argument("--id-type", default="Gene_Name", help="Identifier type used from an idmapping.dat file.")
+    parser.add_argument("--set-stats", default=None, help="Save the overlap of every protein set with the matrix to this tsv file.")
+    parser.add_argument("--engine", choices=["builtin", "gseapy"], default="builtin", help="Scorer to use (the built-in one is vectorised and multi-core).")
+    parser.add_argument("--threads", type=int, default=1, help="Number of processes for the built-in scorer.")
+    parser.add_argument("--permutations", type=int, default=0, help="Permutations per sample for p-values and FDR (0: scores only).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the permutations.")
+    parser.add_argument("--early-stop", type=int, default=20, help="Stop permuting a set once this many permutations reach its score (0: never).")
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32", help="Storage type of the abundance matrix.")
+    parser.add_argument("--fill-missing", type=float, default=None, help="Value for missing abundances (default: keep them missing).")
+    parser.add_argument("--no-cache", action="store_true", help="Parse the abundance matrix text instead of using the binary cache.")
+    parser.add_argument("--report", default=None, help="Save the time and peak memory of each phase to this JSON file.")
+    args = parser.parse_args()
 
-# Load protein-centric gene sets
-protein_sets = gp.gsea.GeneSets(protein_sets_file)
+    if args.report:
+        instrumentation.start()
 
-# Perform ssGSEA
-result = gp.ssgsea(data=abundance_df, gene_sets=protein_sets)
+    # Load the abundance matrix (rows = proteins, columns = samples)
+    # It is converted once into a memory-mapped binary cache next to the text file (see abundance_cache.py)
+    with instrumentation.span("ssgsea.parse") as phase:
+        abundance_df = abundance_cache.load_abundance_matrix(args.abundance, dtype=args.dtype, fill_value=args.fill_missing,
+                                                             use_cache=not args.no_cache)
+        phase.items = abundance_df.size
 
-# Print top enriched pathways
-enriched_pathways = result.res2d.sort_values("fdr", ascending=True)
-print("Top enriched pathways:")
-print(enriched_pathways.head(10))
+    # Load protein-centric gene sets, matched to the identifiers of the matrix
+    # The membership matrix is cached next to the GMT file (see protein_sets.py)
+    with instrumentation.span("ssgsea.sets") as phase:
+        membership, set_names, set_stats = protein_set_loader.load_protein_sets(args.gene_sets, abundance_df.index,
+                                                                               args.id_mapping, args.id_type)
+        phase.items = len(set_names)
+    protein_sets = (membership, set_names)
+    if args.set_stats:
+        set_stats.to_csv(args.set_stats, sep="\t", index=False)
 
-# Save the ssGSEA results to a CSV file
-output_file = "ssgsea_results_proteins.csv"
-result.res2d.to_csv(output_file, sep="\t")
-print(f"Results saved to {output_file}")
+    # Perform ssGSEA (items: set x sample scores)
+    with instrumentation.span("ssgsea.score", len(set_names) * abundance_df.shape[1]):
+        if args.engine == "gseapy":
+            import gseapy as gp
+            gene_sets = protein_set_loader.membership_to_sets(membership, set_names, abundance_df.index)
+            results = gp.ssgsea(data=abundance_df.astype("float64"), gene_sets=gene_sets, threads=args.threads,
+                                permutation_num=args.permutations, seed=args.seed).res2d
+        elif args.permutations:
+            results = ssgsea_permutations.ssgsea_permutations(abundance_df, protein_sets, args.permutations, seed=args.seed,
+                                                              n_jobs=args.threads, stop_exceedances=args.early_stop)
+        else:
+            results = ssgsea_engine.ssgsea(abundance_df, protein_sets, n_jobs=args.threads)
+
+    # Print top enriched pathways (the most significant ones when there are permutations)
+    if args.permutations:
+        enriched_pathways = results.sort_values(["FDR q-val", "NOM p-val", "NES"], ascending=[True, True, False])
+    else:
+        enriched_pathways = results.sort_values("NES", ascending=False)
+    print("Top enriched pathways:")
+    print(enriched_pathways.head(10))
+
+    # Save the ssGSEA results to a CSV file
+    with instrumentation.span("ssgsea.write", len(results)):
+        results.to_csv(args.output, sep="\t")
+    print(f"Results saved to {args.output}")
+    if args.report:
+        instrumentation.write_report(args.report, abundance=args.abundance, gene_sets=args.gene_sets,
+                                     proteins=abundance_df.shape[0], samples=abundance_df.shape[1], sets=len(set_names))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#Built-in single sample GSEA (ssGSEA) scorer.
+#Gives the same enrichment scores as gp.ssgsea (sample_norm_method="rank", weight=0.25), but scores all protein sets
+#of a sample at once with matrix products instead of walking a running sum per set.
+#
+#For a sample, genes are sorted by abundance and gene i (0-based position) adds x_i to the running sum, where
+#x_i = |r_i|^w / (sum of |r|^w over the set) for genes in the set and -1 / (number of genes not in the set) otherwise.
+#The ssGSEA score is the sum of the running sum over all positions, which is sum_i x_i * (N - i). With P = N - position,
+#W = |r|^w and M the set x gene membership matrix this is
+#    ES = (M @ (P * W)) / (M @ W) - (N(N+1)/2 - M @ P) / (N - set size)
+#so every set and sample is scored by three matrix products.
+#
+#Like gseapy, genes with equal values are ranked in reverse input order and missing values are counted as 0.
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# scipy is optional, the membership matrix is kept sparse when it is available
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+#Reads a GMT file into a dictionary {set name: list of members}
+def read_gmt(gmt_file):
+    gene_sets = {}
+    with open(gmt_file) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 3:
+                continue
+            # The second column is a description or URL, the members follow it
+            gene_sets[fields[0]] = [member for member in fields[2:] if member]
+    return gene_sets
+
+#Ranks every column of a 2D array (average rank for ties, missing values ranked last), like
+#DataFrame.rank(axis=0, method="average", na_option="bottom")
+def rank_columns(values):
+    n_rows, n_cols = values.shape
+    ranks = np.empty((n_rows, n_cols), dtype=np.float64)
+    for j in range(n_cols):
+        column = values[:, j]
+        order = np.argsort(column, kind='stable')
+        sorted_column = column[order]
+        # Start of each group of equal values (missing values form one group at the end)
+        missing = np.isnan(sorted_column)
+        new_group = np.ones(n_rows, dtype=bool)
+        new_group[1:] = (sorted_column[1:] != sorted_column[:-1]) & ~(missing[1:] & missing[:-1])
+        group_id = np.cumsum(new_group) - 1
+        starts = np.flatnonzero(new_group)
+        ends = np.append(starts[1:], n_rows)
+        average_rank = (starts + ends + 1) / 2.0
+        ranks[order, j] = average_rank[group_id]
+    return ranks
+
+#Normalises the samples before scoring, same as gseapy's sample_norm_method
+def normalize_samples(values, method="rank"):
+    if method == "rank":
+        return 10000 * rank_columns(values) / values.shape[0]
+    if method == "log_rank":
+        return np.log(10000 * rank_columns(values) / values.shape[0] + np.exp(1))
+    if method == "log":
+        values = np.where(values < 1, 1, values)
+        return np.log(values + np.exp(1))
+    if method in (None, "custom"):
+        return values
+    raise ValueError(f"Unsupported sample normalisation method: {method}")
+
+#Builds the set x gene membership matrix for the genes of the abundance matrix
+#Sets with fewer than min_size or more than max_size genes in the matrix are left out, like in gseapy
+def membership_matrix(gene_sets, genes, min_size=15, max_size=500):
+    position = {gene: i for i, gene in enumerate(genes)}
+    names, rows, cols = [], [], []
+    for name, members in gene_sets.items():
+        found = sorted({position[member] for member in members if member in position})
+        if not min_size <= len(found) <= max_size:
+            continue
+        rows.extend([len(names)] * len(found))
+        cols.extend(found)
+        names.append(name)
+
+    shape = (len(names), len(genes))
+    data = np.ones(len(rows), dtype=np.float64)
+    if sparse is not None:
+        membership = sparse.csr_matrix((data, (rows, cols)), shape=shape)
+    else:
+        membership = np.zeros(shape, dtype=np.float64)
+        membership[rows, cols] = 1.0
+    return membership, names
+
+#Membership matrix of the protein sets for the genes of the abundance matrix
+#gene_sets is {set name: members}, or a ready-made (membership, names) pair with the columns in the order of genes
+#(see protein_sets.py); the size filter applies either way
+def set_membership(gene_sets, genes, min_size=15, max_size=500):
+    if isinstance(gene_sets, dict):
+        return membership_matrix(gene_sets, genes, min_size, max_size)
+    membership, names = gene_sets
+    if membership.shape[1] != len(genes):
+        raise ValueError(f"The membership matrix has {membership.shape[1]} proteins, the abundance matrix {len(genes)}")
+    size = set_sizes(membership)[:, 0]
+    keep = np.flatnonzero((size >= min_size) & (size <= max_size))
+    return membership[keep], [names[i] for i in keep]
+
+#Missing values are counted as 0, as gseapy does (with a warning), instead of being ranked last. This only warns: the
+#values are replaced block by block (see read_block), so a memory-mapped matrix is not copied
+def warn_missing(abundance_df, block_size=64):
+    values = abundance_df.to_numpy()
+    missing = sum(int(np.isnan(np.asarray(values[:, start:start + block_size], dtype=np.float64)).sum())
+                  for start in range(0, values.shape[1], block_size))
+    if missing:
+        logging.warning(f"The abundance matrix has {missing} missing values, they are counted as 0 like in gseapy")
+    return missing
+
+#Samples start to start + block_size of a matrix as float64, with missing values as 0 (see warn_missing)
+def read_block(values, start, block_size):
+    block = np.asarray(values[:, start:start + block_size], dtype=np.float64)
+    return np.where(np.isnan(block), 0.0, block)
+
+#Position weights and |r|^w weights of a block of samples (normalised values, genes x samples)
+#The gene with the highest value gets position weight N, the lowest gets 1; genes with equal values are ranked in
+#reverse input order (a stable ascending sort, reversed), which is what gseapy does
+def sample_weights(values, weight=0.25):
+    n_genes = values.shape[0]
+    order = np.argsort(values, axis=0, kind='stable')[::-1]
+    position_weight = np.empty_like(values, dtype=np.float64)
+    np.put_along_axis(position_weight, order, np.arange(n_genes, 0, -1, dtype=np.float64)[:, None], axis=0)
+    return position_weight, np.abs(values) ** weight
+
+#Enrichment scores from the three matrix products (see the top of this file)
+def enrichment_scores(hit_weighted, hit_norm, hit_positions, set_size, n_genes):
+    total_positions = n_genes * (n_genes + 1) / 2.0
+    return hit_weighted / hit_norm - (total_positions - hit_positions) / (n_genes - set_size)
+
+#Number of genes of every set, as a column vector
+def set_sizes(membership):
+    return np.asarray(membership.sum(axis=1)).reshape(-1, 1)
+
+#Scores a block of samples (normalised values, genes x samples) against all sets, returns a sets x samples array
+def score_block(membership, values, weight=0.25):
+    position_weight, correl = sample_weights(values, weight)
+    return enrichment_scores(membership @ (position_weight * correl), membership @ correl,
+                             membership @ position_weight, set_sizes(membership), values.shape[0])
+
+# The membership matrix is sent to each worker process once, instead of with every block
+_worker_membership = None
+
+def _init_worker(membership):
+    global _worker_membership
+    _worker_membership = membership
+
+def _score_block_worker(values, weight, sample_norm_method):
+    return score_block(_worker_membership, normalize_samples(values, sample_norm_method), weight)
+
+#Scores every sample of an abundance matrix (rows = proteins, columns = samples) against the protein sets
+#Returns a sets x samples DataFrame of enrichment scores
+#Samples are scored in blocks of block_size samples, spread over n_jobs processes; each block is converted to float64
+#and ranked on its own, so a float32 or memory-mapped matrix (see abundance_cache.py) is never copied as a whole
+def ssgsea_scores(abundance_df, gene_sets, sample_norm_method="rank", weight=0.25, min_size=15, max_size=500,
+                  n_jobs=1, block_size=64):
+    warn_missing(abundance_df, block_size)
+    values = abundance_df.to_numpy()
+    membership, names = set_membership(gene_sets, list(abundance_df.index), min_size, max_size)
+    logging.info(f"{len(names)} protein sets used for scoring")
+
+    if not names:
+        return pd.DataFrame(index=pd.Index([], name="Term"), columns=abundance_df.columns, dtype=np.float64)
+
+    starts = range(0, values.shape[1], block_size)
+    blocks = (read_block(values, start, block_size) for start in starts)
+
+    if n_jobs == 1 or len(starts) == 1:
+        scores = [score_block(membership, normalize_samples(block, sample_norm_method), weight) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(membership,)) as executor:
+            scores = list(executor.map(_score_block_worker, blocks, [weight] * len(starts),
+                                       [sample_norm_method] * len(starts)))
+
+    return pd.DataFrame(np.hstack(scores), index=pd.Index(names, name="Term"), columns=abundance_df.columns)
+
+#Runs ssGSEA and returns a long table like gp.ssgsea(...).res2d: Name (sample), Term, ES and NES
+#NES is the ES divided by the range of all scores, as gseapy does
+def ssgsea(abundance_df, gene_sets, **kwargs):
+    scores = ssgsea_scores(abundance_df, gene_sets, **kwargs)
+    es_range = np.nanmax(scores.to_numpy()) - np.nanmin(scores.to_numpy()) if scores.size else 1.0
+    result = scores.T.stack().rename("ES").reset_index()
+    result.columns = ["Name", "Term", "ES"]
+    result["NES"] = result["ES"] / es_range
+    return result
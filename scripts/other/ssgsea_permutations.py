@@ -0,0 +1,175 @@
+#Permutation significance for the built-in ssGSEA scorer (ssgsea_engine.py).
+#The null distribution of a set in a sample is its score after shuffling the protein labels of that sample, i.e. the
+#score of random sets of the same size. Permutations are drawn in batches: a batch of B shuffled orders turns the
+#per-protein weights of a sample into genes x B matrices, and the three matrix products of ssgsea_engine.py then
+#score every set against all B permutations at once. A batch is drawn once and used for a whole block of samples.
+#
+#The nominal p-value of a set is, as in GSEA, the fraction of the permutations with a score of the same sign that are at
+#least as extreme as the observed score. With early stopping, a set is no longer permuted once stop_exceedances
+#permutations have reached its score: it is clearly not significant and its p-value (exceedances / permutations,
+#Besag & Clifford 1991) is already known well enough. Only the remaining sets are scored in later batches.
+#
+#Blocks of samples are spread over worker processes. The normalised abundance matrix is put in shared memory once and
+#every worker reads its samples from there, instead of getting a pickled copy of the matrix. Every batch of permutations
+#has its own random generator seeded from (seed, batch number), so for a given seed and batch size the results do not
+#depend on the number of processes.
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import ssgsea_engine
+
+#What a worker needs to score its samples: the normalised matrix, the membership matrix and the set sizes
+_worker = {}
+
+def _init_worker(shm_name, shape, membership, weight):
+    # The shared memory is kept open for as long as the worker lives (track=False: the parent removes it, Python >= 3.13)
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(shm=shm, values=np.ndarray(shape, dtype=np.float64, buffer=shm.buf), membership=membership,
+                   set_size=ssgsea_engine.set_sizes(membership), weight=weight)
+
+#Scores some sets (membership rows) of one sample against a batch of shuffled protein orders
+#position_weight and correl are the weights of the sample, perms a genes x B array of permutations (the rows of the
+#genes in membership); returns sets x B
+def permuted_scores(membership, set_size, position_weight, correl, perms):
+    return ssgsea_engine.enrichment_scores(membership @ (position_weight * correl)[perms], membership @ correl[perms],
+                                           membership @ position_weight[perms], set_size, len(correl))
+
+#Membership rows of some sets, restricted to the genes in at least one of them: the weights of the other genes are
+#not needed, so fewer are looked up in the permutations as sets stop. Returns (rows, genes)
+def restrict_sets(membership, sets):
+    rows = membership[sets]
+    genes = np.flatnonzero(np.asarray(rows.sum(axis=0)).ravel())
+    return rows[:, genes], genes
+
+#Draws batch number `batch` of the permutations (genes x size), the same for every sample and every process
+def permutation_batch(n_genes, size, seed, batch):
+    rng = np.random.default_rng([seed, batch])
+    return rng.permuted(np.broadcast_to(np.arange(n_genes)[:, None], (n_genes, size)), axis=0)
+
+#Runs the permutations of a block of samples, returns (observed scores, exceedances, permutations with a score of the
+#same sign, permutations done), each sets x samples
+#Every batch of permutations is drawn once and used for all samples of the block that still have sets left
+def sample_permutations(samples, n_permutations, seed, batch_size=128, stop_exceedances=20):
+    membership, set_size, weight = _worker["membership"], _worker["set_size"], _worker["weight"]
+    values = np.asarray(_worker["values"][:, samples[0]:samples[-1] + 1])
+    position_weight, correl = ssgsea_engine.sample_weights(values, weight)
+    n_genes = values.shape[0]
+
+    observed = ssgsea_engine.enrichment_scores(membership @ (position_weight * correl), membership @ correl,
+                                               membership @ position_weight, set_size, n_genes)
+    exceedances = np.zeros(observed.shape, dtype=np.int64)
+    same_sign = np.zeros(observed.shape, dtype=np.int64)
+    done = np.zeros(observed.shape, dtype=np.int64)
+    # Sets of every sample that are still permuted, with their membership rows (empty sets have no score)
+    active = [np.flatnonzero(~np.isnan(observed[:, j])) for j in range(len(samples))]
+    restricted = [restrict_sets(membership, sets) for sets in active]
+
+    for batch, start in enumerate(range(0, n_permutations, batch_size)):
+        if not any(len(sets) for sets in active):
+            break
+        size = min(batch_size, n_permutations - start)
+        perms = permutation_batch(n_genes, size, seed, batch)
+        for j, sets in enumerate(active):
+            if not len(sets):
+                continue
+            rows, genes = restricted[j]
+            null = permuted_scores(rows, set_size[sets], position_weight[:, j], correl[:, j], perms[genes])
+            score = observed[sets, j, None]
+            exceedances[sets, j] += np.where(score >= 0, null >= score, null <= score).sum(axis=1)
+            same_sign[sets, j] += np.where(score >= 0, null >= 0, null < 0).sum(axis=1)
+            done[sets, j] += size
+            # Sets with enough permutations at least as extreme as their score are not significant, they stop here
+            if stop_exceedances:
+                still_active = exceedances[sets, j] < stop_exceedances
+                if not still_active.all():
+                    active[j] = sets[still_active]
+                    restricted[j] = restrict_sets(membership, active[j])
+    return observed, exceedances, same_sign, done
+
+def _sample_worker(args):
+    return sample_permutations(*args)
+
+#Benjamini-Hochberg adjusted p-values (missing p-values stay missing)
+def fdr_bh(p_values):
+    p_values = np.asarray(p_values, dtype=np.float64)
+    q_values = np.full_like(p_values, np.nan)
+    present = np.flatnonzero(~np.isnan(p_values))
+    if present.size:
+        order = present[np.argsort(p_values[present], kind='stable')]
+        ranked = p_values[order] * present.size / np.arange(1, present.size + 1)
+        q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+#Runs ssGSEA with permutation p-values on an abundance matrix (rows = proteins, columns = samples)
+#Returns a long table like ssgsea_engine.ssgsea with NOM p-val, FDR q-val (Benjamini-Hochberg over the sets of each
+#sample) and the number of permutations each p-value is based on
+def ssgsea_permutations(abundance_df, gene_sets, n_permutations=1000, seed=0, n_jobs=1, batch_size=128,
+                        stop_exceedances=20, sample_norm_method="rank", weight=0.25, min_size=15, max_size=500,
+                        block_size=64):
+    ssgsea_engine.warn_missing(abundance_df, block_size)
+    membership, names = ssgsea_engine.set_membership(gene_sets, list(abundance_df.index), min_size, max_size)
+    logging.info(f"{len(names)} protein sets used for scoring, {n_permutations} permutations per sample")
+    columns = ["Name", "Term", "ES", "NES", "NOM p-val", "FDR q-val", "Permutations"]
+    if not names:
+        return pd.DataFrame(columns=columns)
+
+    values = abundance_df.to_numpy()
+    shape = values.shape
+    n_jobs = n_jobs or os.cpu_count()
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        # The matrix is normalised block by block straight into shared memory
+        normalized = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for start in range(0, shape[1], block_size):
+            block = ssgsea_engine.read_block(values, start, block_size)
+            normalized[:, start:start + block_size] = ssgsea_engine.normalize_samples(block, sample_norm_method)
+
+        # Blocks small enough to keep every process busy
+        samples_per_task = max(1, min(block_size, -(-shape[1] // n_jobs)))
+        tasks = [(range(start, min(start + samples_per_task, shape[1])), n_permutations, seed, batch_size, stop_exceedances)
+                 for start in range(0, shape[1], samples_per_task)]
+        if n_jobs == 1 or len(tasks) == 1:
+            _init_worker(shm.name, shape, membership, weight)
+            try:
+                results = [_sample_worker(task) for task in tasks]
+            finally:
+                _worker.pop("shm").close()
+                _worker.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(shm.name, shape, membership, weight)) as executor:
+                results = list(executor.map(_sample_worker, tasks))
+        del normalized
+    finally:
+        shm.close()
+        shm.unlink()
+
+    observed, exceedances, same_sign, done = (np.hstack(arrays) for arrays in zip(*results))
+    # Sets stopped early are estimated by exceedances / permutations, the others by (exceedances + 1) / (permutations + 1),
+    # counting only the permutations with a score of the same sign
+    stopped = (exceedances >= stop_exceedances) if stop_exceedances else np.zeros_like(done, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_values = np.where(stopped, exceedances / same_sign, (exceedances + 1) / (same_sign + 1))
+    p_values[np.isnan(observed)] = np.nan
+    q_values = np.column_stack([fdr_bh(p_values[:, j]) for j in range(shape[1])])
+
+    es_range = np.nanmax(observed) - np.nanmin(observed)
+    result = pd.DataFrame({
+        "Name": np.repeat(np.asarray(abundance_df.columns), len(names)),
+        "Term": np.tile(np.asarray(names, dtype=object), shape[1]),
+        "ES": observed.T.ravel(),
+        "NOM p-val": p_values.T.ravel(),
+        "FDR q-val": q_values.T.ravel(),
+        "Permutations": done.T.ravel(),
+    })
+    result["NES"] = result["ES"] / es_range
+    return result[columns]
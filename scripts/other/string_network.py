@@ -0,0 +1,378 @@
+#Local copy of a STRING protein-protein interaction network, for neighbourhood queries and network images without the API.
+#
+#A STRING links dump (<taxon>.protein.links[.detailed].v*.txt.gz) is converted once into CSR arrays next to it
+#(<links>.network/): indptr, indices (partner rows) and the combined scores (0-1000), with the partners of every protein
+#sorted by descending score, so the top k partners of a protein are the first k entries of its row. The aliases dump and
+#the protein info dump (preferred names) are optional; they are stored as a sorted table of 64-bit hashes of the
+#upper-case aliases, so identifiers are resolved with a binary search instead of a dictionary of millions of strings.
+#Later runs open all arrays memory-mapped, so a network is ready in milliseconds. The conversion is done again when one
+#of the dumps changes (size or modification time) or another minimum score is asked for.
+#
+#Queries take many proteins at once and are vectorised over the CSR arrays: the top partners of thousands of proteins,
+#or the edges between them (induced subgraph), take milliseconds. Images are drawn with matplotlib (optional), in the
+#style of STRING's network images: query proteins in colour, partners in white, edges thicker for higher scores.
+
+import argparse
+import csv
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import protein_sets
+from network_images import image_path
+
+# Images are optional, only needed to draw networks
+try:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+except ImportError:
+    Figure = None
+    FigureCanvasAgg = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+#Bumped whenever the conversion or the layout of the arrays changes
+CACHE_VERSION = 1
+
+#Alias priorities: when an alias names several proteins, the lowest priority wins (then the first protein)
+STRING_ID, PREFERRED_NAME, ALIAS = 0, 1, 2
+
+#Where the converted network of a links dump is kept
+def cache_dir_for(links_file):
+    links_file = Path(links_file)
+    return links_file.with_name(links_file.name + ".network")
+
+#What the converted network must match to be used
+#The alias hashes come from pandas, so its version is part of the key
+def cache_key(links_file, aliases_file=None, info_file=None, min_score=0):
+    sources = {}
+    for name, path in (("links", links_file), ("aliases", aliases_file), ("info", info_file)):
+        if path:
+            stat = os.stat(path)
+            sources[name] = {"path": str(Path(path).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return {"version": CACHE_VERSION, "pandas": pd.__version__, "min_score": min_score, "sources": sources}
+
+def read_names(path):
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f]
+
+def write_names(path, names):
+    with open(path, "w") as f:
+        for name in names:
+            f.write(f"{name}\n")
+
+#64-bit hashes of normalised identifiers (stripped, upper case), the keys of the alias table
+def alias_hashes(keys):
+    keys = pd.Series(keys, dtype=object).str.strip().str.upper()
+    return pd.util.hash_array(keys.to_numpy(dtype=object), categorize=False)
+
+#STRING identifier without its taxon prefix (9606.ENSP00000000233 -> ENSP00000000233)
+def strip_taxon(string_id):
+    return string_id.split(".", 1)[1] if "." in string_id else string_id
+
+#Reads the preferred names of the protein info dump: {STRING identifier: preferred name}, in the order of the file
+def read_info(info_file):
+    info = pd.read_csv(info_file, sep="\t", header=None, usecols=[0, 1], names=["protein", "name"], dtype=str,
+                       quoting=csv.QUOTE_NONE, comment=None, skiprows=1)
+    return dict(zip(info["protein"], info["name"].fillna("")))
+
+#Reads the links dump into edge arrays (rows into proteins), growing proteins with the identifiers not seen before
+#Links below min_score are left out. Returns (sources, targets, scores)
+def read_links(links_file, proteins, min_score=0, chunksize=1000000):
+    index = {protein: row for row, protein in enumerate(proteins)}
+    sources, targets, scores = [], [], []
+    for chunk in pd.read_csv(links_file, sep=" ", usecols=["protein1", "protein2", "combined_score"],
+                             dtype={"protein1": str, "protein2": str, "combined_score": np.int32}, chunksize=chunksize):
+        if min_score:
+            chunk = chunk[chunk["combined_score"] >= min_score]
+        # Both columns are factorised together, only the distinct identifiers of the chunk go through the dict
+        codes, uniques = pd.factorize(np.concatenate([chunk["protein1"].to_numpy(object), chunk["protein2"].to_numpy(object)]))
+        for protein in uniques:
+            if protein not in index:
+                index[protein] = len(proteins)
+                proteins.append(protein)
+        codes = np.array([index[protein] for protein in uniques], dtype=np.int32)[codes]
+        sources.append(codes[:len(chunk)])
+        targets.append(codes[len(chunk):])
+        scores.append(chunk["combined_score"].to_numpy(np.uint16))
+    if not sources:
+        return np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.uint16)
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(scores)
+
+#Turns edges into CSR arrays with both directions of every link, one entry per pair (the highest score, STRING lists
+#every link twice) and the partners of every protein sorted by descending score (ties by partner row)
+#The sort keys are int64, which is enough for networks of up to about 90 million proteins
+def links_to_csr(sources, targets, scores, n_proteins):
+    keep = sources != targets
+    sources, targets, scores = sources[keep], targets[keep], scores[keep]
+    sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+    scores = np.concatenate([scores, scores])
+    if not len(sources):
+        return np.zeros(n_proteins + 1, dtype=np.int64), np.empty(0, np.int32), np.empty(0, np.uint16)
+
+    # Sorting one int64 key is much faster than a lexsort on three arrays (scores are below 1024)
+    # Duplicate pairs: sorted by pair and descending score, the first of every pair has the highest score
+    key = (sources.astype(np.int64) * n_proteins + targets) * 1024 + (1023 - scores.astype(np.int64))
+    key.sort()
+    pair = key >> 10
+    first = np.ones(len(key), dtype=bool)
+    first[1:] = pair[1:] != pair[:-1]
+    key = key[first]
+    sources, targets, scores = (key >> 10) // n_proteins, (key >> 10) % n_proteins, 1023 - (key & 1023)
+    # Then by protein, descending score and partner
+    key = (sources * 1024 + (1023 - scores)) * n_proteins + targets
+    key.sort()
+    sources, scores, targets = key // (1024 * n_proteins), 1023 - (key // n_proteins) % 1024, key % n_proteins
+    scores = scores.astype(np.uint16)
+
+    indptr = np.zeros(n_proteins + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_proteins), out=indptr[1:])
+    return indptr, targets.astype(np.int32), scores
+
+#Builds the alias table: sorted hashes and the protein row of every hash (by hash, then priority, then row)
+#Every protein is found by its STRING identifier, with and without taxon prefix, and by its preferred name
+def build_aliases(proteins, names, aliases_file=None, chunksize=1000000):
+    keys = [proteins, [strip_taxon(protein) for protein in proteins], names]
+    priorities = [np.full(len(proteins), STRING_ID), np.full(len(proteins), STRING_ID), np.full(len(proteins), PREFERRED_NAME)]
+    rows = [np.arange(len(proteins))] * 3
+    hashes = [alias_hashes(key) for key in keys]
+
+    if aliases_file:
+        index = pd.Series(np.arange(len(proteins)), index=proteins)
+        for chunk in pd.read_csv(aliases_file, sep="\t", header=None, usecols=[0, 1], names=["protein", "alias"],
+                                 dtype=str, quoting=csv.QUOTE_NONE, comment=None, chunksize=chunksize):
+            # The header line starts with # (#string_protein_id or ## string_protein_id ##)
+            chunk = chunk[~chunk["protein"].str.startswith("#") & chunk["alias"].notna()]
+            chunk_rows = index.reindex(chunk["protein"]).to_numpy()
+            known = ~np.isnan(chunk_rows)
+            hashes.append(alias_hashes(chunk["alias"].to_numpy()[known]))
+            rows.append(chunk_rows[known].astype(np.int64))
+            priorities.append(np.full(int(known.sum()), ALIAS))
+
+    hashes, rows, priorities = np.concatenate(hashes), np.concatenate(rows), np.concatenate(priorities)
+    order = np.lexsort((rows, priorities, hashes))
+    return hashes[order], rows[order].astype(np.int32)
+
+#Converts the dumps into the network directory; the key is written last, so an interrupted conversion is never used
+def build_network(links_file, cache_dir, aliases_file=None, info_file=None, min_score=0):
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / "cache.json").unlink(missing_ok=True)
+
+    info = read_info(info_file) if info_file else {}
+    proteins = list(info)
+    sources, targets, scores = read_links(links_file, proteins, min_score)
+    indptr, indices, scores = links_to_csr(sources, targets, scores, len(proteins))
+    del sources, targets
+    names = [info.get(protein) or strip_taxon(protein) for protein in proteins]
+    hashes, alias_rows = build_aliases(proteins, names, aliases_file)
+
+    for name, values in (("indptr", indptr), ("indices", indices), ("scores", scores), ("alias_hashes", hashes),
+                         ("alias_rows", alias_rows)):
+        np.save(cache_dir / f"{name}.npy", values)
+    write_names(cache_dir / "proteins.txt", proteins)
+    write_names(cache_dir / "names.txt", names)
+
+    key = cache_key(links_file, aliases_file, info_file, min_score)
+    key.update(proteins=len(proteins), links=len(indices) // 2, aliases=len(hashes))
+    with open(cache_dir / "cache.json", "w") as f:
+        json.dump(key, f, indent=4)
+    logging.info(f"Converted {links_file} ({len(proteins)} proteins, {len(indices) // 2} links, {len(hashes)} aliases) "
+                 f"into {cache_dir}")
+
+#Returns True if the network in cache_dir was made from the current dumps with the same settings
+def cache_is_valid(cache_dir, key):
+    key_file = Path(cache_dir) / "cache.json"
+    if not key_file.exists():
+        return False
+    with open(key_file) as f:
+        stored = json.load(f)
+    return {name: stored.get(name) for name in key} == key
+
+#Positions in the CSR arrays of the first counts[i] entries of every row, with the row each position belongs to
+def gather_positions(indptr, rows, counts):
+    ends = np.cumsum(counts)
+    positions = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts) + np.repeat(indptr[rows], counts)
+    return positions, np.repeat(rows, counts)
+
+#A network opened from its directory; the arrays are memory-mapped
+class Network:
+    def __init__(self, cache_dir):
+        cache_dir = Path(cache_dir)
+        self.indptr, self.indices, self.scores, self.alias_hashes, self.alias_rows = (
+            np.load(cache_dir / f"{name}.npy", mmap_mode="r")
+            for name in ("indptr", "indices", "scores", "alias_hashes", "alias_rows"))
+        self.proteins = read_names(cache_dir / "proteins.txt")
+        self.names = read_names(cache_dir / "names.txt")
+        # What the network was made from (see cache_key), e.g. to tell outputs of another STRING version apart
+        with open(cache_dir / "cache.json") as f:
+            self.key = json.load(f)
+
+    def __len__(self):
+        return len(self.proteins)
+
+    #Resolves identifiers (STRING identifiers, preferred names, aliases, UniProt accessions also as FASTA headers or
+    #isoforms) to network rows. Returns (rows, unresolved): rows is {identifier: row}
+    def resolve(self, identifiers):
+        identifiers = list(dict.fromkeys(identifiers))
+        keys = [(identifier, key) for identifier in identifiers for key in protein_sets.identifier_keys(identifier)]
+        rows = {}
+        # Without an alias table (e.g. an empty network) nothing can be resolved
+        if keys and len(self.alias_hashes):
+            hashes = alias_hashes([key for _, key in keys])
+            found = np.searchsorted(self.alias_hashes, hashes)
+            found = np.minimum(found, len(self.alias_hashes) - 1)
+            matched = self.alias_hashes[found] == hashes
+            for (identifier, _), position, match in zip(keys, found, matched):
+                if match and identifier not in rows:
+                    rows[identifier] = int(self.alias_rows[position])
+        return rows, [identifier for identifier in identifiers if identifier not in rows]
+
+    #The k highest scoring partners of every row (with a score of at least min_score), as (sources, targets, scores)
+    def top_partner_edges(self, rows, k=15, min_score=0):
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.minimum(self.indptr[rows + 1] - self.indptr[rows], k)
+        positions, sources = gather_positions(self.indptr, rows, counts)
+        targets, scores = self.indices[positions], self.scores[positions]
+        keep = scores >= min_score
+        return sources[keep], targets[keep], scores[keep]
+
+    #The links between the given rows (induced subgraph), every link once, as (sources, targets, scores)
+    def subgraph_edges(self, rows, min_score=0):
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        member = np.zeros(len(self.proteins), dtype=bool)
+        member[rows] = True
+        positions, sources = gather_positions(self.indptr, rows, self.indptr[rows + 1] - self.indptr[rows])
+        targets, scores = self.indices[positions], self.scores[positions]
+        keep = member[targets] & (sources < targets) & (scores >= min_score)
+        return sources[keep], targets[keep], scores[keep]
+
+    #A protein and its k highest scoring partners, with the links between all of them (what STRING draws for one
+    #protein with add_white_nodes=k). Returns (node rows, query first, and the edges)
+    def neighbourhood(self, row, k=15, min_score=0):
+        _, partners, _ = self.top_partner_edges([row], k, min_score)
+        nodes = np.concatenate([[row], partners])
+        return nodes, self.subgraph_edges(nodes, min_score)
+
+    #Edges as a table with the identifiers and preferred names of both proteins
+    def edge_table(self, edges, rank=False):
+        sources, targets, scores = edges
+        proteins, names = np.asarray(self.proteins, dtype=object), np.asarray(self.names, dtype=object)
+        table = pd.DataFrame({"protein1": proteins[sources], "name1": names[sources], "protein2": proteins[targets],
+                              "name2": names[targets], "combined_score": np.asarray(scores, dtype=np.int64)})
+        if rank:
+            # Partners come sorted by score within each protein
+            table.insert(4, "rank", table.groupby("protein1", sort=False).cumcount() + 1)
+        return table
+
+#Opens the network of a links dump, converting it first if there is no up-to-date conversion
+def load_network(links_file, aliases_file=None, info_file=None, min_score=0, cache_dir=None):
+    cache_dir = Path(cache_dir) if cache_dir else cache_dir_for(links_file)
+    key = cache_key(links_file, aliases_file, info_file, min_score)
+    if not cache_is_valid(cache_dir, key):
+        build_network(links_file, cache_dir, aliases_file, info_file, min_score)
+    return Network(cache_dir)
+
+#Force-directed layout (Fruchterman-Reingold) of a small network: nodes repel each other, links pull their ends
+#together in proportion to their weight. Returns node positions in [-1, 1]; the same seed gives the same layout
+def spring_layout(n_nodes, sources, targets, weights, seed=0, iterations=200):
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-1, 1, size=(n_nodes, 2))
+    if n_nodes < 2:
+        return np.zeros((n_nodes, 2))
+    ideal = np.sqrt(4.0 / n_nodes)
+    for step in range(iterations):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.maximum(np.linalg.norm(delta, axis=-1), 0.01)
+        displacement = (delta * (ideal ** 2 / distance ** 2)[..., None]).sum(axis=1)
+        pull = positions[sources] - positions[targets]
+        pull = pull * (np.linalg.norm(pull, axis=1) * weights / ideal)[:, None]
+        np.add.at(displacement, sources, -pull)
+        np.add.at(displacement, targets, pull)
+        # A weak pull to the centre keeps unlinked nodes in the picture
+        displacement -= 0.05 * positions
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)
+        temperature = 0.1 * (1 - step / iterations) + 0.005
+        positions += displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+    positions -= positions.mean(axis=0)
+    return positions / max(np.abs(positions).max(), 1e-9)
+
+#Draws a network to a PNG file: nodes are network rows, edges (sources, targets, scores) links between them; the
+#highlighted rows are drawn in colour, the others in white
+def render_network(network, nodes, edges, path, highlight=(), size=6, dpi=100, seed=0):
+    if Figure is None:
+        raise ImportError("Drawing networks needs the matplotlib package (pip install matplotlib).")
+    nodes = np.asarray(nodes, dtype=np.int64)
+    local = {int(row): i for i, row in enumerate(nodes)}
+    sources, targets, scores = edges
+    local_sources = np.array([local[int(row)] for row in sources], dtype=np.int64)
+    local_targets = np.array([local[int(row)] for row in targets], dtype=np.int64)
+    weights = np.asarray(scores, dtype=np.float64) / 1000
+    positions = spring_layout(len(nodes), local_sources, local_targets, weights, seed)
+
+    figure = Figure(figsize=(size, size), dpi=dpi)
+    FigureCanvasAgg(figure)
+    axes = figure.add_axes([0, 0, 1, 1])
+    axes.set_axis_off()
+    for source, target, weight in zip(local_sources, local_targets, weights):
+        axes.plot(positions[[source, target], 0], positions[[source, target], 1], color="0.3",
+                  linewidth=0.5 + 3 * weight, alpha=0.3 + 0.6 * weight, zorder=1)
+    highlight = {int(row) for row in highlight}
+    colours = ["#e4572e" if int(row) in highlight else "white" for row in nodes]
+    axes.scatter(positions[:, 0], positions[:, 1], s=500, c=colours, edgecolors="0.2", linewidths=1, zorder=2)
+    for (x, y), row in zip(positions, nodes):
+        axes.annotate(network.names[row], (x, y), xytext=(0, 14), textcoords="offset points", ha="center",
+                      fontsize=8, zorder=3)
+    axes.set_xlim(-1.25, 1.25)
+    axes.set_ylim(-1.25, 1.25)
+    # Drawn to a temporary file first, so an interrupted run never leaves a truncated image
+    path = str(path)
+    figure.savefig(path + ".tmp", format="png")
+    os.replace(path + ".tmp", path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a local copy of a STRING network: top partners, links between proteins and network images.")
+    parser.add_argument("links", type=str, help="STRING links dump (protein.links[.detailed].v*.txt[.gz]).")
+    parser.add_argument("proteins", nargs="*", help="Protein identifiers to query.")
+    parser.add_argument("--file", type=str, default=None, help="File with one protein identifier per line.")
+    parser.add_argument("--aliases", type=str, default=None, help="STRING aliases dump, to query by other identifiers (UniProt, gene names).")
+    parser.add_argument("--info", type=str, default=None, help="STRING protein info dump, for the preferred names.")
+    parser.add_argument("--min-score", type=int, default=0, help="Leave out links with a lower combined score (0-1000).")
+    parser.add_argument("--partners", type=int, default=15, help="Number of top partners per protein.")
+    parser.add_argument("--top", type=str, default=None, help="Save the top partners of every protein to this tsv file.")
+    parser.add_argument("--subgraph", type=str, default=None, help="Save the links between the proteins to this tsv file.")
+    parser.add_argument("--images", type=str, default=None, help="Directory for a network image of every protein and its top partners.")
+    args = parser.parse_args()
+
+    protein_list = args.proteins
+    if args.file:
+        with open(args.file) as f:
+            protein_list = [line.strip() for line in f if line.strip()]
+
+    network = load_network(args.links, args.aliases, args.info, args.min_score)
+    rows, unresolved = network.resolve(protein_list)
+    logging.info(f"{len(rows)} of {len(rows) + len(unresolved)} proteins found in the network")
+    if unresolved:
+        logging.warning(f"Not in the network: {', '.join(unresolved[:20])}" + (" ..." if len(unresolved) > 20 else ""))
+    query_rows = list(dict.fromkeys(rows.values()))
+
+    top = network.edge_table(network.top_partner_edges(query_rows, args.partners), rank=True)
+    if args.top:
+        top.to_csv(args.top, sep="\t", index=False)
+    elif not args.subgraph and not args.images:
+        print(top.to_string(index=False))
+    if args.subgraph:
+        network.edge_table(network.subgraph_edges(query_rows)).to_csv(args.subgraph, sep="\t", index=False)
+    if args.images:
+        os.makedirs(args.images, exist_ok=True)
+        for identifier, row in rows.items():
+            nodes, edges = network.neighbourhood(row, args.partners)
+            render_network(network, nodes, edges, image_path(args.images, identifier), [row])
+        logging.info(f"{len(rows)} network images saved to {args.images}")
+
+if __name__ == "__main__":
+    main()
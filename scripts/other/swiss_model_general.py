@@ -1,60 +1,236 @@
+import argparse
+import asyncio
+import json
+import os
+
 import requests
-import time
 
-# Replace with your SWISS-MODEL token
-token = "MY_SWISS_MODEL_API_TOKEN"
+# Replace with your SWISS-MODEL token (or set the SWISSMODEL_TOKEN environment variable)
+token = os.environ.get("SWISSMODEL_TOKEN", "MY_SWISS_MODEL_API_TOKEN")
+
+# SWISS-MODEL API address, can be pointed to a local mock server for testing
+api_url = "https://swissmodel.expasy.org"
+
+# Job states after which a project does not change anymore
+FINAL_STATES = ["COMPLETED", "FAILED"]
+
+# Functions to keep the state of all targets in a JSON file, so a crashed run can reattach to its projects
+def load_state(state_file):
+    if state_file and os.path.exists(state_file):
+        with open(state_file) as f:
+            return json.load(f)
+    return {}
+
+def save_state(state, state_file):
+    if not state_file:
+        return
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_file, state_file)
 
-# Function to perform homology modeling with user template
-def perform_user_template_homology_modeling(target_sequences, template_coordinates):
-    # Start a new job for user template homology modelling
-    response = requests.post(
-        "https://swissmodel.expasy.org/user_template",
+# Start a user template modelling project for one target, returns its project ID
+# The blocking requests call runs in a thread, so many submissions can wait on the network at once
+async def submit_target(session, target_sequences, template_coordinates, project_title):
+    response = await asyncio.to_thread(
+        session.post,
+        f"{api_url}/user_template",
         headers={ "Authorization": f"Token {token}" },
         json={
             "target_sequences": target_sequences,
             "template_coordinates": template_coordinates,
-            "project_title": "Thalassemia"
-        })
-
-    # Check status code
-    if response.status_code == 202:
-        project_id = response.json()["project_id"]
-        print(f"Job started with project ID: {project_id}")
-    else:
-        print("Error starting modeling job.")
-        return
+            "project_title": project_title
+        },
+        timeout=60)
+
+    if response.status_code != 202:
+        raise requests.exceptions.HTTPError(f"Error starting modeling job: HTTP {response.status_code}")
+    return response.json()["project_id"]
+
+# Get the summary (status and models) of a project
+async def poll_project(session, project_id):
+    response = await asyncio.to_thread(
+        session.get,
+        f"{api_url}/project/{project_id}/models/summary/",
+        headers={ "Authorization": f"Token {token}" },
+        timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+# True if a polling error will not go away by asking again (a client error other than a rate limit, e.g. an unknown
+# project or a revoked token)
+def is_permanent(error):
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
+# Download the coordinates of the models of a completed target
+async def download_models(session, semaphore, name, models, output_dir):
+    files = []
+    for i, model in enumerate(models, start=1):
+        url = model["coordinates_url"]
+        # Keep the extension of the URL (e.g. .pdb or .pdb.gz)
+        extension = url.split("/")[-1].split(".", 1)[1] if "." in url.split("/")[-1] else "pdb"
+        file_name = os.path.join(output_dir, f"{name}_model_{i}.{extension}")
+        async with semaphore:
+            response = await asyncio.to_thread(session.get, url, timeout=120)
+        response.raise_for_status()
+        with open(file_name, "wb") as f:
+            f.write(response.content)
+        files.append(file_name)
+    print(f"Saved {len(files)} model(s) for {name}")
+    return files
+
+# Model many targets at once
+# targets is a dictionary {name: list of target sequences}. Up to max_in_flight projects run at the same time,
+# all running projects are polled together, waiting longer between rounds while nothing changes
+# (from min_interval up to max_interval seconds). Project IDs are saved in state_file as soon as they are known,
+# so running again with the same state file picks up the projects that were still running instead of resubmitting them.
+# A project is given up (status POLL_FAILED) after max_poll_failures failed polls in a row, or at once on a client error;
+# it keeps its project ID, so a later run reattaches to it.
+async def run_homology_modeling(targets, template_coordinates, state_file="swissmodel_state.json", output_dir=".",
+                                max_in_flight=10, project_title="Thalassemia", min_interval=5, max_interval=60,
+                                max_poll_failures=5):
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_state(state_file)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    downloads = {}
+
+    with requests.Session() as session:
+        # Projects started by an earlier run are reattached, finished ones are left alone
+        in_flight = {}
+        queue = []
+        for name in targets:
+            entry = state.get(name, {})
+            if entry.get("status") in FINAL_STATES:
+                if entry["status"] == "COMPLETED" and not entry.get("files"):
+                    downloads[name] = asyncio.create_task(download_models(session, semaphore, name, entry["models"], output_dir))
+                continue
+            if entry.get("project_id"):
+                print(f"Reattaching {name} to project {entry['project_id']}")
+                in_flight[name] = entry["project_id"]
+            else:
+                queue.append(name)
+
+        interval = min_interval
+        poll_failures = {}
+        while in_flight or queue:
+            # Fill the free slots with new submissions, sent together
+            to_submit = queue[:max(0, max_in_flight - len(in_flight))]
+            queue = queue[len(to_submit):]
+            results = await asyncio.gather(
+                *(submit_target(session, targets[name], template_coordinates, project_title) for name in to_submit),
+                return_exceptions=True)
+            for name, result in zip(to_submit, results):
+                if isinstance(result, Exception):
+                    print(f"Error starting modeling job for {name}: {result}")
+                    state[name] = {"status": "SUBMIT_FAILED", "error": str(result)}
+                else:
+                    print(f"Job for {name} started with project ID: {result}")
+                    state[name] = {"project_id": result, "status": "SUBMITTED"}
+                    in_flight[name] = result
+            save_state(state, state_file)
+
+            if not in_flight:
+                continue
+
+            await asyncio.sleep(interval)
+
+            # Poll every running project in one round
+            names = list(in_flight)
+            summaries = await asyncio.gather(*(poll_project(session, in_flight[name]) for name in names),
+                                             return_exceptions=True)
+            changed = False
+            for name, summary in zip(names, summaries):
+                if not isinstance(summary, Exception) and not summary.get("status"):
+                    summary = ValueError("no status in the project summary")
+                if isinstance(summary, Exception):
+                    poll_failures[name] = poll_failures.get(name, 0) + 1
+                    print(f"Error polling {name} ({poll_failures[name]}/{max_poll_failures}): {summary}")
+                    if is_permanent(summary) or poll_failures[name] >= max_poll_failures:
+                        print(f"Giving up on {name}, run again with the same state file to retry project {in_flight[name]}")
+                        state[name].update(status="POLL_FAILED", error=str(summary))
+                        del in_flight[name]
+                        changed = True
+                    continue
+                poll_failures.pop(name, None)
+                status = summary["status"]
+                if status != state[name]["status"]:
+                    changed = True
+                    print(f"Job status of {name} is now {status}")
+                    state[name]["status"] = status
+                if status in FINAL_STATES:
+                    del in_flight[name]
+                    models = [model for model in summary.get("models") or [] if model.get("coordinates_url")]
+                    if status == "COMPLETED" and not models:
+                        # Nothing to download, the project is no use even though it finished
+                        print(f"Modeling job for {name} completed without models.")
+                        state[name].update(status="FAILED", error="completed without models")
+                    elif status == "COMPLETED":
+                        state[name]["models"] = [{"coordinates_url": model["coordinates_url"]} for model in models]
+                        downloads[name] = asyncio.create_task(download_models(session, semaphore, name, state[name]["models"], output_dir))
+                    else:
+                        print(f"Modeling job for {name} failed.")
+            save_state(state, state_file)
+
+            # Poll quickly while jobs are changing, back off while they are not
+            interval = min_interval if changed else min(interval * 1.5, max_interval)
+
+        # Wait for the model downloads to finish
+        for name, task in downloads.items():
+            try:
+                state[name]["files"] = await task
+            except requests.exceptions.RequestException as e:
+                print(f"Error downloading models for {name}: {e}")
+        save_state(state, state_file)
 
-    # Polling loop for job status
-    while True:
-        time.sleep(10)
+    return state
 
-        response = requests.get(
-            f"https://swissmodel.expasy.org/project/{project_id}/models/summary/", 
-            headers={ "Authorization": f"Token {token}" })
+# Model one target (a list of target sequences) on a template and wait for it, without a state file
+# Kept for the scripts that call it, it is run_homology_modeling with a single target
+def perform_user_template_homology_modeling(target_sequences, template_coordinates, output_dir="."):
+    state = asyncio.run(run_homology_modeling({"target": target_sequences}, template_coordinates, state_file=None,
+                                              output_dir=output_dir))
+    return state["target"]
 
-        status = response.json()["status"]
-        print(f"Job status is now {status}")
+# Reads target sequences from a FASTA file, each record is one target
+def read_targets(fasta_file):
+    targets = {}
+    name = None
+    with open(fasta_file) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                targets[name] = [""]
+            elif name and line:
+                targets[name][0] += line
+    return targets
 
-        if status in ["COMPLETED", "FAILED"]:
-            break
+def main():
+    parser = argparse.ArgumentParser(description="Model many target sequences on a user template with SWISS-MODEL.")
+    parser.add_argument("template", help="Template coordinates (PDB file).")
+    parser.add_argument("--targets", default=None, help="FASTA file with the target sequences (default: the example sequence).")
+    parser.add_argument("--state-file", default="swissmodel_state.json", help="File keeping the project IDs, to resume a run.")
+    parser.add_argument("--output-dir", default=".", help="Directory for the model coordinates.")
+    parser.add_argument("--max-in-flight", type=int, default=10, help="Maximum number of projects running at the same time.")
+    parser.add_argument("--max-poll-failures", type=int, default=5, help="Failed status checks in a row after which a project is given up.")
+    args = parser.parse_args()
 
-    # Check if job is COMPLETED and fetch the model coordinates
-    response_object = response.json()
-    if response_object['status'] == 'COMPLETED':
-        for model in response_object['models']:
-            print("Model coordinates URL:", model['coordinates_url'])
-    else:
-        print("Modeling job failed.")
+    # Example target sequences and template coordinates
+    target_sequences = {"target": [
+        "AMINO_ACID_SEQUENCE"
+    ]}
+    if args.targets:
+        target_sequences = read_targets(args.targets)
 
-# Example target sequences and template coordinates
-target_sequences = [
-    "AMINO_ACID_SEQUENCE"
-]
+    # Load template coordinates from file
+    # Must have pdb file downloaded already
+    with open(args.template) as f:
+        template_coordinates = f.read()
 
-# Load template coordinates from file
-# Must have pdb file downloaded already
-with open("sample.pdb") as f:
-    template_coordinates = f.read()
+    # Perform user template homology modeling
+    asyncio.run(run_homology_modeling(target_sequences, template_coordinates, args.state_file, args.output_dir, args.max_in_flight,
+                                      max_poll_failures=args.max_poll_failures))
 
-# Perform user template homology modeling
-perform_user_template_homology_modeling(target_sequences, template_coordinates)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#The project's steps as one pipeline (see pipeline_runner.py for how it is run and cached).
+#
+#    database preparation:  proteome + contaminants (get_fasta.py, get_cRAP.py) -> search_database (add_contams.py)
+#    bio.tools:             fetch_biotools:<query> -> json2tsv:<query> -> combine_tsv -> reproducibility_score
+#    analysis:              string_mapping (map_identifiers_string.py), enrichment (GO_enrichment.py), ssgsea (ssgsea.py)
+#
+#Which steps exist and their parameters come from a JSON config file (see DEFAULT_CONFIG); branches whose inputs are
+#not configured are left out. Paths are relative to the working directory.
+#Run: python scripts/pipeline.py --config pipeline.json [step ...]
+
+import argparse
+import json
+import logging
+import re
+import sys
+from pathlib import Path
+
+# The steps call the scripts in biotools/ and other/, which import each other by module name
+SCRIPTS_DIR = Path(__file__).resolve().parent
+for subdir in ("biotools", "other"):
+    if str(SCRIPTS_DIR / subdir) not in sys.path:
+        sys.path.insert(0, str(SCRIPTS_DIR / subdir))
+
+import pipeline_runner
+from pipeline_runner import Step
+
+DEFAULT_CONFIG = {
+    # Database preparation
+    "fasta_url": "https://rest.uniprot.org/uniprotkb/stream?format=fasta&query=%28%28proteome%3AUP000005640%29%29",
+    "crap_url": "http://ftp.thegpm.org/fasta/cRAP/crap.fasta",
+    "proteome": "HRP.fasta",
+    "contaminants": "crap.fasta",
+    "search_database": "HRP_contams.fasta",
+    "dedup": False,
+    "contaminant_prefix": "",
+    "decoy": None,
+    # bio.tools: one fetch and one table per query, then the combined table and its scores
+    "biotools_queries": [],
+    "biotools_url": "https://bio.tools/api/tool/",
+    "biotools_dir": "biotools",
+    "combined_table": "biotools/combined_tools.tsv",
+    "scores": "biotools/reproducibility_scores.tsv",
+    # STRING identifiers of a protein list (one identifier per line)
+    "proteins": None,
+    "species": 9606,
+    "string_ids": "string_ids.tsv",
+    # GO enrichment of a table of gene lists (list_id, gene), offline if an annotation file is given
+    "gene_lists": None,
+    "annotations": None,
+    "obo": None,
+    "sources": ["GO:BP"],
+    "threshold": 0.05,
+    "enrichment": "enrichment.tsv",
+    # ssGSEA of an abundance matrix
+    "abundance": None,
+    "gene_sets": None,
+    "id_mapping": None,
+    "permutations": 0,
+    "seed": 0,
+    "threads": 1,
+    "ssgsea": "ssgsea_results.tsv",
+}
+
+#Download of a database file through the shared download cache
+def download_proteome(output, url):
+    import get_fasta
+    get_fasta.get_fasta(url, output)
+
+def download_contaminants(output, url):
+    import get_cRAP
+    get_cRAP.get_crap(url, output)
+
+#Search database: proteome plus contaminants, concatenated (add_contams.py) or merged without duplicates (merge_fasta.py)
+def search_database(proteome, contaminants, output, dedup=False, contaminant_prefix="", decoy=None):
+    if dedup:
+        import merge_fasta
+        merge_fasta.merge_fasta([proteome], [contaminants], output, contaminant_prefix=contaminant_prefix, decoy=decoy)
+    else:
+        import add_contams
+        add_contams.concatenate_fasta_files(proteome, contaminants, output)
+
+def fetch_biotools_query(output, query, url, page_size=150, workers=8):
+    import fetch_biotools
+    tools = fetch_biotools.fetch_biotools(query, url=url, page_size=page_size, workers=workers)
+    if not tools:
+        raise RuntimeError(f"No tools fetched for '{query}'")
+    if output.endswith(".parquet"):
+        fetch_biotools.save_to_parquet(tools, output)
+    else:
+        fetch_biotools.save_to_file(tools, output)
+
+def biotools_table(entries, output):
+    import json2tsv
+    json2tsv.json_to_tsv_streaming(entries, output)
+
+#Only the tables of the configured queries are combined, not every tsv file of their directory
+def combine_tables(tables, output):
+    import combine_tsv
+    if not combine_tsv.combine_tsv_files(tables, output, include_source=True):
+        raise RuntimeError("combine_tsv failed")
+
+def score_tools(table, output, workers=1):
+    import reproducibility_score
+    scores = reproducibility_score.score_tools(reproducibility_score.read_table(table), reproducibility_score.RULES,
+                                               workers, table)
+    scores.sort_values(["Total", "Name"], ascending=[False, True]).to_csv(output, sep='\t', index=False)
+
+def string_mapping(proteins, output, species=9606):
+    import map_identifiers_string
+    with open(proteins) as f:
+        protein_list = [line.strip() for line in f if line.strip()]
+    mapping, unresolved = map_identifiers_string.resolve_protein_identifiers(protein_list, species=species)
+    with open(output, "w") as f:
+        f.write("identifier\tstring_id\n")
+        for identifier in protein_list:
+            f.write(f"{identifier}\t{mapping.get(identifier, '')}\n")
+
+def enrichment(gene_lists, output, annotations=None, obo=None, sources=("GO:BP",), threshold=0.05):
+    import GO_enrichment
+    loaded = None
+    if annotations:
+        import go_offline
+        loaded = go_offline.load_annotations(annotations, obo)
+    results = GO_enrichment.enrich_gene_lists(GO_enrichment.read_gene_lists(table=gene_lists), sources=sources,
+                                              threshold=threshold, annotations=loaded)
+    results.to_csv(output, sep="\t", index=False)
+
+def ssgsea(abundance, gene_sets, output, id_mapping=None, permutations=0, seed=0, threads=1):
+    import abundance_cache
+    import protein_sets
+    import ssgsea_engine
+    import ssgsea_permutations
+    abundance_df = abundance_cache.load_abundance_matrix(abundance)
+    membership, names, _ = protein_sets.load_protein_sets(gene_sets, abundance_df.index, id_mapping)
+    if permutations:
+        results = ssgsea_permutations.ssgsea_permutations(abundance_df, (membership, names), permutations, seed=seed,
+                                                          n_jobs=threads)
+    else:
+        results = ssgsea_engine.ssgsea(abundance_df, (membership, names), n_jobs=threads)
+    results.to_csv(output, sep="\t")
+
+#Name of a bio.tools query usable in step and file names ("mass spectrometry" -> mass_spectrometry)
+def query_slug(query):
+    return re.sub(r"[^A-Za-z0-9]+", "_", query).strip("_").lower() or "query"
+
+#Builds the steps of the pipeline from a config (DEFAULT_CONFIG with the given values replaced)
+def build_steps(config, workdir="."):
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    workdir = Path(workdir)
+
+    def path(value):
+        return str(workdir / value)
+
+    steps = [
+        Step("proteome", download_proteome, outputs={"output": path(config["proteome"])},
+             params={"url": config["fasta_url"]}, modules=["get_fasta", "cached_download"], volatile=True),
+        Step("contaminants", download_contaminants, outputs={"output": path(config["contaminants"])},
+             params={"url": config["crap_url"]}, modules=["get_cRAP", "cached_download"], volatile=True),
+        Step("search_database", search_database,
+             inputs={"proteome": path(config["proteome"]), "contaminants": path(config["contaminants"])},
+             outputs={"output": path(config["search_database"])},
+             params={"dedup": config["dedup"], "contaminant_prefix": config["contaminant_prefix"], "decoy": config["decoy"]},
+             modules=["add_contams", "merge_fasta", "cached_download", "instrumentation"]),
+    ]
+
+    if config["biotools_queries"]:
+        biotools_dir = workdir / config["biotools_dir"]
+        tables = []
+        for query in config["biotools_queries"]:
+            slug = query_slug(query)
+            entries = str(biotools_dir / "fetched" / f"{slug}.json")
+            tables.append(str(biotools_dir / "tables" / f"{slug}.tsv"))
+            # bio.tools changes between runs, so the fetch always runs, like the downloads; the steps after it are
+            # still skipped when the fetched entries did not change
+            steps.append(Step(f"fetch_biotools:{slug}", fetch_biotools_query, outputs={"output": entries},
+                              params={"query": query, "url": config["biotools_url"]},
+                              modules=["fetch_biotools", "instrumentation"], volatile=True))
+            steps.append(Step(f"json2tsv:{slug}", biotools_table, inputs={"entries": entries},
+                              outputs={"output": tables[-1]}, modules=["json2tsv", "pubmed_cache", "instrumentation"]))
+        steps.append(Step("combine_tsv", combine_tables, inputs={"tables": tables},
+                          outputs={"output": path(config["combined_table"])}, modules=["combine_tsv", "instrumentation"]))
+        steps.append(Step("reproducibility_score", score_tools, inputs={"table": path(config["combined_table"])},
+                          outputs={"output": path(config["scores"])}, modules=["reproducibility_score"]))
+
+    if config["proteins"]:
+        steps.append(Step("string_mapping", string_mapping, inputs={"proteins": path(config["proteins"])},
+                          outputs={"output": path(config["string_ids"])}, params={"species": config["species"]},
+                          modules=["map_identifiers_string", "rate_limiter"]))
+
+    if config["gene_lists"]:
+        inputs = {"gene_lists": path(config["gene_lists"])}
+        for name in ("annotations", "obo"):
+            if config[name]:
+                inputs[name] = path(config[name])
+        steps.append(Step("enrichment", enrichment, inputs=inputs, outputs={"output": path(config["enrichment"])},
+                          params={"sources": list(config["sources"]), "threshold": config["threshold"]},
+                          modules=["GO_enrichment", "go_offline"]))
+
+    if config["abundance"] and config["gene_sets"]:
+        inputs = {"abundance": path(config["abundance"]), "gene_sets": path(config["gene_sets"])}
+        if config["id_mapping"]:
+            inputs["id_mapping"] = path(config["id_mapping"])
+        steps.append(Step("ssgsea", ssgsea, inputs=inputs, outputs={"output": path(config["ssgsea"])},
+                          params={"permutations": config["permutations"], "seed": config["seed"],
+                                  "threads": config["threads"]},
+                          modules=["abundance_cache", "protein_sets", "ssgsea_engine", "ssgsea_permutations"]))
+    return steps
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the project's steps as one pipeline, skipping steps whose inputs did not change.")
+    parser.add_argument("targets", nargs="*", help="Steps to run, with the steps they need (default: all).")
+    parser.add_argument("--config", type=str, default=None, help="JSON file with the settings to change from the defaults.")
+    parser.add_argument("--workdir", type=str, default=".", help="Directory the paths of the config are relative to.")
+    parser.add_argument("--jobs", type=int, default=2, help="Number of steps run at the same time.")
+    parser.add_argument("--force", nargs="+", default=[], help="Steps to run even if they are up to date.")
+    parser.add_argument("--force-all", action="store_true", help="Run every step even if it is up to date.")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which steps would run.")
+    parser.add_argument("--list", action="store_true", help="List the steps and what they need, then stop.")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        unknown = sorted(set(config) - set(DEFAULT_CONFIG))
+        if unknown:
+            logging.error(f"Unknown settings in {args.config}: {', '.join(unknown)}")
+            sys.exit(2)
+
+    steps = build_steps(config, args.workdir)
+    try:
+        if args.list:
+            dependencies = pipeline_runner.build_dag(steps)
+            for step in steps:
+                needs = ", ".join(sorted(dependencies[step.name])) or "-"
+                print(f"{step.name:<32} needs: {needs}")
+            return
+        record = pipeline_runner.run(steps, args.targets, args.jobs, True if args.force_all else args.force,
+                                     args.dry_run, args.workdir)
+    except pipeline_runner.PipelineError as e:
+        logging.error(str(e))
+        sys.exit(2)
+
+    counts = {}
+    for entry in record["steps"].values():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    logging.info(f"Pipeline {record['status']} in {record['seconds']:.1f}s: "
+                 + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if record["status"] != "ok":
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#DAG runner for the project's steps (see pipeline.py for the steps themselves).
+#
+#Every step is a function with declared input and output files and parameters. The runner links steps through their
+#files (a step that reads a file depends on the step that writes it), runs independent branches in parallel and skips
+#a step when the content of its inputs, its parameters and the code of its modules are the same as in its last
+#successful run and its outputs are still there unchanged. Each run writes a record with the timing, status and the
+#hashes of everything that went in and came out of every step (the provenance of the outputs), and the time and peak
+#memory of the phases the scripts report (see instrumentation.py).
+#
+#State lives in <workdir>/.pipeline: state.json holds the last successful run of every step, runs/ one record per run.
+
+import hashlib
+import importlib.util
+import inspect
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from importlib.metadata import version
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from pathlib import Path
+
+import instrumentation
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+STATE_DIR = ".pipeline"
+
+#Packages whose versions are written to the run record
+RECORDED_PACKAGES = ["numpy", "pandas", "pyarrow", "scipy", "requests", "gseapy", "gprofiler"]
+
+#Raised when the steps do not form a valid DAG (two steps writing the same file, a cycle, an unknown target)
+class PipelineError(Exception):
+    pass
+
+#One step of the pipeline
+#func is called as func(**inputs, **outputs, **params), with inputs and outputs as {argument name: path}
+#modules are the modules whose code the step runs, with the helper modules they import (e.g. instrumentation); a change
+#to their source makes the step run again
+#volatile steps read something the runner cannot hash (a URL) and always run; steps after them are still skipped when
+#their output did not change
+class Step:
+    def __init__(self, name, func, inputs=None, outputs=None, params=None, modules=(), volatile=False):
+        self.name = name
+        self.func = func
+        self.inputs = dict(inputs or {})
+        self.outputs = dict(outputs or {})
+        self.params = dict(params or {})
+        self.modules = list(modules)
+        self.volatile = volatile
+
+    def input_paths(self):
+        return [path for value in self.inputs.values() for path in (value if isinstance(value, list) else [value])]
+
+    def output_paths(self):
+        return list(self.outputs.values())
+
+#Hashes of files, memoised by size and modification time so unchanged files are not read again
+class FileHasher:
+    def __init__(self, known=None):
+        self.known = dict(known or {})
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        entry = self.known.get(str(path))
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.known[str(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    #Hash of a file, or of a directory as the hashes of all its files; None if the path does not exist
+    def hash(self, path):
+        path = Path(path)
+        if path.is_dir():
+            digest = hashlib.sha256()
+            for child in sorted(p for p in path.rglob("*") if p.is_file()):
+                digest.update(f"{child.relative_to(path)}\t{self.file_hash(child)}\n".encode())
+            return "dir:" + digest.hexdigest()
+        if path.is_file():
+            return self.file_hash(path)
+        return None
+
+#Orders the steps so every step comes after the steps writing its inputs, returns {step name: set of step names it needs}
+def build_dag(steps):
+    writers = {}
+    for step in steps:
+        for path in step.output_paths():
+            if str(path) in writers:
+                raise PipelineError(f"{path} is written by both {writers[str(path)]} and {step.name}")
+            writers[str(path)] = step.name
+
+    dependencies = {}
+    for step in steps:
+        dependencies[step.name] = set()
+        for path in step.input_paths():
+            # An input inside an output directory of another step also depends on that step
+            for written, writer in writers.items():
+                if writer != step.name and (str(path) == written or str(path).startswith(written.rstrip("/") + "/")):
+                    dependencies[step.name].add(writer)
+
+    # Kahn's algorithm, only to find cycles
+    remaining = {name: set(needs) for name, needs in dependencies.items()}
+    while remaining:
+        ready = [name for name, needs in remaining.items() if not needs]
+        if not ready:
+            raise PipelineError(f"The steps {', '.join(sorted(remaining))} depend on each other in a cycle")
+        for name in ready:
+            del remaining[name]
+        for needs in remaining.values():
+            needs.difference_update(ready)
+    return dependencies
+
+#The steps needed for the targets (the targets and everything upstream of them); all steps without targets
+def select_steps(dependencies, targets=None):
+    if not targets:
+        return set(dependencies)
+    unknown = [target for target in targets if target not in dependencies]
+    if unknown:
+        raise PipelineError(f"Unknown steps: {', '.join(unknown)} (known: {', '.join(sorted(dependencies))})")
+    selected, pending = set(), list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    return selected
+
+#Hash of the code a step runs: the file its function is defined in and the source files of its modules
+def code_hash(step):
+    files = [inspect.getsourcefile(step.func)]
+    for module in step.modules:
+        spec = importlib.util.find_spec(module)
+        files.append(spec.origin if spec else None)
+    digest = hashlib.sha256()
+    for path in sorted(path for path in files if path and os.path.isfile(path)):
+        with open(path, "rb") as f:
+            digest.update(f"{Path(path).name}\n".encode() + f.read())
+    return digest.hexdigest()
+
+#Cache key of a step: its name, parameters, code and the content of its inputs
+def step_key(step, input_hashes, code):
+    description = {"name": step.name, "params": step.params, "inputs": input_hashes, "code": code,
+                   "outputs": {name: str(path) for name, path in step.outputs.items()}}
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_state(state_dir):
+    path = Path(state_dir) / "state.json"
+    if not path.exists():
+        return {"steps": {}, "files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state_dir, state):
+    path = Path(state_dir) / "state.json"
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+#Where the code and the Python environment of a run came from
+def environment():
+    packages = {}
+    for package in RECORDED_PACKAGES:
+        try:
+            packages[package] = version(package)
+        except Exception:
+            continue
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "packages": packages,
+            "git_commit": commit, "argv": sys.argv}
+
+#Runs one step, fails if one of its outputs was not written
+#Returns the peak memory sampled while it ran (of the whole process: steps running at the same time are included)
+def execute(step):
+    for path in step.output_paths():
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with instrumentation.span(f"pipeline.{step.name}") as phase:
+        step.func(**step.inputs, **step.outputs, **step.params)
+    missing = [str(path) for path in step.output_paths() if not Path(path).exists()]
+    if missing:
+        raise RuntimeError(f"{step.name} did not write {', '.join(missing)}")
+    return phase.peak_rss
+
+#Runs the steps needed for the targets, at most jobs at a time
+#force: step names to run even if they are up to date (True for all); dry_run only reports what would run
+#Returns the run record (also written to <workdir>/.pipeline/runs/)
+def run(steps, targets=None, jobs=1, force=(), dry_run=False, workdir="."):
+    by_name = {step.name: step for step in steps}
+    dependencies = build_dag(steps)
+    selected = select_steps(dependencies, targets)
+    force = set(by_name) if force is True else set(force or ())
+
+    state_dir = Path(workdir) / STATE_DIR
+    state_dir.mkdir(parents=True, exist_ok=True)
+    state = load_state(state_dir)
+    hasher = FileHasher(state.get("files"))
+    started = datetime.now(timezone.utc)
+    record = {"run": started.strftime("%Y%m%dT%H%M%S.%fZ"), "started": started.isoformat(), "environment": environment(),
+              "steps": {}}
+
+    done, failed, would_run, running = set(), set(), set(), {}
+    pending = set(selected)
+    instrumentation.start()
+    # Hashing, state changes and the record are only touched from this thread; the pool only runs step functions
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                needs = dependencies[name] & selected
+                if needs & failed:
+                    pending.discard(name)
+                    failed.add(name)
+                    record["steps"][name] = {"status": "blocked", "reason": f"{', '.join(sorted(needs & failed))} failed"}
+                    logging.error(f"[{name}] not run: {record['steps'][name]['reason']}")
+                    continue
+                if not needs <= done or len(running) >= max(1, jobs):
+                    continue
+                pending.discard(name)
+                step = by_name[name]
+                missing = [str(path) for path in step.input_paths() if hasher.hash(path) is None]
+                if missing and not dry_run:
+                    failed.add(name)
+                    record["steps"][name] = {"status": "failed", "error": f"missing inputs: {', '.join(missing)}"}
+                    logging.error(f"[{name}] missing inputs: {', '.join(missing)}")
+                    continue
+                input_hashes = {str(path): hasher.hash(path) for path in step.input_paths()}
+                code = code_hash(step)
+                key = step_key(step, input_hashes, code)
+                entry = {"inputs": input_hashes, "params": step.params, "code": code, "key": key}
+
+                previous = state["steps"].get(name)
+                up_to_date = (not step.volatile and name not in force and previous is not None and previous["key"] == key
+                              and all(hasher.hash(path) == previous["outputs"].get(str(path)) for path in step.output_paths()))
+                # In a dry run, steps after a step that would run may get other inputs, so they would run too
+                if dry_run and needs & would_run:
+                    up_to_date = False
+                if up_to_date or dry_run:
+                    entry["status"] = "skipped" if up_to_date else "would run"
+                    if not up_to_date:
+                        would_run.add(name)
+                    entry["outputs"] = previous["outputs"] if up_to_date else {}
+                    record["steps"][name] = entry
+                    done.add(name)
+                    logging.info(f"[{name}] {'up to date, skipped' if up_to_date else 'would run'}")
+                    continue
+
+                logging.info(f"[{name}] running")
+                entry["start"] = time.perf_counter()
+                record["steps"][name] = entry
+                running[executor.submit(execute, step)] = name
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                step, entry = by_name[name], record["steps"][name]
+                entry["seconds"] = round(time.perf_counter() - entry.pop("start"), 3)
+                try:
+                    entry["peak_rss_bytes"] = future.result()
+                except Exception as e:
+                    entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+                    failed.add(name)
+                    logging.error(f"[{name}] failed after {entry['seconds']:.1f}s: {entry['error']}")
+                    continue
+                entry["status"] = "ran"
+                entry["outputs"] = {str(path): hasher.hash(path) for path in step.output_paths()}
+                state["steps"][name] = {"key": entry["key"], "outputs": entry["outputs"],
+                                        "finished": datetime.now(timezone.utc).isoformat()}
+                done.add(name)
+                logging.info(f"[{name}] done in {entry['seconds']:.1f}s")
+                save_state(state_dir, {**state, "files": hasher.known})
+
+    finished = datetime.now(timezone.utc)
+    record["finished"] = finished.isoformat()
+    record["seconds"] = round((finished - started).total_seconds(), 3)
+    record["status"] = "failed" if failed else "ok"
+    instrumentation.recorder.stop()
+    measured = instrumentation.report()
+    record["peak_rss_bytes"], record["max_rss_bytes"] = measured["peak_rss_bytes"], measured["max_rss_bytes"]
+    record["phases"] = measured["phases"]
+    if not dry_run:
+        save_state(state_dir, {**state, "files": hasher.known})
+        runs_dir = state_dir / "runs"
+        runs_dir.mkdir(exist_ok=True)
+        with open(runs_dir / f"{record['run']}.json", "w") as f:
+            json.dump(record, f, indent=4, default=str)
+    return record
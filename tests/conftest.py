@@ -0,0 +1,28 @@
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+# The scripts are not a package, they import each other from their own directories
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+for directory in (SCRIPTS, SCRIPTS / "biotools", SCRIPTS / "other"):
+    sys.path.insert(0, str(directory))
+
+
+# A local HTTP server for the scripts that call web APIs: serve(handler_class) starts it and returns its base URL
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,37 @@
+import gzip
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import cached_download
+
+FASTA = b">sp|P1|TEST\nMKV\n"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    files = {"/plain.fasta": FASTA, "/packed.fasta.gz": gzip.compress(FASTA)}
+
+    def do_GET(self):
+        data = self.files[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("path", ["/plain.fasta", "/packed.fasta.gz"])
+def test_gz_output_is_compressed_once(serve, tmp_path, path):
+    output = tmp_path / "db.fasta.gz"
+    cached_download.download(serve(FileHandler) + path, output, cache_dir=tmp_path / "cache")
+    with gzip.open(output, "rb") as f:
+        assert f.read() == FASTA
+
+
+def test_plain_output_keeps_the_content(serve, tmp_path):
+    output = tmp_path / "db.fasta"
+    cached_download.download(serve(FileHandler) + "/plain.fasta", output, cache_dir=tmp_path / "cache")
+    assert output.read_bytes() == FASTA
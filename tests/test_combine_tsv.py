@@ -0,0 +1,87 @@
+import json
+
+import pandas as pd
+import pytest
+
+import combine_tsv
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def tables(tmp_path):
+    directory = tmp_path / "tables"
+    directory.mkdir()
+    (directory / "a.tsv").write_text("name\tcount\nfoo\t1\nbar\t2\n")
+    (directory / "b.tsv").write_text("name\tdoi\nbaz\t10.1/x\n")
+    return directory
+
+
+def read_output(output):
+    if output.suffix == ".parquet":
+        return pd.read_parquet(output)
+    return pd.read_csv(output, sep="\t", dtype=str)
+
+
+@pytest.mark.parametrize("name", ["combined.tsv", "combined.parquet"])
+def test_streaming_combine_unifies_columns_and_keeps_values_as_text(tables, tmp_path, name):
+    output = tmp_path / name
+    assert combine_tsv.combine_tsv_streaming(tables, output, include_source=True, workers=2, chunksize=1)
+    df = read_output(output)
+    assert list(df.columns) == ["Source File", "name", "count", "doi"]
+    assert df["Source File"].tolist() == ["a", "a", "b"]
+    assert df["count"].tolist()[:2] == ["1", "2"]
+    assert df["doi"].tolist()[2] == "10.1/x"
+
+
+def incremental(tables, output):
+    return combine_tsv.combine_tsv_incremental(tables, output, include_source=True, workers=2)
+
+
+def test_incremental_unchanged_modified_and_deleted_files(tables, tmp_path):
+    output = tmp_path / "combined.tsv"
+    cache = tmp_path / "combined.tsv.cache"
+    assert incremental(tables, output)
+    assert read_output(output)["name"].tolist() == ["foo", "bar", "baz"]
+
+    # Nothing changed: the output and the cache are left alone
+    written = output.stat().st_mtime_ns
+    cached = (cache / "a.parquet").stat().st_mtime_ns
+    assert incremental(tables, output)
+    assert output.stat().st_mtime_ns == written
+
+    # Only the modified file is read again
+    (tables / "b.tsv").write_text("name\tdoi\nbaz\t10.1/y\nqux\t10.2/z\n")
+    assert incremental(tables, output)
+    assert read_output(output)["name"].tolist() == ["foo", "bar", "baz", "qux"]
+    assert (cache / "a.parquet").stat().st_mtime_ns == cached
+
+    # A deleted file loses its rows and its cached copy
+    (tables / "a.tsv").unlink()
+    assert incremental(tables, output)
+    assert read_output(output)["name"].tolist() == ["baz", "qux"]
+    assert not (cache / "a.parquet").exists()
+    manifest = json.loads((tmp_path / "combined.tsv.manifest.json").read_text())
+    assert [key.rsplit("/", 1)[-1] for key in manifest["files"]] == ["b.tsv"]
+
+
+def test_incremental_records_files_that_could_not_be_read(tables, tmp_path, caplog):
+    output = tmp_path / "combined.tsv"
+    (tables / "c.tsv").write_text("")
+    assert incremental(tables, output)
+    assert read_output(output)["name"].tolist() == ["foo", "bar", "baz"]
+    manifest = json.loads((tmp_path / "combined.tsv.manifest.json").read_text())
+    failed = [key for key, entry in manifest["files"].items() if "error" in entry]
+    assert [key.rsplit("/", 1)[-1] for key in failed] == ["c.tsv"]
+
+    # The unreadable file is not a change on the next run, but it is still reported
+    written = output.stat().st_mtime_ns
+    caplog.clear()
+    assert incremental(tables, output)
+    assert output.stat().st_mtime_ns == written
+    assert "Skipping c.tsv" in caplog.text
+
+    # Once fixed, its rows are added
+    (tables / "c.tsv").write_text("name\nquux\n")
+    assert incremental(tables, output)
+    assert read_output(output)["name"].tolist() == ["foo", "bar", "baz", "quux"]
@@ -0,0 +1,105 @@
+import json
+import sys
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import fetch_biotools
+
+
+def make_handler(tools_by_query, failing_pages=(), failing_status=400):
+    class BiotoolsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            tools = tools_by_query[query["q"][0]]
+            page, page_size = int(query["page"][0]), int(query["page_size"][0])
+            if page in failing_pages:
+                self.send_response(failing_status)
+                self.end_headers()
+                if failing_status == 200:
+                    self.wfile.write(b"<html>maintenance</html>")
+                return
+            if (page - 1) * page_size >= len(tools):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = json.dumps({"count": len(tools), "list": tools[(page - 1) * page_size:page * page_size]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return BiotoolsHandler
+
+
+TOOLS = {"proteomics": [{"name": f"proteomics tool {i}"} for i in range(5)],
+         "genomics": [{"name": f"genomics tool {i}"} for i in range(5)]}
+
+
+def names(tools):
+    return [tool["Name"] for tool in tools]
+
+
+def test_checkpoints_are_kept_apart_by_query_and_page_size(serve, tmp_path):
+    url = serve(make_handler(TOOLS)) + "/api/tool/"
+    checkpoints = tmp_path / "pages"
+    first = fetch_biotools.fetch_biotools("proteomics", url=url, page_size=2, checkpoint_dir=checkpoints, backoff=0)
+    second = fetch_biotools.fetch_biotools("genomics", url=url, page_size=2, checkpoint_dir=checkpoints, backoff=0)
+    third = fetch_biotools.fetch_biotools("proteomics", url=url, page_size=3, checkpoint_dir=checkpoints, backoff=0)
+    assert names(first) == names(third) == [f"proteomics tool {i}" for i in range(5)]
+    assert names(second) == [f"genomics tool {i}" for i in range(5)]
+    assert len(list(checkpoints.glob("page_*.json"))) == 3 + 3 + 2
+
+
+def test_failed_pages_are_not_returned_as_complete(serve, tmp_path):
+    url = serve(make_handler(TOOLS, failing_pages={2})) + "/api/tool/"
+    assert fetch_biotools.fetch_biotools("proteomics", url=url, page_size=2, retries=0) is None
+    partial = fetch_biotools.fetch_biotools("proteomics", url=url, page_size=2, retries=0, allow_partial=True)
+    assert names(partial) == ["proteomics tool 0", "proteomics tool 1", "proteomics tool 4"]
+
+
+def test_main_exits_non_zero_without_writing(serve, tmp_path, monkeypatch):
+    url = serve(make_handler(TOOLS, failing_pages={3})) + "/api/tool/"
+    output = tmp_path / "tools.json"
+    monkeypatch.setattr(sys, "argv", ["fetch_biotools.py", "proteomics", str(output), "--url", url,
+                                      "--page-size", "2", "--retries", "0"])
+    with pytest.raises(SystemExit) as exit_info:
+        fetch_biotools.main()
+    assert exit_info.value.code == 1
+    assert not output.exists()
+
+    monkeypatch.setattr(sys, "argv", sys.argv + ["--allow-partial"])
+    fetch_biotools.main()
+    assert len(json.loads(output.read_text())) == 4
+
+
+def test_missing_page_within_the_count_is_not_checkpointed(serve, tmp_path):
+    failing = {2}
+    url = serve(make_handler(TOOLS, failing_pages=failing, failing_status=404)) + "/api/tool/"
+    checkpoints = tmp_path / "pages"
+    assert fetch_biotools.fetch_biotools("proteomics", url=url, page_size=2, checkpoint_dir=checkpoints,
+                                         retries=0) is None
+    assert len(list(checkpoints.glob("page_*.json"))) == 2
+
+    # The page is back: the resumed run fetches it instead of keeping an empty page
+    failing.clear()
+    tools = fetch_biotools.fetch_biotools("proteomics", url=url, page_size=2, checkpoint_dir=checkpoints, retries=0)
+    assert names(tools) == [f"proteomics tool {i}" for i in range(5)]
+
+
+def test_page_past_the_count_is_the_end(serve):
+    url = serve(make_handler(TOOLS)) + "/api/tool/"
+    session = fetch_biotools.make_session(1)
+    assert fetch_biotools.fetch_page(session, url, {"q": "proteomics", "page_size": 2}, 4, retries=0,
+                                     last_page=3) == {"count": 0, "list": []}
+
+
+@pytest.mark.parametrize("page", [1, 2])
+def test_pages_that_are_not_json_fail_the_fetch(serve, page):
+    url = serve(make_handler(TOOLS, failing_pages={page}, failing_status=200)) + "/api/tool/"
+    assert fetch_biotools.fetch_biotools("proteomics", url=url, page_size=2, retries=0) is None
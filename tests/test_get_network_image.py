@@ -0,0 +1,64 @@
+import json
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+import get_network_image
+
+PNG = b"\x89PNG\r\n\x1a\nimage"
+
+
+class StringHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        if body["identifiers"] == ["MISSING"]:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.end_headers()
+        self.wfile.write(PNG + body["identifiers"][0].encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def string_api(serve, monkeypatch):
+    url = serve(StringHandler) + "/api/image/network"
+    monkeypatch.setattr(get_network_image, "base_url", url)
+    return url
+
+
+def read_manifest(output_dir):
+    with open(output_dir / get_network_image.manifest_name) as fh:
+        return json.load(fh)
+
+
+def test_manifest_keeps_genes_of_earlier_runs(tmp_path, string_api):
+    get_network_image.fetch_networks(["TP53", "EGFR"], str(tmp_path), requests_per_second=100)
+    get_network_image.fetch_networks(["BRCA1", "MISSING"], str(tmp_path), requests_per_second=100)
+
+    manifest = read_manifest(tmp_path)
+    assert set(manifest) == {"TP53", "EGFR", "BRCA1", "MISSING"}
+    assert manifest["TP53"]["status"] == "saved"
+    assert manifest["MISSING"]["status"] == "failed"
+    assert (tmp_path / "TP53_network.png").read_bytes() == PNG + b"TP53"
+    assert not list(tmp_path.glob("*.tmp"))
+
+    # The genes of the first run are still skipped after the second one
+    manifest = get_network_image.fetch_networks(["TP53"], str(tmp_path), requests_per_second=100)
+    assert manifest["TP53"]["status"] == "skipped"
+
+
+def test_api_path_needs_no_numerical_packages():
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    other = Path(get_network_image.__file__).parent
+    code = "import sys, get_network_image; print(sorted({'numpy', 'pandas', 'scipy'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=other, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
@@ -0,0 +1,69 @@
+import json
+from http.server import BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+
+import GO_enrichment
+
+
+class ReleaseHandler(BaseHTTPRequestHandler):
+    release = {"gprofiler_version": "e111_eg58_p18"}
+
+    def do_GET(self):
+        if self.path != "/gprofiler/api/util/current_version" or self.release is None:
+            self.send_response(503)
+            self.end_headers()
+            return
+        data = json.dumps(self.release).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gprofiler(serve, monkeypatch):
+    ReleaseHandler.release = {"gprofiler_version": "e111_eg58_p18"}
+    calls = []
+
+    def run_gprofiler(genes, organism, sources, threshold, base_url):
+        calls.append(list(genes))
+        return pd.DataFrame({"native": ["GO:0006412"], "p_value": [0.01]})
+
+    monkeypatch.setattr(GO_enrichment, "run_gprofiler", run_gprofiler)
+    return serve(ReleaseHandler) + "/gprofiler", calls
+
+
+def enrich(url, cache_dir):
+    return GO_enrichment.enrich_gene_lists({"list": ["A", "B"]}, cache_dir=str(cache_dir), base_url=url)
+
+
+def test_online_results_are_cached_per_release(gprofiler, tmp_path):
+    url, calls = gprofiler
+    enrich(url, tmp_path)
+    enrich(url, tmp_path)
+    assert len(calls) == 1
+
+    ReleaseHandler.release = {"gprofiler_version": "e112_eg59_p19"}
+    result = enrich(url, tmp_path)
+    assert len(calls) == 2
+    assert list(result["list_id"]) == ["list"]
+
+
+def test_online_results_are_not_cached_without_a_release(gprofiler, tmp_path):
+    url, calls = gprofiler
+    ReleaseHandler.release = None
+    enrich(url, tmp_path)
+    enrich(url, tmp_path)
+    assert len(calls) == 2
+    assert not list(tmp_path.glob("*.pkl"))
+
+
+def test_archive_urls_need_no_release():
+    url = "https://biit.cs.ut.ee/gprofiler_archive3/e108_eg55_p17"
+    assert GO_enrichment.online_annotation_version(url) == url
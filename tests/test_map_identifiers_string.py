@@ -0,0 +1,97 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+import map_identifiers_string
+
+KNOWN = {"P1": "ENSP001", "P2": "ENSP002", "P3": "ENSP003", "P4": "ENSP004"}
+
+
+class StringHandler(BaseHTTPRequestHandler):
+    requests = []
+    # Status codes answered before the real answer, one per request
+    errors = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        identifiers = form["identifiers"][0].split("\r\n")
+        with self.lock:
+            self.requests.append((self.path, form["species"][0], identifiers))
+            status = self.errors.pop(0) if self.errors else 200
+        if status != 200:
+            self.send_error(status)
+            return
+        body = "".join(f"{query}\t{i}\t{form['species'][0]}.{KNOWN[query]}\tP\n"
+                       for i, query in enumerate(identifiers) if query in KNOWN).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def string_api(serve, monkeypatch):
+    StringHandler.requests = []
+    StringHandler.errors = []
+    base = serve(StringHandler)
+    monkeypatch.setattr(map_identifiers_string, "string_api_url", lambda version: f"{base}/v{version}")
+    monkeypatch.setattr(map_identifiers_string.time, "sleep", lambda seconds: None)
+    return StringHandler
+
+
+def resolve(identifiers, tmp_path, **kwargs):
+    options = dict(batch_size=2, workers=2, requests_per_second=1000, cache_path=str(tmp_path / "cache.sqlite"))
+    options.update(kwargs)
+    return map_identifiers_string.resolve_protein_identifiers(identifiers, **options)
+
+
+def test_identifiers_are_resolved_in_batches(string_api, tmp_path):
+    mapping, unresolved = resolve(["P1", "P2", "NOPE", "P3", "P1", "P4"], tmp_path)
+    assert mapping == {"P1": "9606.ENSP001", "P2": "9606.ENSP002", "P3": "9606.ENSP003", "P4": "9606.ENSP004"}
+    assert unresolved == ["NOPE"]
+    # Duplicates are asked once, at most batch_size identifiers per request
+    batches = sorted(identifiers for _, _, identifiers in string_api.requests)
+    assert batches == [["NOPE", "P3"], ["P1", "P2"], ["P4"]]
+    assert {path for path, _, _ in string_api.requests} == {"/v11.5/tsv-no-header/get_string_ids"}
+
+
+def test_cache_is_kept_per_version_and_species(string_api, tmp_path):
+    resolve(["P1", "NOPE"], tmp_path)
+    string_api.requests.clear()
+
+    # Resolved and unresolved identifiers both come from the cache
+    assert resolve(["P1", "NOPE"], tmp_path) == ({"P1": "9606.ENSP001"}, ["NOPE"])
+    assert string_api.requests == []
+
+    # Only what is new is asked
+    resolve(["P1", "P2"], tmp_path)
+    assert [identifiers for _, _, identifiers in string_api.requests] == [["P2"]]
+
+    string_api.requests.clear()
+    assert resolve(["P1"], tmp_path, species=10090)[0] == {"P1": "10090.ENSP001"}
+    resolve(["P1"], tmp_path, version="12.0")
+    assert [(path.split("/")[1], species) for path, species, _ in string_api.requests] == [("v11.5", "10090"),
+                                                                                            ("v12.0", "9606")]
+
+
+def test_server_errors_are_retried(string_api, tmp_path):
+    string_api.errors = [503, 429]
+    assert resolve(["P1"], tmp_path) == ({"P1": "9606.ENSP001"}, [])
+    assert len(string_api.requests) == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 413])
+def test_client_errors_fail_at_once(string_api, tmp_path, status):
+    string_api.errors = [status]
+    assert resolve(["P1", "P2"], tmp_path) == ({}, ["P1", "P2"])
+    assert len(string_api.requests) == 1
+
+    # A failed batch is not cached as unresolved, the next run asks again
+    assert resolve(["P1", "P2"], tmp_path)[1] == []
+    assert len(string_api.requests) == 2
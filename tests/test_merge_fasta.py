@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import merge_fasta
+
+TARGET = (b">sp|P1|ONE_HUMAN First\nMKVL\nAAGG\n"
+          b">sp|P2|TWO_HUMAN Second\nMSSP\n"
+          b">sp|P3|THREE_HUMAN Same sequence as P1\nMKVLAAGG\n"
+          b">sp|P4|EMPTY_HUMAN No sequence\n"
+          b">sp|P5|EMPTY2_HUMAN No sequence either\n")
+CONTAMINANTS = (b">sp|P2|TWO_HUMAN Also in the target\nMSSP\n"
+                b">sp|C1|KERATIN Keratin\nMQQQ\n")
+
+
+@pytest.fixture
+def fastas(tmp_path):
+    target = tmp_path / "target.fasta"
+    contaminants = tmp_path / "crap.fasta"
+    target.write_bytes(TARGET)
+    contaminants.write_bytes(CONTAMINANTS)
+    return target, contaminants, tmp_path / "merged.fasta"
+
+
+def headers(path):
+    return [line for line in path.read_bytes().split(b"\n") if line.startswith(b">")]
+
+
+def test_duplicate_accessions_and_sequences_are_dropped(fastas):
+    target, contaminants, output = fastas
+    counts = merge_fasta.merge_fasta([target], [contaminants], output)
+    assert [h.split()[0] for h in headers(output)] == [
+        b">sp|P1|ONE_HUMAN", b">sp|P2|TWO_HUMAN", b">sp|P4|EMPTY_HUMAN", b">sp|P5|EMPTY2_HUMAN", b">sp|C1|KERATIN"]
+    assert counts == {"written": 5, "duplicate accession": 1, "duplicate sequence": 1, "decoys": 0}
+    # Kept records are copied as they are, line wrapping included
+    assert output.read_bytes().startswith(b">sp|P1|ONE_HUMAN First\nMKVL\nAAGG\n")
+
+
+def test_duplicates_can_be_renamed_and_contaminants_prefixed(fastas):
+    target, contaminants, output = fastas
+    counts = merge_fasta.merge_fasta([target], [contaminants], output, contaminant_prefix="CONTAM_",
+                                     duplicates="rename")
+    assert [h.split()[0] for h in headers(output)] == [
+        b">sp|P1|ONE_HUMAN", b">sp|P2|TWO_HUMAN", b">sp|P3_dup1|THREE_HUMAN", b">sp|P4|EMPTY_HUMAN",
+        b">sp|P5|EMPTY2_HUMAN", b">CONTAM_sp|P2_dup1|TWO_HUMAN", b">CONTAM_sp|C1|KERATIN"]
+    assert counts["written"] == 7
+
+
+def test_decoys_go_after_the_targets(fastas):
+    target, contaminants, output = fastas
+    counts = merge_fasta.merge_fasta([target], [contaminants], output, decoy="reverse")
+    assert counts["decoys"] == counts["written"] == 5
+    records = output.read_bytes().split(b">")[1:]
+    assert records[5] == b"rev_sp|P1|ONE_HUMAN First\nGGAALVKM\n"
+    assert all(record.startswith(b"rev_") for record in records[5:])
+
+
+def test_shuffled_decoys_depend_only_on_the_seed(fastas):
+    target, contaminants, output = fastas
+    merge_fasta.merge_fasta([target], [], output, decoy="shuffle", seed=1)
+    first = output.read_bytes()
+    merge_fasta.merge_fasta([target], [], output, decoy="shuffle", seed=1)
+    assert output.read_bytes() == first
+
+
+def test_index_is_reused_until_the_fasta_changes(fastas, monkeypatch):
+    target, _, _ = fastas
+    index = merge_fasta.load_index(target)
+    assert [entry[0] for entry in index] == ["P1", "P2", "P3", "P4", "P5"]
+    assert index[0][3] == index[2][3]
+
+    def fail(path):
+        raise AssertionError("index rebuilt")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(merge_fasta, "build_index", fail)
+        assert merge_fasta.load_index(target) == index
+
+    target.write_bytes(TARGET + b">sp|P6|SIX_HUMAN\nMW\n")
+    os.utime(target, ns=(0, 0))
+    assert [entry[0] for entry in merge_fasta.load_index(target)][-1] == "P6"
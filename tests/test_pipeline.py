@@ -0,0 +1,27 @@
+import pandas as pd
+
+import pipeline
+
+
+def test_combine_tables_reads_only_the_declared_tables(tmp_path):
+    tables = tmp_path / "tables"
+    tables.mkdir()
+    pd.DataFrame({"Name": ["a"], "Score": [1]}).to_csv(tables / "first.tsv", sep="\t", index=False)
+    pd.DataFrame({"Name": ["b"], "Other": ["x"]}).to_csv(tables / "second.tsv", sep="\t", index=False)
+    # Left over from a query that was removed from the config
+    pd.DataFrame({"Name": ["stale"]}).to_csv(tables / "old_query.tsv", sep="\t", index=False)
+
+    output = tmp_path / "combined.tsv"
+    pipeline.combine_tables([str(tables / "second.tsv"), str(tables / "first.tsv")], str(output))
+
+    combined = pd.read_csv(output, sep="\t", dtype=str, keep_default_na=False)
+    assert list(combined["Name"]) == ["b", "a"]
+    assert list(combined["Source File"]) == ["second", "first"]
+    assert list(combined.columns) == ["Source File", "Name", "Other", "Score"]
+
+
+def test_biotools_fetch_always_runs(tmp_path):
+    steps = pipeline.build_steps({"biotools_queries": ["mass spectrometry"]}, tmp_path)
+    by_name = {step.name: step for step in steps}
+    assert by_name["fetch_biotools:mass_spectrometry"].volatile
+    assert not by_name["json2tsv:mass_spectrometry"].volatile
@@ -0,0 +1,138 @@
+import ast
+import sys
+from pathlib import Path
+
+import pytest
+
+import pipeline
+import pipeline_runner
+from pipeline_runner import PipelineError, Step
+
+
+def upper(source, output, suffix=""):
+    Path(output).write_text(Path(source).read_text().upper() + suffix)
+
+
+def count(source, output, fail=False):
+    if fail:
+        raise ValueError("broken step")
+    Path(output).write_text(str(len(Path(source).read_text())))
+
+
+def make_steps(tmp_path, suffix="", fail=False, volatile=False):
+    return [
+        Step("upper", upper, inputs={"source": str(tmp_path / "raw.txt")}, outputs={"output": str(tmp_path / "up.txt")},
+             params={"suffix": suffix}, volatile=volatile),
+        Step("count", count, inputs={"source": str(tmp_path / "up.txt")},
+             outputs={"output": str(tmp_path / "count.txt")}, params={"fail": fail}),
+        Step("other", upper, inputs={"source": str(tmp_path / "other.txt")},
+             outputs={"output": str(tmp_path / "other_up.txt")}),
+    ]
+
+
+def statuses(record):
+    return {name: entry["status"] for name, entry in record["steps"].items()}
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    (tmp_path / "raw.txt").write_text("abc")
+    (tmp_path / "other.txt").write_text("xyz")
+    return tmp_path
+
+
+def run(workdir, **kwargs):
+    options = {key: kwargs.pop(key) for key in ("targets", "force", "dry_run") if key in kwargs}
+    return pipeline_runner.run(make_steps(workdir, **kwargs), jobs=2, workdir=workdir, **options)
+
+
+def test_second_run_skips_everything(workdir):
+    assert statuses(run(workdir)) == {"upper": "ran", "count": "ran", "other": "ran"}
+    assert (workdir / "count.txt").read_text() == "3"
+    record = run(workdir)
+    assert statuses(record) == {"upper": "skipped", "count": "skipped", "other": "skipped"}
+    assert record["status"] == "ok"
+    assert (workdir / ".pipeline" / "state.json").exists()
+    assert len(list((workdir / ".pipeline" / "runs").glob("*.json"))) == 2
+
+
+def test_changed_input_reruns_only_downstream_steps(workdir):
+    run(workdir)
+    (workdir / "raw.txt").write_text("abcdef")
+    assert statuses(run(workdir)) == {"upper": "ran", "count": "ran", "other": "skipped"}
+    assert (workdir / "count.txt").read_text() == "6"
+
+
+def test_changed_parameter_reruns_the_step_and_what_follows(workdir):
+    run(workdir)
+    assert statuses(run(workdir, suffix="!")) == {"upper": "ran", "count": "ran", "other": "skipped"}
+    assert statuses(run(workdir, suffix="!")) == {"upper": "skipped", "count": "skipped", "other": "skipped"}
+
+
+def test_changed_or_missing_output_reruns_the_step(workdir):
+    run(workdir)
+    (workdir / "count.txt").unlink()
+    assert statuses(run(workdir)) == {"upper": "skipped", "count": "ran", "other": "skipped"}
+    (workdir / "other_up.txt").write_text("edited by hand")
+    assert statuses(run(workdir))["other"] == "ran"
+
+
+def test_failed_step_blocks_its_dependents(workdir):
+    (workdir / "raw.txt").write_text("abc")
+    steps = make_steps(workdir, fail=True)
+    steps.append(Step("report", upper, inputs={"source": str(workdir / "count.txt")},
+                      outputs={"output": str(workdir / "report.txt")}))
+    record = pipeline_runner.run(steps, workdir=workdir)
+    assert statuses(record) == {"upper": "ran", "count": "failed", "report": "blocked", "other": "ran"}
+    assert record["status"] == "failed"
+    assert "broken step" in record["steps"]["count"]["error"]
+    # The steps that ran are not run again once the failure is fixed
+    assert statuses(run(workdir)) == {"upper": "skipped", "count": "ran", "other": "skipped"}
+
+
+def test_volatile_step_always_runs_but_unchanged_output_skips_downstream(workdir):
+    run(workdir, volatile=True)
+    assert statuses(run(workdir, volatile=True)) == {"upper": "ran", "count": "skipped", "other": "skipped"}
+
+
+def test_force_targets_and_dry_run(workdir):
+    run(workdir)
+    assert statuses(run(workdir, force=["count"])) == {"upper": "skipped", "count": "ran", "other": "skipped"}
+    assert statuses(run(workdir, targets=["upper"])) == {"upper": "skipped"}
+    (workdir / "raw.txt").write_text("changed")
+    assert statuses(run(workdir, dry_run=True)) == {"upper": "would run", "count": "would run", "other": "skipped"}
+    assert (workdir / "count.txt").read_text() == "3"
+
+
+def test_invalid_dags_are_refused(tmp_path):
+    a = Step("a", upper, inputs={"source": "y"}, outputs={"output": "x"})
+    b = Step("b", upper, inputs={"source": "x"}, outputs={"output": "y"})
+    with pytest.raises(PipelineError, match="cycle"):
+        pipeline_runner.build_dag([a, b])
+    with pytest.raises(PipelineError, match="written by both"):
+        pipeline_runner.build_dag([a, Step("c", upper, inputs={"source": "z"}, outputs={"output": "x"})])
+    with pytest.raises(PipelineError, match="Unknown steps"):
+        pipeline_runner.run(make_steps(tmp_path), targets=["nope"], workdir=tmp_path)
+
+
+# Local modules a script imports (the scripts import each other by module name)
+def local_imports(module, scripts_dir):
+    path = next(scripts_dir.rglob(f"{module}.py"))
+    names = set()
+    for node in ast.walk(ast.parse(path.read_text())):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module)
+    return {name for name in names if any(scripts_dir.rglob(f"{name}.py"))}
+
+
+def test_steps_list_every_module_their_code_imports(tmp_path):
+    scripts_dir = Path(pipeline.__file__).parent
+    config = {"biotools_queries": ["proteomics"], "proteins": "p.txt", "gene_lists": "g.tsv", "abundance": "a.tsv",
+              "gene_sets": "s.gmt", "dedup": True}
+    for step in pipeline.build_steps(config, tmp_path):
+        listed = set(step.modules)
+        for module in step.modules:
+            missing = local_imports(module, scripts_dir) - listed
+            assert not missing, f"{step.name}: {module} imports {missing}, which are not in its modules"
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import protein_sets
+
+PROTEINS = ["sp|P69905|HBA_HUMAN", "P68871;P02042", "Q9Y6K9-2", "P12345"]
+GMT = ("HEMOGLOBIN\thttp://example.org\tHBA1\tHBB\tHBD\n"
+       "MIXED\t-\tQ9Y6K9\tP12345\tNOT_A_GENE\n"
+       "EMPTY\t-\tNOT_A_GENE\n")
+MAPPING = "From\tTo\nHBA1\tP69905\nHBB\tP68871\nHBD\tP02042\n"
+
+
+@pytest.fixture
+def files(tmp_path):
+    gmt, mapping = tmp_path / "sets.gmt", tmp_path / "mapping.tsv"
+    gmt.write_text(GMT)
+    mapping.write_text(MAPPING)
+    return gmt, mapping
+
+
+def dense(membership):
+    return membership.toarray() if hasattr(membership, "toarray") else membership
+
+
+def test_gmt_members_are_mapped_to_matrix_rows_through_the_id_table(files, tmp_path):
+    gmt, mapping = files
+    membership, names, stats = protein_sets.load_protein_sets(gmt, PROTEINS, mapping, cache_dir=tmp_path / "cache")
+    assert names == ["HEMOGLOBIN", "MIXED", "EMPTY"]
+    assert membership.shape == (3, 4)
+    # HBB and HBD both map into the protein group, which counts once
+    assert dense(membership).tolist() == [[1, 1, 0, 0], [0, 0, 1, 1], [0, 0, 0, 0]]
+    assert stats.set_index("Term").loc["HEMOGLOBIN", ["Matched", "Direct", "Via mapping", "Proteins"]].tolist() == [3, 0, 3, 2]
+    assert stats.set_index("Term").loc["MIXED", ["Matched", "Direct", "Unmatched"]].tolist() == [2, 2, 1]
+    assert protein_sets.membership_to_sets(membership, names, PROTEINS)["MIXED"] == ["Q9Y6K9-2", "P12345"]
+
+
+def test_without_the_id_table_only_direct_matches_count(files, tmp_path):
+    gmt, _ = files
+    membership, _, stats = protein_sets.load_protein_sets(gmt, PROTEINS, use_cache=False)
+    assert dense(membership).sum(axis=1).tolist() == [0, 2, 0]
+    assert stats["Via mapping"].sum() == 0
+
+
+def test_cache_is_reused_until_an_input_changes(files, tmp_path, monkeypatch):
+    gmt, mapping = files
+    cache_dir = tmp_path / "cache"
+    first = protein_sets.load_protein_sets(gmt, PROTEINS, mapping, cache_dir=cache_dir)
+    assert len(list(cache_dir.glob("membership_*.npz"))) == 1
+
+    def fail(*args):
+        raise AssertionError("membership built again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(protein_sets, "build_membership", fail)
+        membership, names, stats = protein_sets.load_protein_sets(gmt, PROTEINS, mapping, cache_dir=cache_dir)
+    assert np.array_equal(dense(membership), dense(first[0]))
+    assert names == first[1]
+    assert stats["Matched"].tolist() == first[2]["Matched"].tolist()
+
+    # Another matrix index or GMT file is another cache entry
+    protein_sets.load_protein_sets(gmt, PROTEINS[::-1], mapping, cache_dir=cache_dir)
+    gmt.write_text(GMT + "MORE\t-\tP12345\n")
+    assert len(protein_sets.load_protein_sets(gmt, PROTEINS, mapping, cache_dir=cache_dir)[1]) == 4
+    assert len(list(cache_dir.glob("membership_*.npz"))) == 3
+
+
+def test_dense_fallback_without_scipy(files, tmp_path, monkeypatch):
+    gmt, mapping = files
+    cache_dir = tmp_path / "cache"
+    expected = dense(protein_sets.load_protein_sets(gmt, PROTEINS, mapping, cache_dir=cache_dir)[0])
+    monkeypatch.setattr(protein_sets, "sparse", None)
+    # Built without scipy, and read from the cache written with it
+    built = protein_sets.load_protein_sets(gmt, PROTEINS, mapping, use_cache=False)[0]
+    cached, names, _ = protein_sets.load_protein_sets(gmt, PROTEINS, mapping, cache_dir=cache_dir)
+    assert isinstance(built, np.ndarray) and isinstance(cached, np.ndarray)
+    assert np.array_equal(built, expected) and np.array_equal(cached, expected)
+    assert protein_sets.membership_to_sets(cached, names, PROTEINS)["HEMOGLOBIN"] == PROTEINS[:2]
@@ -0,0 +1,98 @@
+import json
+
+import pandas as pd
+import pytest
+
+import fetch_biotools
+import json2tsv
+import pubmed_cache
+
+TITLE = 'Proteomics, "reproducible" pipelines:\ta\nbenchmark'
+ABSTRACT = 'We compare tools, workflows and "standards";\tresults\nfollow, with commas.'
+
+RAW_TOOL = {
+    "name": "Tool, with comma",
+    "homepage": "https://example.org",
+    "description": "Line one\nline two",
+    "topic": [{"term": "Proteomics", "uri": "http://edamontology.org/topic_0121"}],
+    "publication": [
+        {"doi": "10.1000/first", "metadata": {"title": TITLE, "abstract": ABSTRACT}},
+        {"doi": "10.1000/second", "metadata": {"title": "Plain title", "abstract": ""}},
+    ],
+}
+
+EXPECTED = [
+    {"DOI": "10.1000/first", "Title": TITLE.replace("\n", " "), "Abstract": ABSTRACT.replace("\n", " ")},
+    {"DOI": "10.1000/second", "Title": "Plain title", "Abstract": ""},
+]
+
+
+@pytest.fixture
+def fetched_file(tmp_path):
+    path = tmp_path / "tools.json"
+    fetch_biotools.save_to_file([fetch_biotools.filter_tool(RAW_TOOL)], path)
+    return path
+
+
+def read_publications(tsv_file):
+    table = pd.read_csv(tsv_file, sep="\t", dtype=str, keep_default_na=False)
+    assert list(table["Name"]) == ["Tool, with comma"] * 2
+    return table[["DOI", "Title", "Abstract"]].to_dict("records")
+
+
+def test_structured_publications_survive_the_streaming_table(fetched_file, tmp_path):
+    json2tsv.json_to_tsv_streaming(fetched_file, tmp_path / "tools.tsv")
+    assert read_publications(tmp_path / "tools.tsv") == EXPECTED
+
+
+def test_structured_publications_survive_the_pandas_table(fetched_file, tmp_path):
+    json2tsv.json_to_dataframe(fetched_file, tmp_path / "tools.tsv")
+    assert read_publications(tmp_path / "tools.tsv") == EXPECTED
+
+
+def test_structured_publications_survive_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    fetched = tmp_path / "tools.parquet"
+    fetch_biotools.save_to_parquet([fetch_biotools.filter_tool(RAW_TOOL)], fetched)
+    json2tsv.json_to_parquet(fetched, tmp_path / "table.parquet")
+    table = pd.read_parquet(tmp_path / "table.parquet")
+    assert table[["DOI", "Title", "Abstract"]].to_dict("records") == EXPECTED
+
+
+def test_legacy_publication_strings_still_parse():
+    assert json2tsv.extract_publications("10.1000/old, Old title, An abstract, with a comma") == [
+        {"DOI": "10.1000/old", "Title": "Old title", "Abstract": "An abstract, with a comma"}]
+    assert json2tsv.extract_publications("Only a title, and an abstract") == [
+        {"DOI": "", "Title": "Only a title", "Abstract": "and an abstract"}]
+    assert json2tsv.extract_publications("") == []
+
+
+def test_legacy_entries_make_rows(tmp_path):
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text(json.dumps([{"Name": "Old tool", "Topic": "Proteomics",
+                                   "Publications": "10.1000/old, Old title, An abstract"}]))
+    json2tsv.json_to_tsv_streaming(legacy, tmp_path / "legacy.tsv")
+    table = pd.read_csv(tmp_path / "legacy.tsv", sep="\t", dtype=str, keep_default_na=False)
+    assert table[["Name", "DOI", "Title", "Abstract"]].to_dict("records") == [
+        {"Name": "Old tool", "DOI": "10.1000/old", "Title": "Old title", "Abstract": "An abstract"}]
+
+
+def test_publication_dois_are_read_from_both_formats(fetched_file, tmp_path):
+    assert pubmed_cache.read_identifiers(fetched_file) == ["10.1000/first", "10.1000/second"]
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text(json.dumps([{"Name": "Old tool", "Publications": "10.1000/a, T, A; 10.1000/b, T, A"}]))
+    assert pubmed_cache.read_identifiers(legacy) == ["10.1000/a", "10.1000/b"]
+
+
+def test_list_valued_versions_give_the_same_table_from_json_and_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    tools = [fetch_biotools.filter_tool(dict(RAW_TOOL, version=["1.0", "2.0"])),
+             fetch_biotools.filter_tool(dict(RAW_TOOL, name="No version", version=None))]
+    fetch_biotools.save_to_file(tools, tmp_path / "tools.json")
+    fetch_biotools.save_to_parquet(tools, tmp_path / "tools.parquet")
+    json2tsv.json_to_tsv_streaming(tmp_path / "tools.json", tmp_path / "tools.tsv")
+    json2tsv.json_to_parquet(tmp_path / "tools.parquet", tmp_path / "table.parquet")
+
+    from_json = pd.read_csv(tmp_path / "tools.tsv", sep="\t", dtype=str, keep_default_na=False)
+    from_parquet = pd.read_parquet(tmp_path / "table.parquet").fillna("")
+    assert list(from_json["Version"]) == list(from_parquet["Version"]) == ["1.0, 2.0", "1.0, 2.0", "", ""]
@@ -0,0 +1,96 @@
+import json
+import sqlite3
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+
+import pubmed_cache
+
+ARTICLES = [
+    {"doi": "10.1000/a", "pmid": "111", "title": "Proteomics, tools and \"pipelines\"", "abstractText": "First.",
+     "pubYear": "2020", "source": "MED", "journalInfo": {"journal": {"title": "J Prot"}}},
+    {"doi": "10.1000/b", "pmid": "222", "title": "Second article", "abstractText": "Second.", "pubYear": "2021",
+     "source": "MED"},
+    {"doi": "10.1000/c", "pmid": "333", "title": "Third article", "abstractText": "Third.", "pubYear": "2022",
+     "source": "MED"},
+]
+
+
+class EuropePmcHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_POST(self):
+        if self.path != "/rest/searchPOST":
+            self.send_response(404)
+            self.end_headers()
+            return
+        params = {key: values[0] for key, values in
+                  parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode()).items()}
+        type(self).requests.append(params)
+        matches = [article for article in ARTICLES
+                   if f'DOI:"{article["doi"]}"' in params["query"] or f'EXT_ID:{article["pmid"]} ' in params["query"]]
+        # One result per page, so the cursor is followed
+        start = 0 if params["cursorMark"] == "*" else int(params["cursorMark"])
+        body = {"resultList": {"result": matches[start:start + 1]}}
+        if start + 1 < len(matches):
+            body["nextCursorMark"] = str(start + 1)
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def europepmc(serve):
+    EuropePmcHandler.requests = []
+    return serve(EuropePmcHandler) + "/rest/searchPOST"
+
+
+def test_default_url_is_the_post_endpoint():
+    assert pubmed_cache.EUROPEPMC_URL.endswith("/rest/searchPOST")
+
+
+def test_fetch_and_cache(europepmc, tmp_path):
+    cache = tmp_path / "cache.sqlite"
+    identifiers = ["https://doi.org/10.1000/A", "222", "10.1000/unknown"]
+    assert pubmed_cache.fetch_metadata(identifiers, cache, europepmc) == 3
+    assert len(EuropePmcHandler.requests) == 2
+
+    connection = pubmed_cache.open_cache(cache)
+    records = pubmed_cache.lookup_dois(connection, ["10.1000/a", "10.1000/b"])
+    connection.close()
+    assert records["10.1000/a"]["title"] == "Proteomics, tools and \"pipelines\""
+    assert records["10.1000/a"]["journal"] == "J Prot"
+    assert records["10.1000/b"]["pmid"] == "222"
+
+    # Everything was looked up, including the unknown DOI, so nothing is asked again
+    assert pubmed_cache.fetch_metadata(identifiers, cache, europepmc) == 0
+    assert len(EuropePmcHandler.requests) == 2
+
+
+def test_doi_and_pmid_stored_as_two_rows_are_merged(tmp_path):
+    connection = pubmed_cache.open_cache(tmp_path / "cache.sqlite")
+    record = {"doi": "10.1000/a", "pmid": "", "title": "Old title", "abstract": "", "journal": "", "year": "",
+              "source": ""}
+    pubmed_cache.store_records(connection, [record], [("doi", "10.1000/a")])
+    pubmed_cache.store_records(connection, [dict(record, doi="", pmid="111")], [("pmid", "111")])
+
+    merged = dict(record, pmid="111", title="Merged title")
+    pubmed_cache.store_records(connection, [merged, dict(merged, doi="10.1000/b", pmid="222")],
+                               [("doi", "10.1000/a"), ("doi", "10.1000/b")])
+
+    rows = connection.execute("SELECT doi, pmid, title FROM publications ORDER BY id").fetchall()
+    assert rows == [("10.1000/a", "111", "Merged title"), ("10.1000/b", "222", "Merged title")]
+    try:
+        hits = connection.execute("SELECT rowid FROM publications_fts WHERE publications_fts MATCH 'old'").fetchall()
+    except sqlite3.OperationalError:
+        pytest.skip("no FTS5 in this SQLite build")
+    finally:
+        connection.close()
+    assert hits == []
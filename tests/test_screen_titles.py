@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+import screen_titles
+
+
+def screen(titles, match="word"):
+    df = pd.DataFrame({"Title": titles})
+    exclude = screen_titles.compile_terms(screen_titles.EXCLUDE_TERMS, match)
+    proteomics = screen_titles.compile_terms(screen_titles.PROTEOMICS_TERMS, match)
+    focus = screen_titles.compile_terms(screen_titles.FOCUS_TERMS, match)
+    kept, dropped = screen_titles.screen_chunk(df, exclude, proteomics, focus)
+    return list(kept["Title"]), dict(zip(dropped["Title"], dropped["Reason"]))
+
+
+@pytest.mark.parametrize("title", ["A general proteomics workflow", "Generic protein pipeline tool",
+                                   "Next-generation proteomics pipeline"])
+def test_words_starting_with_an_excluded_term_are_kept(title):
+    kept, _ = screen([title])
+    assert kept == [title]
+
+
+@pytest.mark.parametrize("title", ["Gene-level protein workflow", "Genes and proteins: a pipeline",
+                                   "Genomics meets proteomics tools", "RNA and protein workflow",
+                                   "Single-cell proteomics pipeline"])
+def test_excluded_terms_and_their_plurals_are_dropped(title):
+    _, dropped = screen([title])
+    assert dropped[title].startswith("excluded term in title")
+
+
+def test_prefix_matching_is_still_available():
+    _, dropped = screen(["A general proteomics workflow"], match="prefix")
+    assert dropped["A general proteomics workflow"] == "excluded term in title: gene"
+
+
+def test_plural_focus_keywords_are_matched():
+    kept, _ = screen(["Proteomics tools for mass spectrometry", "Proteome workflows"])
+    assert kept == ["Proteomics tools for mass spectrometry", "Proteome workflows"]
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ssgsea_engine
+import ssgsea_permutations
+
+gp = pytest.importorskip("gseapy")
+
+
+def make_data(seed=0, n_genes=60, n_samples=4):
+    rng = np.random.default_rng(seed)
+    genes = [f"P{i:03d}" for i in range(n_genes)]
+    # Few distinct values, so most genes are tied with others
+    values = rng.integers(0, 6, size=(n_genes, n_samples)).astype(np.float64)
+    abundance_df = pd.DataFrame(values, index=genes, columns=[f"S{j}" for j in range(n_samples)])
+    gene_sets = {f"set{k}": list(rng.choice(genes, size=20, replace=False)) for k in range(5)}
+    return abundance_df, gene_sets
+
+
+def gseapy_scores(abundance_df, gene_sets):
+    result = gp.ssgsea(data=abundance_df, gene_sets=gene_sets, outdir=None, sample_norm_method="rank",
+                       min_size=15, max_size=500, permutation_num=0, no_plot=True, threads=1, verbose=False)
+    res = result.res2d
+    return res.pivot(index="Term", columns="Name", values="ES").astype(float)
+
+
+def engine_scores(abundance_df, gene_sets):
+    return ssgsea_engine.ssgsea_scores(abundance_df, gene_sets)
+
+
+def assert_same_scores(abundance_df, gene_sets):
+    expected = gseapy_scores(abundance_df, gene_sets)
+    scores = engine_scores(abundance_df, gene_sets).loc[expected.index, expected.columns]
+    np.testing.assert_allclose(scores.to_numpy(), expected.to_numpy(), rtol=1e-9, atol=1e-9)
+
+
+def test_ties_match_gseapy():
+    assert_same_scores(*make_data())
+
+
+def test_missing_values_match_gseapy(caplog):
+    abundance_df, gene_sets = make_data(seed=1)
+    abundance_df.iloc[[3, 10, 25], 1] = np.nan
+    abundance_df.iloc[7, :] = np.nan
+    abundance_df.iloc[0, 2] = np.nan
+    assert_same_scores(abundance_df, gene_sets)
+    assert "missing values" in caplog.text
+
+
+def test_permutations_score_like_engine():
+    abundance_df, gene_sets = make_data(seed=3)
+    abundance_df.iloc[2, 0] = np.nan
+    result = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations=10, seed=0)
+    scores = engine_scores(abundance_df, gene_sets)
+    es = result.pivot(index="Term", columns="Name", values="ES").loc[scores.index, scores.columns]
+    np.testing.assert_allclose(es.to_numpy(), scores.to_numpy())
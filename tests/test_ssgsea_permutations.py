@@ -0,0 +1,88 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ssgsea_permutations
+
+
+def null_data(seed=0, n_genes=200, n_samples=20, n_sets=20, set_size=20):
+    rng = np.random.default_rng(seed)
+    genes = [f"P{i:03d}" for i in range(n_genes)]
+    abundance_df = pd.DataFrame(rng.normal(size=(n_genes, n_samples)), index=genes,
+                                columns=[f"S{j}" for j in range(n_samples)])
+    gene_sets = {f"set{k}": list(rng.choice(genes, size=set_size, replace=False)) for k in range(n_sets)}
+    return abundance_df, gene_sets
+
+
+def test_results_do_not_depend_on_the_number_of_processes():
+    abundance_df, gene_sets = null_data(n_samples=5, n_sets=6)
+    options = dict(n_permutations=300, seed=3, batch_size=64, stop_exceedances=10)
+    serial = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_jobs=1, **options)
+    parallel = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_jobs=2, **options)
+    pd.testing.assert_frame_equal(serial, parallel)
+    # Early stopping did happen, so the comparison covers it
+    assert serial["Permutations"].min() < 300 == serial["Permutations"].max()
+
+
+def test_p_values_are_calibrated_on_null_data():
+    abundance_df, gene_sets = null_data()
+    result = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations=400, stop_exceedances=0)
+    p_values = result["NOM p-val"].to_numpy()
+    assert len(p_values) == 400 and not np.isnan(p_values).any()
+    for alpha in (0.05, 0.1, 0.25, 0.5):
+        assert abs(np.mean(p_values <= alpha) - alpha) < 0.04
+    assert (result["FDR q-val"] >= result["NOM p-val"] - 1e-12).all()
+
+
+def test_early_stopping_keeps_small_p_values_exact():
+    abundance_df, gene_sets = null_data(n_samples=4)
+    # A set of the 20 highest proteins of the first sample is strongly enriched there
+    gene_sets["planted"] = list(abundance_df["S0"].nlargest(20).index)
+    full = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations=500, stop_exceedances=0)
+    stopped = ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations=500)
+    planted = (full["Name"] == "S0") & (full["Term"] == "planted")
+    assert full.loc[planted, "NOM p-val"].item() < 0.01
+    pd.testing.assert_series_equal(full.loc[planted, "NOM p-val"], stopped.loc[planted, "NOM p-val"])
+    assert stopped["Permutations"].sum() < full["Permutations"].sum()
+
+
+@pytest.fixture
+def created_segments(monkeypatch):
+    names = []
+
+    class RecordingSharedMemory(shared_memory.SharedMemory):
+        def __init__(self, *args, create=False, **kwargs):
+            super().__init__(*args, create=create, **kwargs)
+            if create:
+                names.append(self.name)
+
+    monkeypatch.setattr(shared_memory, "SharedMemory", RecordingSharedMemory)
+    return names
+
+
+def assert_removed(names):
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_shared_memory_is_removed(created_segments, n_jobs):
+    abundance_df, gene_sets = null_data(n_samples=4, n_sets=3)
+    ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations=50, n_jobs=n_jobs)
+    assert_removed(created_segments)
+
+
+def test_shared_memory_is_removed_when_a_worker_fails(created_segments, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("worker failed")
+
+    monkeypatch.setattr(ssgsea_permutations, "sample_permutations", fail)
+    abundance_df, gene_sets = null_data(n_samples=4, n_sets=3)
+    with pytest.raises(RuntimeError, match="worker failed"):
+        ssgsea_permutations.ssgsea_permutations(abundance_df, gene_sets, n_permutations=50)
+    assert_removed(created_segments)
+    assert not ssgsea_permutations._worker
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+import get_network_image
+import network_images
+import string_network
+
+LINKS = """protein1 protein2 combined_score
+9606.P1 9606.P2 900
+9606.P2 9606.P1 900
+9606.P1 9606.P3 400
+9606.P3 9606.P1 400
+9606.P2 9606.P3 700
+9606.P3 9606.P2 700
+"""
+
+
+@pytest.fixture
+def links_file(tmp_path):
+    path = tmp_path / "9606.protein.links.v12.0.txt"
+    path.write_text(LINKS)
+    return path
+
+
+def test_top_partners(links_file):
+    network = string_network.load_network(links_file)
+    rows, unresolved = network.resolve(["P1", "9606.P3", "NOPE"])
+    assert unresolved == ["NOPE"]
+    sources, targets, scores = network.top_partner_edges([rows["P1"]], k=1)
+    assert [network.names[row] for row in targets] == ["P2"]
+    assert list(scores) == [900]
+
+
+def test_empty_network_resolves_nothing(tmp_path):
+    path = tmp_path / "empty.links.txt"
+    path.write_text("protein1 protein2 combined_score\n")
+    network = string_network.load_network(path)
+    assert network.resolve(["P1", "P2"]) == ({}, ["P1", "P2"])
+
+
+def test_image_paths_stay_in_the_directory(tmp_path):
+    assert network_images.image_path(str(tmp_path), "TP53") == os.path.join(str(tmp_path), "TP53_network.png")
+    odd = [network_images.image_path(str(tmp_path), identifier) for identifier in ("HLA-A/B", "HLA-A_B", "..", "../x")]
+    assert all(os.path.dirname(path) == str(tmp_path) for path in odd)
+    assert len(set(odd)) == len(odd)
+
+
+def test_render_networks_keeps_earlier_genes_and_counts_skipped(tmp_path, links_file, capsys):
+    pytest.importorskip("matplotlib")
+    network = string_network.load_network(links_file)
+    output_dir = tmp_path / "images"
+    get_network_image.render_networks(["P1", "P2/X"], network, str(output_dir), partners=2)
+    manifest = get_network_image.render_networks(["P1", "P3"], network, str(output_dir), partners=2)
+    out = capsys.readouterr().out.splitlines()[-1]
+
+    assert manifest["P1"]["status"] == "skipped"
+    assert out.startswith("1 networks drawn, 1 skipped, 0 not in the network")
+    with open(output_dir / get_network_image.manifest_name) as fh:
+        saved = json.load(fh)
+    assert set(saved) == {"P1", "P2/X", "P3"}
+    assert saved["P2/X"]["status"] == "failed"
+    assert sorted(os.listdir(output_dir)) == ["P1_network.png", "P3_network.png", get_network_image.manifest_name]
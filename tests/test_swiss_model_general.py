@@ -0,0 +1,58 @@
+import asyncio
+import json
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import swiss_model_general
+
+
+def make_handler(poll_status, poll_body):
+    class SwissModelHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_json(202, {"project_id": "p1"})
+
+        def do_GET(self):
+            self.send_json(poll_status, poll_body)
+
+        def log_message(self, *args):
+            pass
+
+    return SwissModelHandler
+
+
+@pytest.mark.parametrize("poll_status, poll_body", [(500, {}), (404, {"detail": "Not found"}), (200, {"models": []})])
+def test_failing_polls_give_up(serve, monkeypatch, tmp_path, poll_status, poll_body):
+    monkeypatch.setattr(swiss_model_general, "api_url", serve(make_handler(poll_status, poll_body)))
+    state = asyncio.run(swiss_model_general.run_homology_modeling(
+        {"target": ["SEQUENCE"]}, "ATOM", str(tmp_path / "state.json"), str(tmp_path), min_interval=0,
+        max_interval=0, max_poll_failures=3))
+    assert state["target"]["status"] == "POLL_FAILED"
+    assert state["target"]["project_id"] == "p1"
+
+
+def test_completed_without_models_is_failed(serve, monkeypatch, tmp_path):
+    monkeypatch.setattr(swiss_model_general, "api_url", serve(make_handler(200, {"status": "COMPLETED"})))
+    state = asyncio.run(swiss_model_general.run_homology_modeling(
+        {"first": ["SEQUENCE"], "second": ["SEQUENCE"]}, "ATOM", str(tmp_path / "state.json"), str(tmp_path),
+        min_interval=0, max_interval=0))
+    assert {name: entry["status"] for name, entry in state.items()} == {"first": "FAILED", "second": "FAILED"}
+    with open(tmp_path / "state.json") as f:
+        assert json.load(f)["first"]["error"] == "completed without models"
+
+
+def test_single_target_wrapper(serve, monkeypatch, tmp_path):
+    monkeypatch.setattr(swiss_model_general, "api_url", serve(make_handler(200, {"status": "FAILED"})))
+    original = swiss_model_general.run_homology_modeling
+    monkeypatch.setattr(swiss_model_general, "run_homology_modeling",
+                        lambda *args, **kwargs: original(*args, **dict(kwargs, min_interval=0)))
+    assert swiss_model_general.perform_user_template_homology_modeling(["SEQUENCE"], "ATOM", str(tmp_path))["status"] == "FAILED"